@@ -0,0 +1,234 @@
+"""
+Synthetic inputs for the offline benchmarks.
+
+Everything here is generated locally: ERA5-like NetCDF files, GRIB2
+surface fields on the ECMWF and GFS grids, a stub of the NMC station
+endpoint and a stand-in ONNX model with the Pangu input/output shapes.
+"""
+import json
+import struct
+import threading
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+import netCDF4 as nc
+
+import onnx
+from onnx import TensorProto, helper
+
+from pwv.grid import GRIDS, get_grid_axes
+
+SURFACE_SHAPE = (4, 721, 1440)
+UPPER_SHAPE = (5, 13, 721, 1440)
+# GRIB2 中 (参数类别, 参数编号, 离地高度)
+GRIB_PARAMETERS = {"2t": (0, 0, 2), "10u": (2, 2, 10), "10v": (2, 3, 10)}
+
+
+def make_field(shape, seed=0, mean=0.0, amplitude=1.0):
+    # 平滑的波动加上少量噪声，压缩和插值的表现接近真实场
+    rng = np.random.default_rng(seed)
+    lats = np.linspace(np.pi / 2, -np.pi / 2, shape[-2])[:, None]
+    lons = np.linspace(0, 2 * np.pi, shape[-1], endpoint=False)[None, :]
+    fields = np.empty(shape, dtype=np.float32)
+    for i in np.ndindex(*shape[:-2]):
+        phase = rng.uniform(0, 2 * np.pi)
+        fields[i] = mean + amplitude * np.cos(lats) * np.sin(3 * lons + phase)
+        fields[i] += rng.normal(0, 0.05 * amplitude, shape[-2:])
+
+    return fields
+
+
+def make_era5_netcdf(surface_fp, upper_fp, init_dt, seed=0):
+    """
+    ERA5-like single-time NetCDF files in the old CDS layout.
+    """
+    lons, lats = get_grid_axes("pangu")
+    hours = int((init_dt - datetime(1900, 1, 1, tzinfo=timezone.utc)).total_seconds() // 3600)
+
+    surface = {"msl": (101300, 1000), "u10": (0, 10), "v10": (0, 10), "t2m": (280, 20)}
+    upper = {
+        "z": (50000, 5000),
+        "q": (0.005, 0.004),
+        "t": (250, 20),
+        "u": (0, 20),
+        "v": (0, 20),
+    }
+    for fp, variables, nlevels in ((surface_fp, surface, None), (upper_fp, upper, 13)):
+        with nc.Dataset(fp, "w") as ds:
+            ds.createDimension("time", 1)
+            ds.createDimension("latitude", len(lats))
+            ds.createDimension("longitude", len(lons))
+            dims = ("time", "latitude", "longitude")
+            if nlevels:
+                ds.createDimension("level", nlevels)
+                ds.createVariable("level", "i4", ("level",))[:] = [
+                    50, 100, 150, 200, 250, 300, 400, 500, 600, 700, 850, 925, 1000
+                ]
+                dims = ("time", "level", "latitude", "longitude")
+            time_var = ds.createVariable("time", "i4", ("time",))
+            time_var.units = "hours since 1900-01-01 00:00:00.0"
+            time_var[:] = [hours]
+            ds.createVariable("latitude", "f4", ("latitude",))[:] = lats
+            ds.createVariable("longitude", "f4", ("longitude",))[:] = lons
+            for i, (varname, (mean, amplitude)) in enumerate(variables.items()):
+                shape = tuple(len(ds.dimensions[dim]) for dim in dims)
+                var = ds.createVariable(varname, "f4", dims)
+                var[:] = make_field(shape, seed + i, mean, amplitude)
+
+    return surface_fp, upper_fp
+
+
+def encode_signed(value, nbytes):
+    # GRIB 的有符号整数用最高位表示符号
+    magnitude = abs(int(value))
+    if value < 0:
+        magnitude |= 1 << (8 * nbytes - 1)
+
+    return magnitude.to_bytes(nbytes, "big")
+
+
+def encode_grib2_message(field, grid, parameter, ref_dt, step, decimal_scale=2):
+    """
+    One GRIB2 message of a regular lat/lon field with simple packing.
+    """
+    category, number, height = GRIB_PARAMETERS[parameter]
+    nlat, nlon = field.shape
+    npoints = nlat * nlon
+    lon0 = grid["lon0"] % 360
+    lon1 = (grid["lon0"] + grid["dlon"] * (nlon - 1)) % 360
+    lat1 = grid["lat0"] + grid["dlat"] * (nlat - 1)
+
+    scaled = np.round(field.astype(np.float64).ravel() * 10**decimal_scale)
+    reference = scaled.min()
+    packed = (scaled - reference).astype(np.int64)
+    nbits = max(int(packed.max()).bit_length(), 1)
+    bits = (packed[:, None] >> np.arange(nbits - 1, -1, -1)) & 1
+    data = np.packbits(bits.astype(np.uint8).ravel()).tobytes()
+
+    section1 = struct.pack(
+        ">IBHHBBBHBBBBBBB", 21, 1, 98, 0, 4, 0, 1,
+        ref_dt.year, ref_dt.month, ref_dt.day, ref_dt.hour, 0, 0, 0, 1,
+    )
+    section3 = (
+        struct.pack(">IBBIBBH", 72, 3, 0, npoints, 0, 0, 0)
+        + struct.pack(">BBIBIBI", 6, 0, 0, 0, 0, 0, 0)
+        + struct.pack(">IIII", nlon, nlat, 0, 0)
+        + encode_signed(grid["lat0"] * 1e6, 4)
+        + encode_signed(lon0 * 1e6, 4)
+        + struct.pack(">B", 48)
+        + encode_signed(lat1 * 1e6, 4)
+        + encode_signed(lon1 * 1e6, 4)
+        + struct.pack(">II", int(abs(grid["dlon"]) * 1e6), int(abs(grid["dlat"]) * 1e6))
+        + struct.pack(">B", 0)
+    )
+    section4 = struct.pack(
+        ">IBHHBBBBBHBBIBBIBBI", 34, 4, 0, 0,
+        category, number, 2, 0, 0, 0, 0, 1, step, 103, 0, height, 255, 255, 0xFFFFFFFF,
+    )
+    section5 = (
+        struct.pack(">IBIH", 21, 5, npoints, 0)
+        + struct.pack(">f", reference)
+        + encode_signed(0, 2)
+        + encode_signed(decimal_scale, 2)
+        + struct.pack(">BB", nbits, 0)
+    )
+    section6 = struct.pack(">IBB", 6, 6, 255)
+    section7 = struct.pack(">IB", 5 + len(data), 7) + data
+    body = section1 + section3 + section4 + section5 + section6 + section7 + b"7777"
+    section0 = b"GRIB" + struct.pack(">HBBQ", 0, 0, 2, 16 + len(body))
+
+    return section0 + body
+
+
+def make_grib2(fp, grid_name, ref_dt, step=0, seed=0):
+    """
+    GRIB2 file with the 2t, 10u and 10v fields on the named grid.
+    """
+    grid = GRIDS[grid_name]
+    shape = (grid["nlat"], grid["nlon"])
+    fields = {
+        "2t": make_field(shape, seed, 280, 20),
+        "10u": make_field(shape, seed + 1, 0, 10),
+        "10v": make_field(shape, seed + 2, 0, 10),
+    }
+    with open(fp, "wb") as f:
+        for parameter, field in fields.items():
+            f.write(encode_grib2_message(field, grid, parameter, ref_dt, step))
+
+    return fp
+
+
+def start_station_server(obs_dt):
+    """
+    Local stub of the NMC station endpoint answering every station with a
+    24-hour chart that holds ``obs_dt``.
+
+    Returns the running server and the URL pattern for ``prepare``.
+    """
+    # 观测时间以北京时间给出
+    local_dt = obs_dt.astimezone(timezone(timedelta(hours=8)))
+    chart = [
+        {
+            "time": (local_dt - timedelta(hours=hour)).strftime("%Y-%m-%d %H:%M"),
+            "windSpeed": 3.0,
+            "windDirection": 180.0,
+            "temperature": 25.0,
+            "humidity": 60.0,
+        }
+        for hour in range(24)
+    ]
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            sid = parse_qs(urlparse(self.path).query)["stationid"][0]
+            body = json.dumps({"data": {"station": sid, "passedchart": chart}}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url_pattern = f"http://127.0.0.1:{server.server_port}/rest/weather?stationid={{sid}}"
+
+    return server, url_pattern
+
+
+def make_onnx_model(
+    fp, step_mode, batch=None, surface_shape=SURFACE_SHAPE, upper_shape=UPPER_SHAPE
+):
+    """
+    Stand-in for ``pangu_weather_{step_mode}.onnx``: same input and output
+    names and shapes, adding a constant so the rollout cost is memory-bound.
+
+    ``batch`` adds a leading batch dimension, a fixed size or a name such as
+    ``"N"`` for a dynamic one.
+    """
+    prefix = [] if batch is None else [batch]
+    upper_shape = prefix + list(upper_shape)
+    surface_shape = prefix + list(surface_shape)
+    inputs = [
+        helper.make_tensor_value_info("input", TensorProto.FLOAT, upper_shape),
+        helper.make_tensor_value_info("input_surface", TensorProto.FLOAT, surface_shape),
+    ]
+    outputs = [
+        helper.make_tensor_value_info("output", TensorProto.FLOAT, upper_shape),
+        helper.make_tensor_value_info("output_surface", TensorProto.FLOAT, surface_shape),
+    ]
+    step = helper.make_tensor("step", TensorProto.FLOAT, [], [step_mode * 1e-3])
+    nodes = [
+        helper.make_node("Add", ["input", "step"], ["output"]),
+        helper.make_node("Add", ["input_surface", "step"], ["output_surface"]),
+    ]
+    graph = helper.make_graph(nodes, f"pangu_weather_{step_mode}", inputs, outputs, [step])
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid("", 13)])
+    model.ir_version = 8
+    onnx.save(model, fp)
+
+    return fp
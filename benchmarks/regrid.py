@@ -0,0 +1,58 @@
+"""
+Compare ``prepare.interpolate`` (scipy griddata) with ``grid.Regridder``.
+
+Usage: python -m benchmarks.regrid
+"""
+import time
+import tempfile
+
+import numpy as np
+
+from pwv.grid import Regridder, get_grid_axes
+from pwv.prepare import interpolate
+
+
+def make_ecmwf_fields(nfields=3, seed=0):
+    lons, lats = get_grid_axes("ecmwf")
+    grid_lons, grid_lats = np.meshgrid(lons, lats)
+    rng = np.random.default_rng(seed)
+    fields = []
+    for _ in range(nfields):
+        phase = rng.uniform(0, 2 * np.pi)
+        field = 280 + 20 * np.cos(np.deg2rad(grid_lats)) * np.sin(
+            np.deg2rad(grid_lons) + phase
+        )
+        fields.append(field + rng.normal(0, 0.5, field.shape))
+
+    return grid_lons, grid_lats, np.stack(fields)
+
+
+def main():
+    grid_lons, grid_lats, fields = make_ecmwf_fields()
+
+    t0 = time.perf_counter()
+    reference = np.stack(
+        [interpolate(grid_lons.copy(), grid_lats, field) for field in fields]
+    )
+    t1 = time.perf_counter()
+    print(f"griddata: {t1 - t0:.2f}s")
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        t0 = time.perf_counter()
+        regridder = Regridder.from_latlons(grid_lats, grid_lons, "pangu", cache_dir)
+        t1 = time.perf_counter()
+        print(f"Regridder stencil (cold): {t1 - t0:.2f}s")
+
+        t0 = time.perf_counter()
+        regridder = Regridder.from_latlons(grid_lats, grid_lons, "pangu", cache_dir)
+        result = regridder.regrid(fields)
+        t1 = time.perf_counter()
+        print(f"Regridder stencil (cached) + apply: {t1 - t0:.2f}s")
+
+    valid = ~np.isnan(reference)
+    print(f"max abs diff: {np.abs(result[valid] - reference[valid]).max():.3e}")
+    print(f"nan points in griddata output: {(~valid).sum()}")
+
+
+if __name__ == "__main__":
+    main()
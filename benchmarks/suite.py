@@ -0,0 +1,320 @@
+"""
+Offline benchmark of every pipeline stage on synthetic fixtures.
+
+Each stage is timed ``repeats`` times; the first call is reported on its own
+since it includes one-off work such as building and caching interpolation
+stencils or station indices. Results are written as JSON, tagged with the
+current commit, so two commits can be compared with ``--baseline``.
+
+Usage: python -m benchmarks.suite [--repeats 3] [--only rollout,...]
+       [--output results.json] [--baseline old.json]
+"""
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import tempfile
+import subprocess
+from datetime import datetime, timedelta, timezone
+from statistics import median
+
+import numpy as np
+
+from benchmarks import fixtures
+from pwv import models, prepare, verify
+from pwv.grid import load_station_idx
+from pwv.predict import SESSION_POOL, iteratively_predict
+from pwv.prepare import (
+    download_station_responses,
+    interpolate,
+    parse_station_responses,
+    transfer_ecmwf,
+    transfer_gfs,
+    transfer_surface,
+    transfer_upper,
+)
+from pwv.verify import extract_station_forecast_data, get_pangu_station_idx, sinlge_verify
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+INIT_DT = datetime(2023, 7, 11, 0, tzinfo=timezone.utc)
+OBS_DT = datetime(2023, 7, 16, 3, tzinfo=timezone.utc)
+
+
+def timeit(func, repeats):
+    seconds = []
+    for _ in range(max(repeats, 1)):
+        t0 = time.perf_counter()
+        func()
+        seconds.append(time.perf_counter() - t0)
+
+    rest = seconds[1:] or seconds
+
+    return {
+        "first": seconds[0],
+        "min": min(rest),
+        "median": median(rest),
+        "repeats": len(seconds),
+    }
+
+
+def get_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Fixtures:
+    """
+    Lazily generated synthetic inputs, shared by the stages of one run.
+    """
+
+    def __init__(self, workdir) -> None:
+        self.workdir = workdir
+        self.built = {}
+
+    def get(self, name):
+        if name not in self.built:
+            self.built[name] = getattr(self, f"make_{name}")()
+        return self.built[name]
+
+    def make_era5(self):
+        return fixtures.make_era5_netcdf(
+            os.path.join(self.workdir, "surface.nc"),
+            os.path.join(self.workdir, "upper.nc"),
+            INIT_DT,
+        )
+
+    def make_ecmwf_grib(self):
+        batch_dt = OBS_DT - timedelta(hours=15)
+        return fixtures.make_grib2(
+            os.path.join(self.workdir, "ecmwf.grib2"), "ecmwf", batch_dt, 15
+        )
+
+    def make_gfs_grib(self):
+        batch_dt = OBS_DT - timedelta(hours=3)
+        return fixtures.make_grib2(
+            os.path.join(self.workdir, "gfs.grib2"), "gfs", batch_dt, 3, seed=10
+        )
+
+    def make_pangu_surface(self):
+        fp = os.path.join(self.workdir, "pangu-surface.npy")
+        np.save(fp, fixtures.make_field(fixtures.SURFACE_SHAPE, 20, 280, 20))
+        return fp
+
+    def make_competitor_surfaces(self):
+        ec_fp = os.path.join(self.workdir, "surface-ecmwf.npy")
+        gfs_fp = os.path.join(self.workdir, "surface-gfs.npy")
+        np.save(ec_fp, fixtures.make_field((3, 721, 1440), 30, 280, 20))
+        np.save(gfs_fp, fixtures.make_field((3, 721, 1440), 40, 280, 20))
+        return ec_fp, gfs_fp
+
+    def make_observation(self):
+        station_idx = load_station_idx("pangu")
+        rng = np.random.default_rng(0)
+        obs_fp = os.path.join(self.workdir, "observation.csv")
+        with open(obs_fp, "w") as f:
+            f.write("sid,wind_speed,wind_direction,temperature\n")
+            for sid in station_idx[:, 0]:
+                f.write(
+                    f"{sid},{rng.uniform(0, 10):.1f},{rng.uniform(0, 360):.0f},"
+                    f"{rng.uniform(10, 35):.1f}\n"
+                )
+        return obs_fp
+
+    def make_models(self):
+        model_dir = os.path.join(self.workdir, "models")
+        os.makedirs(model_dir, exist_ok=True)
+        for step_mode in (1, 3, 6, 24):
+            fixtures.make_onnx_model(
+                os.path.join(model_dir, f"pangu_weather_{step_mode}.onnx"), step_mode
+            )
+        return model_dir
+
+
+def bench_transfer_surface(fx, repeats):
+    surface_fp, _ = fx.get("era5")
+    outfp = os.path.join(fx.workdir, "surface-input.npy")
+    return timeit(lambda: transfer_surface(surface_fp, outfp), repeats)
+
+
+def bench_transfer_upper(fx, repeats):
+    _, upper_fp = fx.get("era5")
+    outfp = os.path.join(fx.workdir, "upper-input.npy")
+    return timeit(lambda: transfer_upper(upper_fp, outfp), repeats)
+
+
+def bench_interpolate(fx, repeats):
+    # griddata 很慢，只测一个变量
+    import pygrib
+
+    with pygrib.open(fx.get("ecmwf_grib")) as messages:
+        data, lats, lons = messages.select(shortName="2t")[0].data()
+    return timeit(lambda: interpolate(lons.copy(), lats, data), min(repeats, 1))
+
+
+def bench_transfer_ecmwf(fx, repeats):
+    grib_fp = fx.get("ecmwf_grib")
+    savefp = os.path.join(fx.workdir, "ecmwf-out.npy")
+    return timeit(lambda: transfer_ecmwf(grib_fp, savefp=savefp), repeats)
+
+
+def bench_transfer_ecmwf_station(fx, repeats):
+    grib_fp = fx.get("ecmwf_grib")
+    savefp = os.path.join(fx.workdir, "ecmwf-station.npy")
+    return timeit(lambda: transfer_ecmwf(grib_fp, station_only=True, savefp=savefp), repeats)
+
+
+def bench_transfer_gfs(fx, repeats):
+    grib_fp = fx.get("gfs_grib")
+    savefp = os.path.join(fx.workdir, "gfs-out.npy")
+    return timeit(lambda: transfer_gfs(grib_fp, savefp=savefp), repeats)
+
+
+def bench_observation(fx, repeats):
+    sids = prepare.get_station_info()["区站号"].tolist()
+    server, url_pattern = fixtures.start_station_server(OBS_DT)
+    want_ts = int(OBS_DT.timestamp())
+
+    def run():
+        responses = download_station_responses(sids, url_pattern=url_pattern)
+        records, _, _ = parse_station_responses(sids, responses, want_ts)
+        assert len(records) == len(sids)
+
+    try:
+        return timeit(run, repeats)
+    finally:
+        server.shutdown()
+
+
+def bench_station_idx(fx, repeats):
+    # 第一次调用在临时目录中重建站点索引，之后读取缓存的索引
+    station_info_fp = os.path.join(fx.workdir, "station_info.csv")
+    with open(verify.STATION_INFO_FP, "rb") as src, open(station_info_fp, "wb") as dst:
+        dst.write(src.read())
+    station_info_fp_orig = verify.STATION_INFO_FP
+    verify.STATION_INFO_FP = station_info_fp
+    try:
+        return timeit(get_pangu_station_idx, repeats)
+    finally:
+        verify.STATION_INFO_FP = station_info_fp_orig
+
+
+def bench_extract_station_forecast_data(fx, repeats):
+    pangu_fp = fx.get("pangu_surface")
+    ec_fp, gfs_fp = fx.get("competitor_surfaces")
+    return timeit(lambda: extract_station_forecast_data(pangu_fp, ec_fp, gfs_fp), repeats)
+
+
+def bench_sinlge_verify(fx, repeats):
+    pangu_fp = fx.get("pangu_surface")
+    ec_fp, gfs_fp = fx.get("competitor_surfaces")
+    df = verify.compare_with_observation(pangu_fp, ec_fp, gfs_fp, fx.get("observation"))
+    return timeit(lambda: sinlge_verify(df, INIT_DT, OBS_DT, "pangu"), repeats)
+
+
+def bench_rollout(fx, repeats):
+    # 用形状相同的替身模型测量推理循环本身（加载、读写状态、调度）的开销
+    model_dir = fx.get("models")
+    rollout_dir = os.path.join(fx.workdir, "rollout")
+    os.makedirs(rollout_dir, exist_ok=True)
+    init_ts = int(INIT_DT.timestamp())
+    np.save(
+        os.path.join(rollout_dir, f"surface-{init_ts}.npy"),
+        np.zeros(fixtures.SURFACE_SHAPE, dtype=np.float32),
+    )
+    np.save(
+        os.path.join(rollout_dir, f"upper-{init_ts}.npy"),
+        np.zeros(fixtures.UPPER_SHAPE, dtype=np.float32),
+    )
+    target_ts = int(OBS_DT.timestamp())
+
+    static_dir = models.STATIC_DIR
+    models.STATIC_DIR = model_dir
+    try:
+        return timeit(
+            lambda: iteratively_predict(init_ts, target_ts, cache=None, workdir=rollout_dir),
+            repeats,
+        )
+    finally:
+        models.STATIC_DIR = static_dir
+        SESSION_POOL.clear()
+
+
+BENCHMARKS = {
+    "transfer_surface": bench_transfer_surface,
+    "transfer_upper": bench_transfer_upper,
+    "interpolate": bench_interpolate,
+    "transfer_ecmwf": bench_transfer_ecmwf,
+    "transfer_ecmwf_station": bench_transfer_ecmwf_station,
+    "transfer_gfs": bench_transfer_gfs,
+    "observation": bench_observation,
+    "get_pangu_station_idx": bench_station_idx,
+    "extract_station_forecast_data": bench_extract_station_forecast_data,
+    "sinlge_verify": bench_sinlge_verify,
+    "rollout": bench_rollout,
+}
+
+
+def run(names=None, repeats=3, workdir=None):
+    names = names or list(BENCHMARKS)
+    results = {}
+    with tempfile.TemporaryDirectory(dir=workdir) as tmpdir:
+        fx = Fixtures(tmpdir)
+        for name in names:
+            print(f"Benchmarking {name}...")
+            results[name] = BENCHMARKS[name](fx, repeats)
+            print(
+                f"{name}: first {results[name]['first']:.3f}s, "
+                f"median {results[name]['median']:.3f}s"
+            )
+
+    return {
+        "commit": get_commit(),
+        "created_at": datetime.now(tz=timezone.utc).isoformat(),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "results": results,
+    }
+
+
+def compare(report, baseline):
+    for name, result in report["results"].items():
+        if name not in baseline["results"]:
+            continue
+        ratio = result["median"] / baseline["results"][name]["median"]
+        print(f"{name}: {ratio:.2f}x of {baseline['commit']}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline benchmark of the pipeline stages")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--only", help="comma separated benchmark names")
+    parser.add_argument("--output", help="JSON file of the results")
+    parser.add_argument("--baseline", help="JSON results of an earlier run to compare with")
+    parser.add_argument("--workdir", help="directory for the synthetic fixtures")
+    args = parser.parse_args()
+
+    report = run(args.only.split(",") if args.only else None, args.repeats, args.workdir)
+
+    output = args.output
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        dtstr = datetime.now(tz=timezone.utc).strftime("%Y%m%d%H%M%S")
+        output = os.path.join(RESULTS_DIR, f"{dtstr}-{report['commit'] or 'unknown'}.json")
+    with open(output, "w") as f:
+        json.dump(report, f, indent=4)
+    print(f"Results saved to {output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(report, json.load(f))
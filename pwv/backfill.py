@@ -0,0 +1,277 @@
+import os
+import glob
+import json
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, timedelta, timezone
+
+import arrow
+import pandas as pd
+
+from pwv.cache import atomic_dump_json
+from pwv.context import RunContext
+from pwv.era5 import ARCHIVE_DIR as ERA5_ARCHIVE_DIR
+from pwv.era5 import ERA5, SURFACE_DATASET, UPPER_DATASET
+from pwv.plan import parse_leads
+from pwv.predict import predict_leads
+from pwv.prepare import load_era5_api_key, transfer_era5
+from pwv.verify import verify_lead_cases
+
+BACKFILL_DIR = "./results/backfill"
+CHECKPOINT_FN = "checkpoint.json"
+
+
+def get_init_dts(start_dt, end_dt, cadence_hours):
+    # 起止时间都包含在内
+    init_dts = []
+    init_dt = start_dt
+    while init_dt <= end_dt:
+        init_dts.append(init_dt)
+        init_dt += timedelta(hours=cadence_hours)
+
+    return init_dts
+
+
+def get_archived_observation(obs_dt, obs_dir):
+    # 与 prepare_observations 保存的文件同名
+    obs_fp = os.path.join(obs_dir, f"observation-{int(obs_dt.timestamp())}.csv")
+    if not os.path.exists(obs_fp):
+        return None, 0
+
+    return obs_fp, len(pd.read_csv(obs_fp, usecols=["sid"]))
+
+
+def get_archived_forecast(model, obs_dt, forecast_dir):
+    """
+    Latest archived ``model`` forecast valid at ``obs_dt``.
+
+    Forecasts are stored as ``{model}-{batch_timestamp}-{obs_timestamp}.npy``
+    holding either a ``(3, lat, lon)`` surface field or a ``(3, n_stations)``
+    station table, like the ``prepare_ecmwf``/``prepare_gfs`` outputs.
+
+    Returns ``(array_fp, batch_dt)``, ``(None, None)`` when not archived.
+    """
+    if not forecast_dir:
+        return None, None
+    pattern = os.path.join(forecast_dir, f"{model}-*-{int(obs_dt.timestamp())}.npy")
+    candidates = []
+    for array_fp in glob.glob(pattern):
+        batch_ts = os.path.basename(array_fp).split("-")[1]
+        if batch_ts.isdigit():
+            candidates.append((int(batch_ts), array_fp))
+    if not candidates:
+        return None, None
+
+    batch_ts, array_fp = max(candidates)
+
+    return array_fp, datetime.fromtimestamp(batch_ts, tz=timezone.utc)
+
+
+def run_case(init_dt, leads, era5_dir, obs_dir, forecast_dir=None, api_key=None):
+    """
+    Roll out and verify one init time.
+
+    Each case runs in its own ``RunContext`` directory, which is removed
+    afterwards. Leads without archived observations are
+    skipped, ECMWF and GFS are only verified where archived.
+
+    Returns the records of the ``verify_lead_cases`` table, ``None`` when no
+    lead has observations.
+    """
+    init_ts = int(init_dt.timestamp())
+    lead_cases = []
+    for lead in sorted(set(leads)):
+        obs_dt = init_dt + timedelta(hours=lead)
+        obs_fp, obs_count = get_archived_observation(obs_dt, obs_dir)
+        if obs_fp is None:
+            continue
+        ec_surface_fp, ecmwf_batch_dt = get_archived_forecast("ecmwf", obs_dt, forecast_dir)
+        gfs_surface_fp, gfs_batch_dt = get_archived_forecast("gfs", obs_dt, forecast_dir)
+        lead_cases.append(
+            {
+                "lead": lead,
+                "obs_dt": obs_dt,
+                "obs_fp": obs_fp,
+                "obs_count": obs_count,
+                "ec_surface_fp": ec_surface_fp,
+                "gfs_surface_fp": gfs_surface_fp,
+                "ecmwf_batch_dt": ecmwf_batch_dt,
+                "gfs_batch_dt": gfs_batch_dt,
+            }
+        )
+    if not lead_cases:
+        return None
+
+    with RunContext(prefix=f"backfill-{init_ts}-") as ctx:
+        era5 = ERA5(api_key, archive_dir=era5_dir)
+        transfer_era5(
+            era5.fetch_surface(init_dt), era5.fetch_upper(init_dt), init_dt, ctx.run_dir
+        )
+
+        obs_tss = [int(case["obs_dt"].timestamp()) for case in lead_cases]
+        predict_results = predict_leads(init_ts, obs_tss, ctx=ctx)
+        for case, obs_ts in zip(lead_cases, obs_tss):
+            case["pangu_surface_fp"] = predict_results[obs_ts]["surface_fp"]
+            case["forward_records"] = predict_results[obs_ts]["forward_records"]
+
+        df_leads = verify_lead_cases(init_dt, lead_cases)
+
+    df_leads.insert(0, "init_datetime", init_dt.isoformat())
+
+    return df_leads.reset_index().to_dict("records")
+
+
+def load_checkpoint(checkpoint_fp, config):
+    if not os.path.exists(checkpoint_fp):
+        return {"config": config, "cases": {}}
+
+    with open(checkpoint_fp) as f:
+        checkpoint = json.load(f)
+    if checkpoint["config"] != config:
+        raise ValueError(
+            f"{checkpoint_fp} belongs to another backfill {checkpoint['config']}, "
+            "use another output directory."
+        )
+
+    return checkpoint
+
+
+def backfill(
+    start_dt,
+    end_dt,
+    cadence_hours=24,
+    leads=(24,),
+    era5_dir=None,
+    obs_dir=None,
+    forecast_dir=None,
+    output_dir=BACKFILL_DIR,
+    workers=1,
+    api_key=None,
+):
+    """
+    Reforecast and verify every init time from ``start_dt`` to ``end_dt``.
+
+    Init times follow ``cadence_hours`` and each one is verified at
+    ``leads`` (hours) against the observations archived in ``obs_dir`` (see
+    ``prepare_observations``). ERA5 inputs are read from the archive in
+    ``era5_dir`` (see ``era5.ERA5Archive``) and, with an ``api_key`` (the
+    key or a function returning it, see ``era5.ERA5``), all missing init
+    times are retrieved into it in batched requests before the cases start;
+    ECMWF and GFS forecasts are verified where archived in ``forecast_dir``
+    (see ``get_archived_forecast``). Without an ``api_key`` the run is
+    offline.
+
+    Cases run on a pool of ``workers`` processes, each holding its own model
+    sessions, so mind the memory of one Pangu rollout per worker. The status
+    of every case is written to ``checkpoint.json`` in ``output_dir`` as
+    soon as it finishes, and the table of each finished case to
+    ``cases/{init_timestamp}.csv``; running again with the same arguments
+    skips finished cases, so a killed job resumes where it stopped.
+
+    Returns the table of all finished cases, also saved as
+    ``backfill-results.csv``.
+    """
+    era5_dir = era5_dir or ERA5_ARCHIVE_DIR
+    obs_dir = obs_dir or os.path.join(output_dir, "observation")
+    cases_dir = os.path.join(output_dir, "cases")
+    os.makedirs(cases_dir, exist_ok=True)
+
+    config = {
+        "start": start_dt.isoformat(),
+        "end": end_dt.isoformat(),
+        "cadence_hours": cadence_hours,
+        "leads": sorted(set(int(lead) for lead in leads)),
+    }
+    checkpoint_fp = os.path.join(output_dir, CHECKPOINT_FN)
+    checkpoint = load_checkpoint(checkpoint_fp, config)
+
+    init_dts = get_init_dts(start_dt, end_dt, cadence_hours)
+    pending = [
+        init_dt
+        for init_dt in init_dts
+        if checkpoint["cases"].get(init_dt.isoformat(), {}).get("status") != "done"
+    ]
+    print(f"{len(init_dts) - len(pending)} of {len(init_dts)} cases already done.")
+
+    if api_key and pending:
+        # 一次性批量下载所有个例的 ERA5 数据，比每个个例单独排队快得多
+        era5 = ERA5(api_key, archive_dir=era5_dir)
+        for dataset in (SURFACE_DATASET, UPPER_DATASET):
+            try:
+                era5.retrieve(dataset, pending)
+            except Exception as e:
+                print(f"Failed to retrieve {dataset} in batch: {e!r}")
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(
+                run_case, init_dt, config["leads"], era5_dir, obs_dir, forecast_dir, api_key
+            ): init_dt
+            for init_dt in pending
+        }
+        for future in as_completed(futures):
+            init_dt = futures[future]
+            try:
+                records = future.result()
+            except Exception as e:
+                status = {"status": "failed", "error": repr(e)}
+            else:
+                if records is None:
+                    status = {"status": "skipped", "error": "no observations"}
+                else:
+                    case_fp = os.path.join(cases_dir, f"{int(init_dt.timestamp())}.csv")
+                    pd.DataFrame(records).to_csv(case_fp, index=False)
+                    status = {"status": "done", "case_fp": case_fp}
+            print(f"Case {init_dt.isoformat()}: {status['status']}")
+            checkpoint["cases"][init_dt.isoformat()] = status
+            atomic_dump_json(checkpoint_fp, checkpoint)
+
+    case_fps = [
+        status["case_fp"]
+        for status in checkpoint["cases"].values()
+        if status["status"] == "done"
+    ]
+    if not case_fps:
+        print("No case has been verified.")
+        return None
+
+    df = pd.concat(
+        [pd.read_csv(fp, dtype={"forward_records": str}) for fp in sorted(case_fps)],
+        ignore_index=True,
+    )
+    df.to_csv(os.path.join(output_dir, "backfill-results.csv"), index=False)
+    print("All done.")
+
+    return df
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Reforecast and verify a date range")
+    parser.add_argument("start", help="first init time in UTC, e.g. 2023-07-01T00")
+    parser.add_argument("end", help="last init time in UTC")
+    parser.add_argument("--cadence", type=int, default=24, help="hours between init times")
+    parser.add_argument(
+        "--leads", type=parse_leads, default=[24], help="comma separated leads in hours"
+    )
+    parser.add_argument("--era5-dir")
+    parser.add_argument("--obs-dir")
+    parser.add_argument("--forecast-dir")
+    parser.add_argument("--output-dir", default=BACKFILL_DIR)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument(
+        "--offline", action="store_true", help="never retrieve missing ERA5 data from CDS"
+    )
+    args = parser.parse_args()
+
+    backfill(
+        arrow.get(args.start).to("utc").datetime,
+        arrow.get(args.end).to("utc").datetime,
+        cadence_hours=args.cadence,
+        leads=args.leads,
+        era5_dir=args.era5_dir,
+        obs_dir=args.obs_dir,
+        forecast_dir=args.forecast_dir,
+        output_dir=args.output_dir,
+        workers=args.workers,
+        api_key=None if args.offline else load_era5_api_key,
+    )
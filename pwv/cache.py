@@ -0,0 +1,264 @@
+import os
+import json
+import time
+import hashlib
+import tempfile
+
+import numpy as np
+
+from pwv.models import get_model_fp
+
+# 缓存目录不在 TMP_DIR 内，每次运行结束清理 TMP_DIR 时不会被删除
+CACHE_DIR = os.environ.get(
+    "PWV_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache")
+)
+CACHE_MAX_BYTES = int(os.environ.get("PWV_CACHE_MAX_BYTES", 20 * 1024**3))
+MODEL_HASHES_FN = "model-hashes.json"
+
+
+def get_umask():
+    # umask 只能在设置的同时读取，在导入时（还没有其他线程）读取一次
+    umask = os.umask(0)
+    os.umask(umask)
+
+    return umask
+
+
+# 新文件的权限与直接 open 创建的文件一致，而不是 mkstemp 的 0600
+FILE_MODE = 0o666 & ~get_umask()
+
+
+def atomic_write(fp, write, mode="wb"):
+    """
+    Write ``fp`` atomically: ``write`` is called with a temporary file of the
+    same directory, which then replaces ``fp``, so an interrupted write never
+    leaves a partial file. The file gets the usual permissions of a new file
+    under the umask, so a shared cache stays readable by other users.
+    """
+    fd, tmp_fp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(fp)), suffix=".tmp")
+    try:
+        with os.fdopen(fd, mode) as f:
+            write(f)
+        os.chmod(tmp_fp, FILE_MODE)
+        os.replace(tmp_fp, fp)
+    except BaseException:
+        if os.path.exists(tmp_fp):
+            os.remove(tmp_fp)
+        raise
+
+
+def atomic_save(fp, array):
+    atomic_write(fp, lambda f: np.save(f, array))
+
+
+def atomic_dump_json(fp, obj):
+    atomic_write(fp, lambda f: json.dump(obj, f), mode="w")
+
+
+def validate_state(surface_fp, upper_fp, surface_shape=None, upper_shape=None):
+    """
+    Check that a pair of state files is complete and readable.
+
+    Only the ``.npy`` headers are parsed and the arrays are memory-mapped, so
+    a truncated or foreign file is rejected without reading it into memory.
+    """
+    try:
+        surface_array = np.load(surface_fp, mmap_mode="r")
+        upper_array = np.load(upper_fp, mmap_mode="r")
+    except (OSError, ValueError):
+        return False
+    if surface_array.dtype != np.float32 or upper_array.dtype != np.float32:
+        return False
+    if surface_shape is not None and surface_array.shape != tuple(surface_shape):
+        return False
+    if upper_shape is not None and upper_array.shape != tuple(upper_shape):
+        return False
+
+    return True
+
+
+def get_file_signature(fp):
+    stat = os.stat(fp)
+
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def hash_file(fp, chunk_size=16 * 1024 * 1024):
+    sha = hashlib.sha256()
+    with open(fp, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            sha.update(chunk)
+
+    return sha.hexdigest()
+
+
+class StateCache:
+    """
+    Persistent on-disk cache of forecast states.
+
+    An entry is keyed by the init timestamp, the lead, the step path that
+    produced it and the content hash of every model on that path. Each entry
+    is stored as ``{key}.surface.npy``, ``{key}.upper.npy`` and ``{key}.json``;
+    all files are written atomically and the metadata file is written last, so
+    an entry without valid metadata is never served. The metadata records the
+    size and modification time of both state files, and an entry whose files
+    were changed since, e.g. rewritten through a hard link, is discarded. Entries are evicted in
+    least-recently-used order once the cache grows beyond ``max_bytes``.
+    """
+
+    def __init__(self, cache_dir=CACHE_DIR, max_bytes=CACHE_MAX_BYTES) -> None:
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.model_hashes = {}
+
+    def get_model_hash(self, step_mode, variant=None):
+        modelfp = get_model_fp(step_mode, variant)
+        stat = os.stat(modelfp)
+        signature = [stat.st_size, stat.st_mtime_ns]
+        if modelfp in self.model_hashes:
+            if self.model_hashes[modelfp][0] == signature:
+                return self.model_hashes[modelfp][1]
+
+        # 模型文件很大，按文件大小和修改时间把哈希结果持久化，避免每次进程启动都重新计算
+        hashes_fp = os.path.join(self.cache_dir, MODEL_HASHES_FN)
+        known = {}
+        if os.path.exists(hashes_fp):
+            with open(hashes_fp) as f:
+                known = json.load(f)
+        record = known.get(os.path.basename(modelfp))
+        if record and record["signature"] == signature:
+            digest = record["sha256"]
+        else:
+            print(f"Hashing model {os.path.basename(modelfp)}...")
+            digest = hash_file(modelfp)
+            known[os.path.basename(modelfp)] = {"signature": signature, "sha256": digest}
+            os.makedirs(self.cache_dir, exist_ok=True)
+            atomic_dump_json(hashes_fp, known)
+
+        self.model_hashes[modelfp] = (signature, digest)
+
+        return digest
+
+    def make_key(self, init_timestamp, path, variant=None):
+        identity = {
+            "init_timestamp": int(init_timestamp),
+            "lead": int(sum(path)),
+            "path": [int(step) for step in path],
+            "models": [self.get_model_hash(step, variant) for step in path],
+        }
+        encoded = json.dumps(identity, sort_keys=True).encode("utf8")
+
+        return hashlib.sha256(encoded).hexdigest()
+
+    def entry_fps(self, key):
+        prefix = os.path.join(self.cache_dir, key)
+
+        return f"{prefix}.surface.npy", f"{prefix}.upper.npy", f"{prefix}.json"
+
+    def get(self, init_timestamp, path, variant=None):
+        key = self.make_key(init_timestamp, path, variant)
+        surface_fp, upper_fp, meta_fp = self.entry_fps(key)
+        if not os.path.exists(meta_fp):
+            return None
+
+        try:
+            with open(meta_fp) as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            meta = None
+        if (
+            not meta
+            or meta.get("key") != key
+            or not validate_state(
+                surface_fp, upper_fp, meta["surface_shape"], meta["upper_shape"]
+            )
+            or not self.check_signatures(meta, surface_fp, upper_fp)
+        ):
+            print(f"Discarding invalid cache entry {key}")
+            self.remove(key)
+            return None
+
+        # 用元数据文件的修改时间记录最近访问时间，条目可能刚被其他进程淘汰
+        try:
+            os.utime(meta_fp)
+        except FileNotFoundError:
+            return None
+
+        return surface_fp, upper_fp
+
+    def check_signatures(self, meta, surface_fp, upper_fp):
+        # 文件被原地改写后大小或修改时间会变化，这样的条目不再可信
+        try:
+            signatures = [get_file_signature(surface_fp), get_file_signature(upper_fp)]
+        except FileNotFoundError:
+            return False
+
+        return meta.get("signatures") == signatures
+
+    def put(self, init_timestamp, path, surface_array, upper_array, variant=None):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        key = self.make_key(init_timestamp, path, variant)
+        surface_fp, upper_fp, meta_fp = self.entry_fps(key)
+        surface_array = np.asarray(surface_array, dtype=np.float32)
+        upper_array = np.asarray(upper_array, dtype=np.float32)
+        self.evict(reserve=surface_array.nbytes + upper_array.nbytes)
+
+        atomic_save(surface_fp, surface_array)
+        atomic_save(upper_fp, upper_array)
+        atomic_dump_json(
+            meta_fp,
+            {
+                "key": key,
+                "init_timestamp": int(init_timestamp),
+                "lead": int(sum(path)),
+                "path": [int(step) for step in path],
+                "surface_shape": list(surface_array.shape),
+                "upper_shape": list(upper_array.shape),
+                "signatures": [
+                    get_file_signature(surface_fp),
+                    get_file_signature(upper_fp),
+                ],
+                "created_at": time.time(),
+            },
+        )
+
+        return surface_fp, upper_fp
+
+    def remove(self, key):
+        for fp in self.entry_fps(key):
+            try:
+                os.remove(fp)
+            except FileNotFoundError:
+                pass
+
+    def entries(self):
+        if not os.path.isdir(self.cache_dir):
+            return []
+
+        entries = []
+        for fn in os.listdir(self.cache_dir):
+            if not fn.endswith(".json") or fn == MODEL_HASHES_FN:
+                continue
+            key = fn[: -len(".json")]
+            fps = self.entry_fps(key)
+            # 多个进程共用缓存目录时，条目可能在遍历过程中被淘汰
+            try:
+                size = sum(os.path.getsize(fp) for fp in fps if os.path.exists(fp))
+                entries.append((os.path.getmtime(fps[2]), key, size))
+            except FileNotFoundError:
+                continue
+
+        return sorted(entries)
+
+    def evict(self, reserve=0):
+        entries = self.entries()
+        total = sum(size for _, _, size in entries)
+        for _, key, size in entries:
+            if total + reserve <= self.max_bytes:
+                break
+            print(f"Evicting cache entry {key}")
+            self.remove(key)
+            total -= size
+
+
+STATE_CACHE = StateCache()
@@ -0,0 +1,50 @@
+import os
+import shutil
+import tempfile
+
+from pwv.cache import CACHE_DIR, STATE_CACHE, StateCache
+
+TMP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tmp")
+
+
+class RunContext:
+    """
+    Working directories of one run.
+
+    ``run_dir`` is private to the run: every downloaded, converted and
+    predicted file of the run is written there under a fixed name, so runs
+    with their own context never see each other's files. Without a
+    ``run_dir``, a fresh directory named ``{prefix}*`` is created under
+    ``TMP_DIR``. ``cleanup``, also called when leaving a ``with`` block,
+    removes it.
+
+    ``cache_dir`` is shared by all runs and never cleaned up by them: it
+    holds the state cache (``cache``) and the cached interpolation stencils,
+    all written atomically, so any number of processes can use it at once.
+    """
+
+    def __init__(self, run_dir=None, cache_dir=CACHE_DIR, prefix="run-") -> None:
+        if run_dir is None:
+            os.makedirs(TMP_DIR, exist_ok=True)
+            run_dir = tempfile.mkdtemp(prefix=prefix, dir=TMP_DIR)
+        self.run_dir = run_dir
+        self.cache_dir = cache_dir
+        self.cache = STATE_CACHE if cache_dir == STATE_CACHE.cache_dir else StateCache(cache_dir)
+
+    def path(self, fn):
+        os.makedirs(self.run_dir, exist_ok=True)
+
+        return os.path.join(self.run_dir, fn)
+
+    def cleanup(self):
+        shutil.rmtree(self.run_dir, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.cleanup()
+
+
+# 不指定运行上下文时，所有文件仍然写在共用的 TMP_DIR 中
+DEFAULT_CONTEXT = RunContext(TMP_DIR)
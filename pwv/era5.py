@@ -1,15 +1,164 @@
 import os
+import json
+import fcntl
+import hashlib
+from collections import defaultdict
+from datetime import timezone
 
 import cdsapi
 import arrow
+import netCDF4 as nc
+
+from pwv.cache import FILE_MODE, atomic_dump_json
+from pwv.trace import TRACER, get_host
 
 URL = "https://cds.climate.copernicus.eu/api/v2"
+# 下载的 ERA5 数据按数据集归档，之后相同时次的请求直接从归档读取
+ARCHIVE_DIR = os.environ.get(
+    "PWV_ERA5_ARCHIVE_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "archive", "era5"),
+)
+INDEX_FN = "index.json"
+
+SURFACE_DATASET = "reanalysis-era5-single-levels"
+UPPER_DATASET = "reanalysis-era5-pressure-levels"
+PRESSURE_LEVELS = [50, 100, 150, 200, 250, 300, 400, 500, 600, 700, 850, 925, 1000]
+# 请求中的变量名与 NetCDF 文件中的变量名
+VARIABLES = {
+    SURFACE_DATASET: {
+        "10m_u_component_of_wind": "u10",
+        "10m_v_component_of_wind": "v10",
+        "2m_temperature": "t2m",
+        "mean_sea_level_pressure": "msl",
+    },
+    UPPER_DATASET: {
+        "geopotential": "z",
+        "specific_humidity": "q",
+        "temperature": "t",
+        "u_component_of_wind": "u",
+        "v_component_of_wind": "v",
+    },
+}
+LEVELS = {SURFACE_DATASET: [None], UPPER_DATASET: PRESSURE_LEVELS}
+
+
+def read_netcdf_coords(fp):
+    # 新旧两版 CDS 输出的时间和层次坐标名称不同
+    with nc.Dataset(fp) as ds:
+        time_name = "valid_time" if "valid_time" in ds.variables else "time"
+        time_var = ds.variables[time_name]
+        times = nc.num2date(
+            time_var[:],
+            time_var.units,
+            only_use_cftime_datetimes=False,
+            only_use_python_datetimes=True,
+        )
+        times = [arrow.get(dt.replace(tzinfo=timezone.utc)).isoformat() for dt in times]
+        levels = [None]
+        for level_name in ("pressure_level", "level"):
+            if level_name in ds.variables:
+                levels = [int(level) for level in ds.variables[level_name][:]]
+                break
+        variables = [name for name in ds.variables if name not in ds.dimensions]
+
+    return times, levels, variables
+
+
+class ERA5Archive:
+    """
+    Local archive of retrieved ERA5 NetCDF files.
+
+    Files are kept as retrieved, possibly holding many times each, and
+    ``index.json`` records the times, levels and variables of every file, so
+    any ``(dataset, variable, level, time)`` can be located without opening
+    the files. A located time is then read as a single slice of its file.
+    """
+
+    def __init__(self, archive_dir=ARCHIVE_DIR) -> None:
+        self.archive_dir = archive_dir
+        self.index_fp = os.path.join(archive_dir, INDEX_FN)
+        self.lookup = None
+
+    def load_index(self):
+        if not os.path.exists(self.index_fp):
+            return {}
+        with open(self.index_fp) as f:
+            return json.load(f)
+
+    def build_lookup(self):
+        lookup = {}
+        for dataset, files in self.load_index().items():
+            for fn, meta in files.items():
+                for time_index, time in enumerate(meta["times"]):
+                    for variable in meta["variables"]:
+                        for level in meta["levels"]:
+                            lookup[(dataset, variable, level, time)] = (fn, time_index)
+        self.lookup = lookup
+
+    def add(self, dataset, fp):
+        times, levels, variables = read_netcdf_coords(fp)
+        # 多个进程可能同时更新索引，读改写期间加锁以免丢失其他进程的记录
+        with open(f"{self.index_fp}.lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            index = self.load_index()
+            index.setdefault(dataset, {})[os.path.basename(fp)] = {
+                "times": times,
+                "levels": levels,
+                "variables": variables,
+            }
+            atomic_dump_json(self.index_fp, index)
+        self.lookup = None
+
+    def locate(self, dataset, dt):
+        """
+        File and time index holding every variable and level of ``dataset``
+        at ``dt``, ``None`` when the archive does not cover it.
+        """
+        if self.lookup is None:
+            self.build_lookup()
+        time = arrow.get(dt).to("utc").isoformat()
+        keys = [
+            (dataset, variable, level, time)
+            for variable in VARIABLES[dataset].values()
+            for level in LEVELS[dataset]
+        ]
+        locations = {self.lookup.get(key) for key in keys}
+        if len(locations) != 1 or None in locations:
+            return None
+
+        fn, time_index = locations.pop()
+
+        return os.path.join(self.archive_dir, dataset, fn), time_index
+
+    def get_missing(self, dataset, dts):
+        return [dt for dt in dts if self.locate(dataset, dt) is None]
 
 
 class ERA5:
-    def __init__(self, api_key) -> None:
+    """
+    ERA5 client serving single times from the local archive.
+
+    Missing times are retrieved from CDS in as few requests as possible,
+    one per dataset and month holding every requested day and hour, and
+    added to the archive. ``client`` replaces the CDS client, e.g. with an
+    offline fake exposing the same ``retrieve(name, request, target)``;
+    without an ``api_key`` or a ``client`` only the archive is used.
+    ``api_key`` may also be a function returning the key, called only once
+    a time is missing from the archive.
+    """
+
+    def __init__(self, api_key=None, client=None, archive_dir=ARCHIVE_DIR) -> None:
         self.api_key = api_key
-        self.client = cdsapi.Client(key=self.api_key, url=URL)
+        self.client = client
+        self.archive = ERA5Archive(archive_dir)
+
+    def get_client(self):
+        # 归档缺少数据时才创建 CDS 客户端（并读取 API Key）
+        if self.client is None and self.api_key:
+            api_key = self.api_key() if callable(self.api_key) else self.api_key
+            self.client = cdsapi.Client(key=api_key, url=URL)
+
+        return self.client
 
     def get_latest_datetime_of_cds(self):
         nowhour = arrow.now(tz="utc").floor("hour")
@@ -17,79 +166,93 @@ class ERA5:
 
         return latest_cds_hour
 
-    def fetch_latest_surface(self, savepath="."):
-        latest_cds_hour = self.get_latest_datetime_of_cds()
-        year = latest_cds_hour.year
-        month = latest_cds_hour.month
-        day = latest_cds_hour.day
-        hour = latest_cds_hour.hour
-
-        savefp = os.path.join(savepath, latest_cds_hour.strftime("surface_%Y%m%d%H.nc"))
-        self.client.retrieve(
-            "reanalysis-era5-single-levels",
-            {
+    def make_requests(self, dataset, dts):
+        groups = defaultdict(list)
+        for dt in dts:
+            dt = arrow.get(dt).to("utc")
+            groups[(dt.year, dt.month)].append(dt)
+
+        requests = []
+        for (year, month), group in sorted(groups.items()):
+            request = {
                 "product_type": "reanalysis",
                 "format": "netcdf",
-                "variable": [
-                    "10m_u_component_of_wind",
-                    "10m_v_component_of_wind",
-                    "2m_temperature",
-                    "mean_sea_level_pressure",
-                ],
+                "variable": list(VARIABLES[dataset]),
                 "year": f"{year}",
                 "month": f"{month:02}",
-                "day": f"{day:02}",
-                "time": f"{hour:02}:00",
-            },
-            savefp,
-        )
+                "day": sorted({f"{dt.day:02}" for dt in group}),
+                "time": sorted({f"{dt.hour:02}:00" for dt in group}),
+            }
+            if dataset == UPPER_DATASET:
+                request["pressure_level"] = [str(level) for level in PRESSURE_LEVELS]
+            requests.append(request)
+
+        return requests
+
+    def retrieve(self, dataset, dts):
+        """
+        Make sure every time of ``dts`` is archived, retrieving the missing
+        ones in batched requests.
+        """
+        missing = self.archive.get_missing(dataset, dts)
+        if not missing:
+            return
+        client = self.get_client()
+        if client is None:
+            raise FileNotFoundError(
+                f"{len(missing)} times of {dataset} are not archived, "
+                f"the first one is {arrow.get(missing[0]).isoformat()}"
+            )
+
+        dataset_dir = os.path.join(self.archive.archive_dir, dataset)
+        os.makedirs(dataset_dir, exist_ok=True)
+        for request in self.make_requests(dataset, missing):
+            digest = hashlib.sha256(
+                json.dumps(request, sort_keys=True).encode("utf8")
+            ).hexdigest()[:16]
+            savefp = os.path.join(
+                dataset_dir, f"{request['year']}{request['month']}-{digest}.nc"
+            )
+            print(
+                f"Retrieving {dataset} of {len(request['day'])} days "
+                f"and {len(request['time'])} hours in {request['year']}-{request['month']}..."
+            )
+            tmp_fp = f"{savefp}.{os.getpid()}.tmp"
+            # 包括在 CDS 队列中等待的时间
+            with TRACER.span("cds_retrieve", dataset=dataset, month=request["month"]):
+                client.retrieve(dataset, request, tmp_fp)
+            TRACER.count("http_requests_total", host=get_host(URL))
+            TRACER.count("download_bytes_total", os.path.getsize(tmp_fp), host=get_host(URL))
+            os.chmod(tmp_fp, FILE_MODE)
+            os.replace(tmp_fp, savefp)
+            self.archive.add(dataset, savefp)
+
+        missing = self.archive.get_missing(dataset, missing)
+        if missing:
+            raise ValueError(
+                f"Retrieved {dataset} data does not cover {arrow.get(missing[0]).isoformat()}"
+            )
+
+    def fetch_surface(self, dt):
+        # 返回归档文件路径及该时次在文件中的序号
+        self.retrieve(SURFACE_DATASET, [dt])
+
+        return self.archive.locate(SURFACE_DATASET, dt)
 
-        return savefp, latest_cds_hour
+    def fetch_upper(self, dt):
+        self.retrieve(UPPER_DATASET, [dt])
 
-    def fetch_latest_upper(self, savepath="."):
+        return self.archive.locate(UPPER_DATASET, dt)
+
+    def fetch_latest_surface(self):
+        latest_cds_hour = self.get_latest_datetime_of_cds()
+
+        return self.fetch_surface(latest_cds_hour), latest_cds_hour
+
+    def fetch_latest_upper(self):
         latest_cds_hour = self.get_latest_datetime_of_cds()
-        year = latest_cds_hour.year
-        month = latest_cds_hour.month
-        day = latest_cds_hour.day
-        hour = latest_cds_hour.hour
-
-        savefp = os.path.join(savepath, latest_cds_hour.strftime("upper_%Y%m%d%H.nc"))
-        self.client.retrieve(
-            "reanalysis-era5-pressure-levels",
-            {
-                "product_type": "reanalysis",
-                "format": "netcdf",
-                "pressure_level": [
-                    "50",
-                    "100",
-                    "150",
-                    "200",
-                    "250",
-                    "300",
-                    "400",
-                    "500",
-                    "600",
-                    "700",
-                    "850",
-                    "925",
-                    "1000",
-                ],
-                "variable": [
-                    "geopotential",
-                    "specific_humidity",
-                    "temperature",
-                    "u_component_of_wind",
-                    "v_component_of_wind",
-                ],
-                "year": f"{year}",
-                "month": f"{month:02}",
-                "day": f"{day:02}",
-                "time": f"{hour:02}:00",
-            },
-            savefp,
-        )
 
-        return savefp, latest_cds_hour
+        return self.fetch_upper(latest_cds_hour), latest_cds_hour
 
 
 if __name__ == "__main__":
@@ -0,0 +1,225 @@
+import os
+import glob
+import json
+import hashlib
+
+import numpy as np
+import pandas as pd
+
+from pwv.cache import CACHE_DIR, atomic_save, atomic_write
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+STATION_INFO_FP = os.path.join(STATIC_DIR, "station_info.csv")
+
+# 规则经纬度网格的定义，纬度均自北向南排列
+GRIDS = {
+    # 盘古的输入输出网格，与 ERA5 一致
+    "pangu": {"lon0": 0.0, "dlon": 0.25, "nlon": 1440, "lat0": 90.0, "dlat": -0.25, "nlat": 721},
+    # ECMWF 开放数据的原始网格，经度范围为 -180 ~ 179.75
+    "ecmwf": {"lon0": -180.0, "dlon": 0.25, "nlon": 1440, "lat0": 90.0, "dlat": -0.25, "nlat": 721},
+    "gfs": {"lon0": 0.0, "dlon": 0.25, "nlon": 1440, "lat0": 90.0, "dlat": -0.25, "nlat": 721},
+}
+
+
+def get_grid_axes(grid):
+    if isinstance(grid, str):
+        grid = GRIDS[grid]
+    lons = grid["lon0"] + grid["dlon"] * np.arange(grid["nlon"])
+    lats = grid["lat0"] + grid["dlat"] * np.arange(grid["nlat"])
+
+    return lons, lats
+
+
+def get_station_table_hash(station_info_fp=STATION_INFO_FP):
+    with open(station_info_fp, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()[:16]
+
+
+def build_station_idx(station_lons, station_lats, grid):
+    """
+    Nearest grid point of every station, computed in one vectorized pass.
+
+    Station longitudes may use either the 0~360 or the -180~180 convention,
+    distances along longitude wrap around the globe. Ties resolve to the
+    first grid point, like ``np.argmin``.
+
+    Returns an int32 array of shape ``(n_stations, 2)`` holding ``(iy, ix)``.
+    """
+    lons, lats = get_grid_axes(grid)
+    station_lons = np.asarray(station_lons, dtype=np.float64)
+    station_lats = np.asarray(station_lats, dtype=np.float64)
+
+    dlon = np.abs(station_lons[:, None] % 360 - lons[None, :] % 360)
+    dlon = np.minimum(dlon, 360 - dlon)
+    ix = dlon.argmin(axis=1)
+    iy = np.abs(station_lats[:, None] - lats[None, :]).argmin(axis=1)
+
+    return np.stack([iy, ix], axis=1).astype(np.int32)
+
+
+def load_station_idx(grid="pangu", station_info_fp=STATION_INFO_FP):
+    """
+    Station ids and nearest grid indices for a named grid.
+
+    The table is stored next to the station list as
+    ``station_idx-{grid}-{hash}.npy``, an int32 array of ``(sid, iy, ix)``
+    rows. ``hash`` is taken from the station list, so editing the list
+    invalidates the table and it is rebuilt on the next call.
+    """
+    station_dir = os.path.dirname(station_info_fp)
+    table_hash = get_station_table_hash(station_info_fp)
+    idx_fp = os.path.join(station_dir, f"station_idx-{grid}-{table_hash}.npy")
+    if os.path.exists(idx_fp):
+        return np.load(idx_fp)
+
+    station_df = pd.read_csv(station_info_fp)
+    idx = build_station_idx(station_df["经度"].values, station_df["纬度"].values, grid)
+    sids = station_df["区站号"].values.astype(np.int32)
+    station_idx = np.column_stack([sids, idx]).astype(np.int32)
+
+    for stale_fp in glob.glob(os.path.join(station_dir, f"station_idx-{grid}-*.npy")):
+        os.remove(stale_fp)
+    atomic_save(idx_fp, station_idx)
+
+    return station_idx
+
+
+def infer_grid(lats, lons):
+    # 从 GRIB 消息给出的二维经纬度推断规则网格的定义
+    return {
+        "lon0": float(lons[0, 0]),
+        "dlon": float(lons[0, 1] - lons[0, 0]),
+        "nlon": int(lons.shape[1]),
+        "lat0": float(lats[0, 0]),
+        "dlat": float(lats[1, 0] - lats[0, 0]),
+        "nlat": int(lats.shape[0]),
+    }
+
+
+def build_bilinear_stencil(src_grid, lons, lats):
+    """
+    Bilinear interpolation stencil from a regular global grid to target points.
+
+    Longitudes wrap around the globe and latitudes are clamped to the source
+    range. Returns ``(idx, weights)``, both of shape ``(n_points, 4)``, where
+    ``idx`` holds flat indices into a ``(nlat, nlon)`` source field.
+    """
+    if isinstance(src_grid, str):
+        src_grid = GRIDS[src_grid]
+    nlon, nlat = src_grid["nlon"], src_grid["nlat"]
+    lons = np.asarray(lons, dtype=np.float64).ravel()
+    lats = np.asarray(lats, dtype=np.float64).ravel()
+
+    # 舍入消除浮点误差，使落在格点上的目标点权重恰好为 1
+    fx = np.round(((lons - src_grid["lon0"]) % 360) / src_grid["dlon"], 9)
+    fy = np.round((lats - src_grid["lat0"]) / src_grid["dlat"], 9)
+    fy = np.clip(fy, 0, nlat - 1)
+
+    ix0 = np.floor(fx).astype(np.int64)
+    wx = fx - ix0
+    ix0 = ix0 % nlon
+    ix1 = (ix0 + 1) % nlon
+    iy0 = np.minimum(np.floor(fy).astype(np.int64), nlat - 2)
+    wy = fy - iy0
+    iy1 = iy0 + 1
+
+    idx = np.stack(
+        [iy0 * nlon + ix0, iy0 * nlon + ix1, iy1 * nlon + ix0, iy1 * nlon + ix1], axis=1
+    )
+    weights = np.stack(
+        [(1 - wy) * (1 - wx), (1 - wy) * wx, wy * (1 - wx), wy * wx], axis=1
+    )
+
+    return idx, weights
+
+
+class Regridder:
+    """
+    Reusable bilinear regridder between two regular global grids.
+
+    The index/weight stencil of a ``(src_grid, dst_grid)`` pair is computed
+    once and cached on disk under ``cache_dir``; applying it to any number of
+    fields is then a single gather.
+    """
+
+    def __init__(self, src_grid, dst_grid="pangu", cache_dir=CACHE_DIR) -> None:
+        self.src_grid = GRIDS[src_grid] if isinstance(src_grid, str) else src_grid
+        self.dst_grid = GRIDS[dst_grid] if isinstance(dst_grid, str) else dst_grid
+        self.cache_dir = cache_dir
+        self.idx, self.weights = self.load_stencil()
+
+    @classmethod
+    def from_latlons(cls, lats, lons, dst_grid="pangu", cache_dir=CACHE_DIR):
+        return cls(infer_grid(lats, lons), dst_grid, cache_dir)
+
+    def get_identity(self):
+        return [self.src_grid, self.dst_grid]
+
+    def get_target_points(self):
+        dst_lons, dst_lats = get_grid_axes(self.dst_grid)
+
+        return np.meshgrid(dst_lons, dst_lats)
+
+    def get_output_shape(self):
+        return (self.dst_grid["nlat"], self.dst_grid["nlon"])
+
+    def get_stencil_fp(self):
+        identity = json.dumps(self.get_identity(), sort_keys=True)
+        digest = hashlib.sha256(identity.encode("utf8")).hexdigest()[:16]
+
+        return os.path.join(self.cache_dir, f"regrid-{digest}.npz")
+
+    def load_stencil(self):
+        stencil_fp = self.get_stencil_fp()
+        if os.path.exists(stencil_fp):
+            with np.load(stencil_fp) as stencil:
+                return stencil["idx"], stencil["weights"]
+
+        lons, lats = self.get_target_points()
+        idx, weights = build_bilinear_stencil(self.src_grid, lons, lats)
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        atomic_write(stencil_fp, lambda f: np.savez(f, idx=idx, weights=weights))
+
+        return idx, weights
+
+    def regrid(self, fields):
+        """
+        Regrid fields of shape ``(..., src_nlat, src_nlon)`` to the target.
+        """
+        fields = np.asarray(fields)
+        leading_shape = fields.shape[:-2]
+        flat_fields = fields.reshape(-1, fields.shape[-2] * fields.shape[-1])
+        regridded = np.einsum("kpn,pn->kp", flat_fields[:, self.idx], self.weights)
+
+        return regridded.reshape(leading_shape + self.get_output_shape())
+
+
+class StationSampler(Regridder):
+    """
+    Bilinear sampler from a regular global grid to the station coordinates.
+
+    Works like ``Regridder`` but targets the stations of ``station_info_fp``
+    in table order, so ``regrid`` returns arrays of shape
+    ``(..., n_stations)``. The stencil is cached per grid and station list.
+    """
+
+    def __init__(
+        self, src_grid, station_info_fp=STATION_INFO_FP, cache_dir=CACHE_DIR
+    ) -> None:
+        self.station_info_fp = station_info_fp
+        self.station_df = pd.read_csv(station_info_fp)
+        super().__init__(src_grid, None, cache_dir)
+
+    @classmethod
+    def from_latlons(cls, lats, lons, station_info_fp=STATION_INFO_FP, cache_dir=CACHE_DIR):
+        return cls(infer_grid(lats, lons), station_info_fp, cache_dir)
+
+    def get_identity(self):
+        return [self.src_grid, get_station_table_hash(self.station_info_fp)]
+
+    def get_target_points(self):
+        return self.station_df["经度"].values, self.station_df["纬度"].values
+
+    def get_output_shape(self):
+        return (len(self.station_df),)
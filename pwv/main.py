@@ -1,15 +1,82 @@
 import os
-import shutil
+import time
+import argparse
+from datetime import datetime, timedelta, timezone
 
-from pwv.prepare import prepare_all
-from pwv.predict import iteratively_predict
-from pwv.verify import verify
+from pwv.context import RunContext
+from pwv.pipeline import run_task_graph
+from pwv.era5 import ERA5
+from pwv.prepare import (
+    OBS_WINDOW_HOURS,
+    OPTIONAL_STAGES,
+    collect_prepare_result,
+    get_expected_obs_dt,
+    get_observable_leads,
+    get_prepare_tasks,
+    prepare_all,
+    prepare_ecmwf,
+    prepare_era5,
+    prepare_gfs,
+    prepare_observation,
+    prepare_observations,
+)
+from pwv.plan import parse_leads
+from pwv.predict import iteratively_predict, predict_leads
+from pwv.shm import SurfaceRing, start_station_workers
+from pwv.trace import TRACER
+from pwv.verify import verify, verify_leads
 
-TMP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tmp")
 
+def prepare_and_predict_streaming(station_only, deadline_at, ctx):
+    """
+    Run the Pangu rollout next to the data preparation.
 
-def main():
-    prepare_result = prepare_all()
+    The observation time only depends on the clock, so it is fixed up front
+    and the rollout starts as soon as the ERA5 input is converted, while the
+    observation crawl and the ECMWF/GFS downloads are still running. Both
+    sides join before verification. Optional stages are dropped at
+    ``deadline_at`` like in ``prepare_all``.
+    """
+    expected_obs_dt = get_expected_obs_dt()
+
+    tasks = get_prepare_tasks(
+        station_only,
+        stages={"observation": lambda: prepare_observation(expected_obs_dt, ctx)},
+        deadline_at=deadline_at,
+        ctx=ctx,
+    )
+    tasks["predict"] = (
+        lambda era5: iteratively_predict(
+            int(era5[2].timestamp()), int(expected_obs_dt.timestamp()), ctx=ctx
+        ),
+        ["era5"],
+    )
+    results, timings = run_task_graph(
+        tasks, optional=OPTIONAL_STAGES, deadline_at=deadline_at
+    )
+    prepare_result = collect_prepare_result(results, timings)
+    predict_result = results["predict"]
+
+    if prepare_result["obs_dt"] != expected_obs_dt:
+        print("Observation time differs from the expected one, predicting again.")
+        predict_result = iteratively_predict(
+            int(prepare_result["era5_dt"].timestamp()),
+            int(prepare_result["obs_dt"].timestamp()),
+            ctx=ctx,
+        )
+
+    return prepare_result, predict_result
+
+
+def run_cycle(station_only, streaming, deadline_at, ctx):
+    if streaming:
+        prepare_result, predict_result = prepare_and_predict_streaming(
+            station_only, deadline_at, ctx
+        )
+    else:
+        prepare_result = prepare_all(
+            station_only=station_only, deadline_at=deadline_at, ctx=ctx
+        )
     ecmwfarray_fp = prepare_result["ecmwfarray_fp"]
     gfsarray_fp = prepare_result["gfsarray_fp"]
     gfs_batch_dt = prepare_result["gfs_batch_dt"]
@@ -17,12 +84,13 @@ def main():
     obs_count = prepare_result["obs_count"]
     ecmwf_batch_dt = prepare_result["ecmwf_batch_dt"]
     obs_dt = prepare_result["obs_dt"]
-    predict_result = iteratively_predict(
-        int(era5_dt.timestamp()), int(obs_dt.timestamp())
-    )
+    if not streaming:
+        predict_result = iteratively_predict(
+            int(era5_dt.timestamp()), int(obs_dt.timestamp()), ctx=ctx
+        )
     surface_fp = predict_result["surface_fp"]
     forward_records = predict_result["forward_records"]
-    verify(
+    result_fp = verify(
         surface_fp,
         ecmwfarray_fp,
         gfsarray_fp,
@@ -32,10 +100,205 @@ def main():
         gfs_batch_dt,
         obs_count,
         forward_records,
+        ctx,
     )
 
-    shutil.rmtree(TMP_DIR)
+    return result_fp
+
+
+def main(station_only=False, streaming=False, deadline=None):
+    """
+    Run one verification cycle and save its trace.
+
+    With a ``deadline`` (seconds from the start of the cycle), the GFS
+    comparison is dropped when it is not ready by then, see ``prepare_all``.
+
+    The spans and counters of the cycle (see ``pwv.trace``) are written next
+    to its ``verification-results-*.json`` as ``.trace.jsonl`` and ``.prom``
+    files, or as ``failed-cycle-at-*`` files when the cycle raised.
+
+    Every file of the cycle is written into its own ``RunContext`` directory,
+    removed at the end, so several cycles can run at once.
+
+    Returns the path of the ``verification-results-*.json`` file.
+    """
+    TRACER.reset()
+    deadline_at = time.monotonic() + deadline if deadline else None
+    result_fp = None
+    try:
+        with TRACER.span("cycle", station_only=station_only, streaming=streaming):
+            with RunContext() as ctx:
+                result_fp = run_cycle(station_only, streaming, deadline_at, ctx)
+    finally:
+        if result_fp:
+            prefix = os.path.splitext(result_fp)[0]
+        else:
+            dtstr = datetime.now(tz=timezone.utc).strftime("%Y%m%d%HZ")
+            prefix = f"./results/failed-cycle-at-{dtstr}"
+        trace_fp, _ = TRACER.dump(prefix)
+        print(f"Trace saved to {trace_fp}")
+
+    return result_fp
+
+
+def main_leads(leads, station_only=False, workers=0):
+    """
+    Verify a single Pangu rollout at several leads (in hours).
+
+    Every lead whose valid time has already been observed is captured from
+    one rollout of the ERA5 init, paired with the observations of that hour
+    (all hours come from one crawl) and with the ECMWF and GFS forecasts
+    valid at the same time. The metrics are written as one table by lead.
+
+    With ``workers``, the station values of each lead are extracted by that
+    many worker processes while the rollout goes on, see
+    ``predict_leads_with_workers``.
+    """
+    with RunContext() as ctx:
+        run_leads(leads, station_only, ctx, workers)
+
+
+def predict_leads_with_workers(init_timestamp, target_timestamps, workers, ctx):
+    """
+    ``predict_leads`` publishing its target states to station workers.
+
+    The surface states are handed over through a ``shm.SurfaceRing`` instead
+    of being read back from the run directory, and each worker saves the
+    station values of the states it takes as ``station-pangu-*.npy`` tables
+    in the run directory.
+
+    Returns the ``predict_leads`` results and the table of every target
+    timestamp whose values were saved.
+    """
+    leads = [(ts - init_timestamp) // 3600 for ts in target_timestamps]
+    with SurfaceRing(leads=leads) as ring:
+        processes = start_station_workers(ring, ctx.run_dir, workers)
+        try:
+            predict_results = predict_leads(
+                init_timestamp, target_timestamps, ctx=ctx, sink=ring
+            )
+        finally:
+            ring.close()
+            for process in processes:
+                process.join()
+
+    station_fps = {}
+    for ts, lead in zip(target_timestamps, leads):
+        fp = ctx.path(f"station-pangu-{init_timestamp}-{lead}.npy")
+        if os.path.exists(fp):
+            station_fps[ts] = fp
+
+    return predict_results, station_fps
+
+
+def get_verifiable_leads(leads, obs_dt=None):
+    """
+    The leads of ``leads`` that can be verified now, see
+    ``prepare.get_observable_leads``. Raises ``ValueError`` naming the
+    verifiable leads when there is none, before anything is downloaded.
+    """
+    obs_dt = obs_dt or get_expected_obs_dt()
+    era5_dt = ERA5().get_latest_datetime_of_cds().datetime
+    observable_leads = get_observable_leads(leads, era5_dt, obs_dt)
+    if not observable_leads:
+        last_lead = int((obs_dt - era5_dt).total_seconds() // 3600)
+        first_lead = last_lead - OBS_WINDOW_HOURS + 1
+        raise ValueError(
+            f"None of the leads {sorted(set(leads))} has been observed: the ERA5 init "
+            f"is {era5_dt.isoformat()}, so only leads {first_lead} to {last_lead} "
+            "can be verified now"
+        )
+
+    return observable_leads
+
+
+def run_leads(leads, station_only, ctx, workers=0):
+    expected_obs_dt = get_expected_obs_dt()
+    leads = get_verifiable_leads(leads, expected_obs_dt)
+
+    _, _, era5_dt = prepare_era5(ctx)
+    era5_ts = int(era5_dt.timestamp())
+    # ERA5 的时次可能在检查之后刚好更新，按实际时次重新筛选
+    valid_dts = [
+        era5_dt + timedelta(hours=lead)
+        for lead in get_observable_leads(leads, era5_dt, expected_obs_dt)
+    ]
+    observations = prepare_observations(valid_dts, ctx)
+
+    obs_timestamps = [int(obs_dt.timestamp()) for obs_dt in observations]
+    if workers:
+        predict_results, station_fps = predict_leads_with_workers(
+            era5_ts, obs_timestamps, workers, ctx
+        )
+    else:
+        predict_results = predict_leads(era5_ts, obs_timestamps, ctx=ctx)
+        station_fps = {}
+
+    kind = "station" if station_only else "surface"
+    lead_cases = []
+    for obs_dt, (obs_fp, obs_count) in observations.items():
+        obs_ts = int(obs_dt.timestamp())
+        ecmwfarray_fp, ecmwf_batch_dt = prepare_ecmwf(
+            obs_dt, station_only, ctx.path(f"{kind}-ecmwf-{obs_ts}.npy"), ctx=ctx
+        )
+        gfsarray_fp, gfs_batch_dt = prepare_gfs(
+            obs_dt, station_only, ctx.path(f"{kind}-gfs-{obs_ts}.npy"), ctx=ctx
+        )
+        lead_cases.append(
+            {
+                "lead": (obs_ts - era5_ts) // 3600,
+                "obs_dt": obs_dt,
+                "obs_fp": obs_fp,
+                "obs_count": obs_count,
+                "pangu_surface_fp": station_fps.get(
+                    obs_ts, predict_results[obs_ts]["surface_fp"]
+                ),
+                "ec_surface_fp": ecmwfarray_fp,
+                "gfs_surface_fp": gfsarray_fp,
+                "ecmwf_batch_dt": ecmwf_batch_dt,
+                "gfs_batch_dt": gfs_batch_dt,
+                "forward_records": predict_results[obs_ts]["forward_records"],
+            }
+        )
+
+    verify_leads(era5_dt, lead_cases)
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Verify Pangu weather forecasts")
+    parser.add_argument("--station-only", action="store_true")
+    parser.add_argument("--streaming", action="store_true")
+    parser.add_argument(
+        "--deadline",
+        type=int,
+        help="seconds after which optional stages such as GFS are dropped",
+    )
+    parser.add_argument(
+        "--leads",
+        type=parse_leads,
+        help="comma separated leads in hours, verified from a single rollout",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=0,
+        help="processes extracting the station values of each lead during --leads",
+    )
+    args = parser.parse_args()
+
+    if args.leads:
+        try:
+            leads = get_verifiable_leads(args.leads)
+        except ValueError as e:
+            parser.error(str(e))
+        main_leads(
+            leads,
+            station_only=args.station_only,
+            workers=args.workers,
+        )
+    else:
+        main(
+            station_only=args.station_only,
+            streaming=args.streaming,
+            deadline=args.deadline,
+        )
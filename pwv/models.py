@@ -0,0 +1,20 @@
+import os
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+# 推理使用的模型变体，例如 optimized、fp16、int8，见 pwv.optimize；为空时使用原始模型
+MODEL_VARIANT = os.environ.get("PWV_MODEL_VARIANT", "")
+
+
+def get_model_fp(step_mode, variant=None):
+    """
+    Path of the ``step_mode`` model, ``pangu_weather_{step_mode}.onnx`` for the
+    reference model and ``pangu_weather_{step_mode}.{variant}.onnx`` for a
+    variant. ``variant=None`` selects ``MODEL_VARIANT``, ``"reference"`` always
+    selects the reference model.
+    """
+    if variant is None:
+        variant = MODEL_VARIANT
+    if not variant or variant == "reference":
+        return os.path.join(STATIC_DIR, f"pangu_weather_{step_mode}.onnx")
+
+    return os.path.join(STATIC_DIR, f"pangu_weather_{step_mode}.{variant}.onnx")
@@ -0,0 +1,194 @@
+import os
+import time
+import argparse
+
+import numpy as np
+
+import onnx
+import onnxruntime as ort
+
+from pwv.models import get_model_fp
+from pwv.predict import create_session
+from pwv.tuning import get_execution_profile
+
+VARIANTS = ("optimized", "fp16", "int8")
+SURFACE_VARIABLES = ["msl", "u10", "v10", "t2m"]
+
+
+def build_optimized(modelfp, outfp):
+    # 离线做与硬件无关的图优化（extended 级别），结果可以在其他机器上使用
+    options = ort.SessionOptions()
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED
+    options.optimized_model_filepath = outfp
+    ort.InferenceSession(modelfp, sess_options=options, providers=["CPUExecutionProvider"])
+
+
+def build_fp16(modelfp, outfp):
+    try:
+        from onnxconverter_common import float16
+    except ImportError:
+        raise ImportError(
+            "The fp16 variant requires onnxconverter-common, "
+            "install it with `pip install onnxconverter-common`."
+        )
+
+    model = onnx.load(modelfp)
+    # 输入输出仍为 float32，与原始模型的调用方式一致
+    model = float16.convert_float_to_float16(model, keep_io_types=True)
+    onnx.save(model, outfp)
+
+
+def build_int8(modelfp, outfp):
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    quantize_dynamic(modelfp, outfp, weight_type=QuantType.QInt8)
+
+
+BUILDERS = {
+    "optimized": build_optimized,
+    "fp16": build_fp16,
+    "int8": build_int8,
+}
+
+
+def build_variant(step_mode, variant):
+    """
+    Build ``pangu_weather_{step_mode}.{variant}.onnx`` next to the reference
+    model. ``predict`` picks it up through ``variant`` or ``PWV_MODEL_VARIANT``.
+    """
+    modelfp = get_model_fp(step_mode, "reference")
+    outfp = get_model_fp(step_mode, variant)
+    print(f"Building {os.path.basename(outfp)}...")
+    t0 = time.perf_counter()
+    BUILDERS[variant](modelfp, outfp)
+    print(f"Done. Time elapsed: {time.perf_counter() - t0:.2f}s")
+
+    return outfp
+
+
+def run_model(modelfp, step_mode, input_surface_array, input_upper_array, repeats=1):
+    ort_session = create_session(modelfp, profile=get_execution_profile(step_mode))
+    inputs = {"input": input_upper_array, "input_surface": input_surface_array}
+    t0 = time.perf_counter()
+    for _ in range(repeats):
+        output_upper_array, output_surface_array = ort_session.run(None, inputs)
+    seconds = (time.perf_counter() - t0) / repeats
+
+    return output_surface_array, seconds
+
+
+def parse_max_rmse(text):
+    """
+    ``VAR=LIMIT`` RMSE limit of a command line option.
+    """
+    try:
+        varname, limit = text.split("=")
+        limit = float(limit)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"RMSE limit must look like t2m=0.1: {text}")
+    if varname not in SURFACE_VARIABLES:
+        raise argparse.ArgumentTypeError(
+            f"Unknown variable {varname}, choose from {', '.join(SURFACE_VARIABLES)}"
+        )
+
+    return varname, limit
+
+
+def check_variant(
+    step_mode, variant, input_surface_fp, input_upper_fp, max_rmse=None, repeats=1
+):
+    """
+    Accuracy gate of a model variant against the reference model.
+
+    Both models run on the stored sample state, and the RMSE of every surface
+    variable of the variant's output against the reference output is reported
+    together with the speedup. When ``max_rmse`` maps variable names to
+    limits, ``passed`` tells whether every listed variable stays within its
+    limit.
+    """
+    unknown = set(max_rmse or {}) - set(SURFACE_VARIABLES)
+    if unknown:
+        raise ValueError(f"Unknown variables in max_rmse: {sorted(unknown)}")
+
+    input_surface_array = np.load(input_surface_fp).astype(np.float32, copy=False)
+    input_upper_array = np.load(input_upper_fp).astype(np.float32, copy=False)
+
+    reference_surface, reference_seconds = run_model(
+        get_model_fp(step_mode, "reference"),
+        step_mode,
+        input_surface_array,
+        input_upper_array,
+        repeats,
+    )
+    variant_surface, variant_seconds = run_model(
+        get_model_fp(step_mode, variant),
+        step_mode,
+        input_surface_array,
+        input_upper_array,
+        repeats,
+    )
+
+    diff = variant_surface.astype(np.float64) - reference_surface.astype(np.float64)
+    rmse = {
+        varname: float(np.sqrt(np.mean(diff[i] ** 2)))
+        for i, varname in enumerate(SURFACE_VARIABLES)
+    }
+    passed = all(rmse[varname] <= limit for varname, limit in (max_rmse or {}).items())
+
+    report = {
+        "step_mode": step_mode,
+        "variant": variant,
+        "rmse": rmse,
+        "reference_seconds": reference_seconds,
+        "variant_seconds": variant_seconds,
+        "speedup": reference_seconds / variant_seconds,
+        "passed": passed,
+    }
+    print(
+        f"pangu_weather_{step_mode}.{variant}.onnx: "
+        + ", ".join(f"{varname} RMSE {value:.4f}" for varname, value in rmse.items())
+        + f", speedup {report['speedup']:.2f}x, {'passed' if passed else 'FAILED'}"
+    )
+
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build and check model variants")
+    parser.add_argument("action", choices=["build", "check"])
+    parser.add_argument("variant", choices=VARIANTS)
+    parser.add_argument("step_modes", nargs="*", type=int, default=[1, 3, 6, 24])
+    parser.add_argument("--surface", help="surface npy of the sample state, required by check")
+    parser.add_argument("--upper", help="upper npy of the sample state, required by check")
+    parser.add_argument(
+        "--max-rmse",
+        action="append",
+        type=parse_max_rmse,
+        default=[],
+        metavar="VAR=LIMIT",
+        help="RMSE limit of a surface variable, e.g. t2m=0.1",
+    )
+    parser.add_argument("--repeats", type=int, default=1)
+    args = parser.parse_args()
+    if args.action == "check" and not (args.surface and args.upper):
+        parser.error("check requires --surface and --upper")
+
+    max_rmse = dict(args.max_rmse)
+
+    failed = False
+    for step_mode in args.step_modes:
+        if args.action == "build":
+            build_variant(step_mode, args.variant)
+        else:
+            report = check_variant(
+                step_mode,
+                args.variant,
+                args.surface,
+                args.upper,
+                max_rmse=max_rmse,
+                repeats=args.repeats,
+            )
+            failed = failed or not report["passed"]
+
+    if failed:
+        raise SystemExit(1)
@@ -0,0 +1,125 @@
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from pwv.trace import TRACER
+
+
+class DeadlineExceeded(Exception):
+    """
+    Raised by a stage that gave up because the deadline of its run passed.
+    """
+
+
+def run_task_graph(tasks, max_workers=None, optional=(), deadline_at=None):
+    """
+    Run a small task graph on a thread pool.
+
+    Parameters:
+    tasks : dict
+        Maps a task name to ``(func, deps)``. ``func`` is called with the
+        results of the tasks named in ``deps``, in that order, as soon as all
+        of them have finished.
+    max_workers : int
+        Size of the thread pool, one thread per task by default.
+    optional : iterable
+        Names of tasks that may be dropped: once ``deadline_at`` (a
+        ``time.monotonic`` value) has passed, or when they raise
+        ``DeadlineExceeded``, their result is ``None`` and the graph no longer
+        waits for them. A dropped task still running should stop on its own
+        at the deadline; tasks depending on it receive ``None``.
+
+    Returns:
+    results : dict
+        Result of every task.
+    timings : dict
+        ``start``, ``end`` (``time.time`` values) and ``seconds`` of every task,
+        and ``dropped`` for the dropped ones.
+    """
+    for name, (_, deps) in tasks.items():
+        for dep in deps:
+            if dep not in tasks:
+                raise ValueError(f"Task {name} depends on unknown task {dep}")
+    optional = set(optional)
+
+    results = {}
+    timings = {}
+    starts = {}
+    dropped = set()
+
+    def run(name):
+        func, deps = tasks[name]
+        start = time.time()
+        t0 = time.perf_counter()
+        starts[name] = (start, t0)
+        try:
+            return func(*[results[dep] for dep in deps])
+        finally:
+            if name not in dropped:
+                timings[name] = {
+                    "start": start,
+                    "end": time.time(),
+                    "seconds": time.perf_counter() - t0,
+                }
+
+    def drop(name):
+        dropped.add(name)
+        results[name] = None
+        start, t0 = starts.get(name, (time.time(), time.perf_counter()))
+        timings[name] = {
+            "start": start,
+            "end": time.time(),
+            "seconds": time.perf_counter() - t0,
+            "dropped": True,
+        }
+        print(f"Task {name} dropped at the deadline")
+
+    pending = dict(tasks)
+    running = {}
+    executor = ThreadPoolExecutor(max_workers=max_workers or len(tasks) or 1)
+    try:
+        while pending or running:
+            if deadline_at is not None and time.monotonic() >= deadline_at:
+                for future, name in list(running.items()):
+                    if name in optional:
+                        future.cancel()
+                        del running[future]
+                        drop(name)
+                for name in [name for name in pending if name in optional]:
+                    del pending[name]
+                    drop(name)
+
+            ready = [
+                name
+                for name, (_, deps) in pending.items()
+                if all(dep in results for dep in deps)
+            ]
+            if not ready and not running:
+                if not pending:
+                    break
+                raise ValueError(f"Task graph has a cycle among {sorted(pending)}")
+            for name in ready:
+                del pending[name]
+                # 任务在线程池中运行，它们的 span 挂在调用方当前的 span 下
+                running[executor.submit(TRACER.bind(run), name)] = name
+
+            timeout = None
+            if deadline_at is not None and optional & (set(running.values()) | set(pending)):
+                timeout = max(deadline_at - time.monotonic(), 0)
+            done, _ = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    results[name] = future.result()
+                except DeadlineExceeded:
+                    if name not in optional:
+                        raise
+                    drop(name)
+                except BaseException:
+                    for other in running:
+                        other.cancel()
+                    raise
+    finally:
+        # 被放弃的任务不再等待，它们会在截止时间后自行退出
+        executor.shutdown(wait=not dropped)
+
+    return results, timings
@@ -0,0 +1,149 @@
+import os
+import json
+import argparse
+
+from pwv.cache import atomic_dump_json
+from pwv.models import STATIC_DIR
+
+STEP_MODES = (24, 6, 3, 1)
+# 每个模型单步推理的实测耗时（秒），按指数滑动平均更新，并保存下来供之后的运行使用
+STEP_LATENCY = {}
+LATENCY_FP = os.path.join(STATIC_DIR, "step_latency.json")
+LATENCY_LOADED = False
+
+
+def load_latency():
+    # 首次使用时读取之前运行保存的耗时，本进程已测到的值优先
+    global LATENCY_LOADED
+    if LATENCY_LOADED:
+        return STEP_LATENCY
+    LATENCY_LOADED = True
+    if os.path.exists(LATENCY_FP):
+        try:
+            with open(LATENCY_FP) as f:
+                saved = {int(step): float(seconds) for step, seconds in json.load(f).items()}
+        except (ValueError, AttributeError):
+            saved = {}
+        for step, seconds in saved.items():
+            STEP_LATENCY.setdefault(step, seconds)
+
+    return STEP_LATENCY
+
+
+def record_latency(step_mode, seconds, alpha=0.3):
+    load_latency()
+    if step_mode in STEP_LATENCY:
+        STEP_LATENCY[step_mode] = (1 - alpha) * STEP_LATENCY[step_mode] + alpha * seconds
+    else:
+        STEP_LATENCY[step_mode] = seconds
+    try:
+        atomic_dump_json(LATENCY_FP, {str(step): value for step, value in STEP_LATENCY.items()})
+    except OSError as e:
+        print(f"Failed to save step latencies to {LATENCY_FP}: {e!r}")
+
+
+def get_step_costs():
+    # 还没测到耗时的模型用已测模型的平均值代替，都没测过时每步代价相同
+    load_latency()
+    if STEP_LATENCY:
+        default = sum(STEP_LATENCY.values()) / len(STEP_LATENCY)
+    else:
+        default = 1.0
+
+    return {step: STEP_LATENCY.get(step, default) for step in STEP_MODES}
+
+
+def decompose(max_hours, costs):
+    """
+    Cheapest step chain for every lead from 0 to ``max_hours``.
+
+    Returns a list indexed by lead hour of ``(cost, chain)``, where ``chain`` is
+    a tuple of step modes sorted from the largest to the smallest. Ties in cost
+    are broken by the number of model calls, then by preferring larger steps.
+    """
+    table = [(0.0, ())]
+    for hours in range(1, max_hours + 1):
+        best = None
+        for step in STEP_MODES:
+            if step > hours:
+                continue
+            cost, chain = table[hours - step]
+            candidate = (cost + costs[step], tuple(sorted(chain + (step,), reverse=True)))
+            if best is None or (candidate[0], len(candidate[1])) < (best[0], len(best[1])):
+                best = candidate
+        table.append(best)
+
+    return table
+
+
+def parse_leads(text):
+    """
+    Comma separated leads (hours) of a command line option.
+
+    Lead 0 is the init state itself; negative leads are rejected before any
+    data is downloaded.
+    """
+    try:
+        leads = [int(lead) for lead in text.split(",")]
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Leads must be comma separated hours: {text}")
+    negative = [lead for lead in leads if lead < 0]
+    if negative:
+        raise argparse.ArgumentTypeError(f"Leads must not be negative: {negative}")
+
+    return leads
+
+
+def plan_leads(leads, costs=None):
+    """
+    Plan the model calls that reach every lead (in hours) from one init state.
+
+    Calls form a tree rooted at the init state: a node is identified by its
+    step path, e.g. ``(24, 24)`` for the 48h state, so targets such as 50h and
+    53h share the ``24 -> 24`` prefix and only diverge afterwards. Targets are
+    attached in ascending order, each one branching off the existing node that
+    makes its remaining chain cheapest under ``costs`` (seconds per call of
+    each step mode, the latencies measured by this and earlier runs by
+    default, see ``record_latency``).
+
+    The plan is greedy: every chain from a node to a target is the cheapest
+    one, but a target is never re-routed to share calls with later targets,
+    so the total cost is not guaranteed to be the minimum over all trees.
+
+    Returns a dict with ``calls``, the step paths to run in an order where
+    every parent precedes its children (depth-first, so branch states can be
+    released early), ``paths``, the step path of each lead, and ``cost``, the
+    total cost of all calls.
+    """
+    if costs is None:
+        costs = get_step_costs()
+    leads = sorted(set(int(lead) for lead in leads))
+    if not leads:
+        return {"calls": [], "paths": {}, "cost": 0.0}
+    if leads[0] < 0:
+        raise ValueError(f"Lead must not be negative: {leads[0]}")
+
+    table = decompose(leads[-1], costs)
+    nodes = {(): 0}
+    paths = {}
+    for lead in leads:
+        best = None
+        for path, node_lead in nodes.items():
+            if node_lead > lead:
+                continue
+            cost, chain = table[lead - node_lead]
+            key = (cost, len(path) + len(chain), -node_lead)
+            if best is None or key < best[0]:
+                best = (key, path, chain)
+
+        _, path, chain = best
+        for step in chain:
+            nodes[path + (step,)] = nodes[path] + step
+            path = path + (step,)
+        paths[lead] = path
+
+    # 元组的字典序即为深度优先的先序遍历
+    calls = sorted(path for path in nodes if path)
+    total_cost = sum(costs[path[-1]] for path in calls)
+
+    return {"calls": calls, "paths": paths, "cost": total_cost}
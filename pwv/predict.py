@@ -1,18 +1,252 @@
 import os
 import re
+import shutil
 import sys
 import time
+from collections import Counter, OrderedDict
 from datetime import datetime, timedelta, timezone
 
 import numpy as np
 
-import onnxruntime as ort
+from pwv.cache import STATE_CACHE, atomic_save
+from pwv.context import DEFAULT_CONTEXT
+from pwv.models import get_model_fp
+from pwv.plan import plan_leads, record_latency
+from pwv.trace import TRACER, traced
+from pwv.tuning import DEFAULT_PROFILE, create_inference_session, get_execution_profile
 
-STATIC_DIR = os.path.join(os.path.dirname(__file__), "static")
-TMP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tmp")
+# 会话池可占用的内存上限（字节），None 表示不限制，可通过环境变量覆盖
+SESSION_MEMORY_BUDGET = os.environ.get("PWV_SESSION_MEMORY_BUDGET")
+# 批量推理可占用的内存上限（字节），默认使用当前可用内存
+BATCH_MEMORY_BUDGET = os.environ.get("PWV_BATCH_MEMORY_BUDGET")
+# 推理时每个状态的峰值内存约为状态大小的倍数（经验值）
+BATCH_MEMORY_FACTOR = 32
 
 
-def predict(input_surface_fp, input_upper_fp, step_mode=24, gpu=False):
+def create_session(modelfp, gpu=False, profile=None):
+    # Set the behavier of onnxruntime, see pwv.tuning for the profile options
+    profile = profile or DEFAULT_PROFILE
+    if gpu:
+        # 序列化的优化图针对 CPU，GPU 上不使用
+        profile = dict(profile, cache_optimized_model=False)
+
+    if gpu:
+        cuda_provider_options = {
+            "arena_extend_strategy": "kSameAsRequested",
+        }
+        providers = [("CUDAExecutionProvider", cuda_provider_options)]
+    else:
+        providers = ["CPUExecutionProvider"]
+
+    return create_inference_session(modelfp, profile, providers)
+
+
+class SessionPool:
+    """
+    Process-wide registry of ONNX Runtime sessions keyed by step mode.
+
+    Each model (or model variant, see ``models.get_model_fp``) is loaded once
+    and reused by every later ``predict`` call in the process, including
+    consecutive scheduler runs.
+    When ``memory_budget`` (bytes) is set, the least recently used sessions are
+    evicted until the estimated footprint of the loaded models fits the budget.
+    The footprint of a session is estimated from the size of its model file.
+    """
+
+    def __init__(self, memory_budget=None) -> None:
+        self.memory_budget = int(memory_budget) if memory_budget else None
+        self.sessions = OrderedDict()
+        self.sizes = {}
+
+    def get(self, step_mode, gpu=False, variant=None):
+        modelfp = get_model_fp(step_mode, variant)
+        key = (step_mode, gpu, modelfp)
+        if key in self.sessions:
+            self.sessions.move_to_end(key)
+            return self.sessions[key]
+
+        size = os.path.getsize(modelfp)
+        self.evict(reserve=size)
+
+        print(f"Loading model {os.path.basename(modelfp)}...")
+        with TRACER.span("model_load", step_mode=step_mode):
+            ort_session = create_session(
+                modelfp, gpu=gpu, profile=get_execution_profile(step_mode)
+            )
+        self.sessions[key] = ort_session
+        self.sizes[key] = size
+
+        return ort_session
+
+    def evict(self, reserve=0):
+        if self.memory_budget is None:
+            return
+        while self.sessions and sum(self.sizes.values()) + reserve > self.memory_budget:
+            key, _ = self.sessions.popitem(last=False)
+            del self.sizes[key]
+            print(f"Evicted model {os.path.basename(key[2])} from session pool")
+
+    def clear(self):
+        self.sessions.clear()
+        self.sizes.clear()
+
+
+SESSION_POOL = SessionPool(SESSION_MEMORY_BUDGET)
+
+
+def predict_array(
+    input_surface_array, input_upper_array, step_mode=24, gpu=False, variant=None
+):
+    ort_session = SESSION_POOL.get(step_mode, gpu=gpu, variant=variant)
+
+    # Run the inference session
+    output_upper_array, output_surface_array = ort_session.run(
+        None,
+        {
+            "input": np.asarray(input_upper_array, dtype=np.float32),
+            "input_surface": np.asarray(input_surface_array, dtype=np.float32),
+        },
+    )
+
+    return output_surface_array, output_upper_array
+
+
+def get_available_memory():
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def get_batch_size(member_nbytes, memory_budget=None):
+    """
+    Number of states that fit in one batch.
+
+    The peak memory of inferring one state is estimated as
+    ``BATCH_MEMORY_FACTOR`` times its size, and the budget is
+    ``PWV_BATCH_MEMORY_BUDGET`` (bytes) when set, the available host memory
+    otherwise. Set the budget explicitly when running on GPU.
+    """
+    memory_budget = memory_budget or BATCH_MEMORY_BUDGET or get_available_memory()
+    if not memory_budget:
+        return 1
+
+    return max(int(memory_budget) // (member_nbytes * BATCH_MEMORY_FACTOR), 1)
+
+
+def get_model_batch_dim(ort_session):
+    """
+    Batch dimension of a model's upper-air input: ``None`` when the model
+    takes a single unbatched state, ``0`` when the batch size is dynamic,
+    the fixed batch size otherwise.
+    """
+    shape = next(node.shape for node in ort_session.get_inputs() if node.name == "input")
+    if len(shape) == 4:
+        return None
+
+    return shape[0] if isinstance(shape[0], int) else 0
+
+
+def predict_batch(
+    surface_arrays, upper_arrays, step_mode=24, gpu=False, variant=None, batch_size=None
+):
+    """
+    Advance several states by one step of ``step_mode``.
+
+    States are stacked along a leading batch dimension and run through the
+    model in chunks of ``batch_size`` (``get_batch_size`` by default), a
+    single state being a batch of one. Models without a batch dimension, like
+    the published Pangu models, are run once per state. Returns a list of
+    ``(surface, upper)`` arrays in input order.
+    """
+    ort_session = SESSION_POOL.get(step_mode, gpu=gpu, variant=variant)
+    batch_dim = get_model_batch_dim(ort_session)
+    if batch_dim is None:
+        return [
+            predict_array(
+                surface_array, upper_array, step_mode=step_mode, gpu=gpu, variant=variant
+            )
+            for surface_array, upper_array in zip(surface_arrays, upper_arrays)
+        ]
+
+    if batch_dim:
+        batch_size = batch_dim
+    elif batch_size is None:
+        member_nbytes = 4 * (np.size(surface_arrays[0]) + np.size(upper_arrays[0]))
+        batch_size = get_batch_size(member_nbytes)
+
+    outputs = []
+    for i in range(0, len(surface_arrays), batch_size):
+        surface_chunk = list(surface_arrays[i : i + batch_size])
+        upper_chunk = list(upper_arrays[i : i + batch_size])
+        n_members = len(surface_chunk)
+        # 固定批大小的模型用最后一个状态补齐
+        while batch_dim and len(surface_chunk) < batch_dim:
+            surface_chunk.append(surface_chunk[-1])
+            upper_chunk.append(upper_chunk[-1])
+
+        output_upper_array, output_surface_array = ort_session.run(
+            None,
+            {
+                "input": np.stack(upper_chunk).astype(np.float32, copy=False),
+                "input_surface": np.stack(surface_chunk).astype(np.float32, copy=False),
+            },
+        )
+        outputs.extend(
+            (output_surface_array[j], output_upper_array[j]) for j in range(n_members)
+        )
+
+    return outputs
+
+
+def load_state(surface_fp, upper_fp):
+    # float32 的输入不会再额外拷贝一次
+    surface_array = np.load(surface_fp).astype(np.float32, copy=False)
+    upper_array = np.load(upper_fp).astype(np.float32, copy=False)
+
+    return surface_array, upper_array
+
+
+def save_state(surface_array, upper_array, timestamp, savepath):
+    surface_fp = os.path.join(savepath, f"surface-{timestamp}.npy")
+    upper_fp = os.path.join(savepath, f"upper-{timestamp}.npy")
+    # 工作目录中的同名文件可能是指向缓存条目的硬链接，替换文件而不是原地改写
+    atomic_save(surface_fp, surface_array)
+    atomic_save(upper_fp, upper_array)
+
+    return surface_fp, upper_fp
+
+
+def link_state(surface_fp, upper_fp, timestamp, savepath):
+    # 用硬链接把缓存中的状态放到工作目录，缓存淘汰时不会影响本次运行，跨文件系统时退回到复制
+    linked_fps = []
+    for fp, prefix in ((surface_fp, "surface"), (upper_fp, "upper")):
+        linked_fp = os.path.join(savepath, f"{prefix}-{timestamp}.npy")
+        if os.path.exists(linked_fp):
+            # 目标就是源文件本身时（例如 0 时效的初始场）不能删除
+            if os.path.samefile(fp, linked_fp):
+                linked_fps.append(linked_fp)
+                continue
+            os.remove(linked_fp)
+        try:
+            os.link(fp, linked_fp)
+        except OSError:
+            shutil.copyfile(fp, linked_fp)
+        linked_fps.append(linked_fp)
+
+    return tuple(linked_fps)
+
+
+def predict(
+    input_surface_fp, input_upper_fp, step_mode=24, gpu=False, variant=None
+):
     input_surface_fn = os.path.basename(input_surface_fp)
     input_upper_fn = os.path.basename(input_upper_fp)
 
@@ -31,88 +265,323 @@ def predict(input_surface_fp, input_upper_fp, step_mode=24, gpu=False):
         os.path.dirname(input_upper_fp), f"upper-{new_upper_ts}.npy"
     )
 
-    if os.path.exists(output_surface_fp) and os.path.exists(output_upper_fp):
-        return output_surface_fp, output_upper_fp
+    # 同名的已有输出可能来自别的起报时间、步长路径或模型变体，总是重新计算；
+    # 跨运行的复用由按 (起报时间, 路径, 变体) 索引的 STATE_CACHE 负责
+    input_surface_array, input_upper_array = load_state(input_surface_fp, input_upper_fp)
+    output_surface_array, output_upper_array = predict_array(
+        input_surface_array,
+        input_upper_array,
+        step_mode=step_mode,
+        gpu=gpu,
+        variant=variant,
+    )
 
-    modelfp = os.path.join(STATIC_DIR, f"pangu_weather_{step_mode}.onnx")
-    # model = onnx.load(modelfp)
+    # Save the results
+    atomic_save(output_upper_fp, output_upper_array)
+    atomic_save(output_surface_fp, output_surface_array)
 
-    # Set the behavier of onnxruntime
-    options = ort.SessionOptions()
-    options.enable_cpu_mem_arena = False
-    options.enable_mem_pattern = False
-    options.enable_mem_reuse = False
-    # Increase the number for faster inference and more memory consumption
-    options.intra_op_num_threads = 1
+    return output_surface_fp, output_upper_fp
 
-    if gpu:
-        cuda_provider_options = {
-            "arena_extend_strategy": "kSameAsRequested",
-        }
 
-        ort_session = ort.InferenceSession(
-            modelfp,
-            sess_options=options,
-            providers=[("CUDAExecutionProvider", cuda_provider_options)],
-        )
-    else:
-        ort_session = ort.InferenceSession(
-            modelfp, sess_options=options, providers=["CPUExecutionProvider"]
-        )
+@traced("predict")
+def predict_leads_batch(
+    init_timestamps,
+    leads,
+    gpu=False,
+    checkpoint_every=None,
+    costs=None,
+    cache=STATE_CACHE,
+    variant=None,
+    batch_size=None,
+    workdir=None,
+    sink=None,
+):
+    """
+    Roll the model forward from several init states to the same leads.
 
-    # Load the upper-air numpy arrays
-    input_upper_array = np.load(input_upper_fp).astype(np.float32)
-    # Load the surface numpy arrays
-    input_surface_array = np.load(input_surface_fp).astype(np.float32)
+    Every init state follows the same ``plan_leads`` plan, and each call of
+    the plan advances all init states that need it together through
+    ``predict_batch``. States are kept in memory and released as soon as no
+    remaining call needs them. Pass ``checkpoint_every=N`` to also save every
+    state whose step path length is a multiple of N.
 
-    # Run the inference session
-    output_upper_array, output_surface_array = ort_session.run(
-        None, {"input": input_upper_array, "input_surface": input_surface_array}
+    With a ``cache`` (the persistent ``STATE_CACHE`` by default), each init
+    state resumes from the deepest state on each path already cached by an
+    earlier run, and target and branch states computed here are added to the
+    cache. ``variant`` selects a model variant, see ``models.get_model_fp``.
+    Pass ``cache=None`` to disable the cache.
+
+    ``sink``, e.g. a ``store.TrajectoryStore``, receives every state computed
+    here and every target served from the cache through its
+    ``write(init_timestamp, lead, surface_array, upper_array, path=path)``,
+    ``path`` being the steps (hours) that led to the state.
+
+    The init states are read from ``workdir``, the run directory of
+    ``context.DEFAULT_CONTEXT`` by default. With a single init state the
+    target states are written to ``workdir``; with several, the states of
+    each init go to ``workdir/init-{init_timestamp}`` so that their valid
+    times do not collide.
+
+    Returns a dict keyed by init timestamp of dicts keyed by target timestamp
+    of dicts with ``surface_fp``, ``upper_fp`` and ``forward_records``.
+    """
+    workdir = workdir or DEFAULT_CONTEXT.run_dir
+    init_timestamps = list(dict.fromkeys(int(ts) for ts in init_timestamps))
+    plan = plan_leads(leads, costs)
+    target_paths = {path: lead for lead, path in plan["paths"].items()}
+    plan_children = Counter(path[:-1] for path in plan["calls"])
+
+    savepaths = {}
+    cached = {}
+    calls = {}
+    for init_timestamp in init_timestamps:
+        if len(init_timestamps) == 1:
+            savepaths[init_timestamp] = workdir
+        else:
+            savepaths[init_timestamp] = os.path.join(workdir, f"init-{init_timestamp}")
+            os.makedirs(savepaths[init_timestamp], exist_ok=True)
+
+        # 从最深的已缓存状态开始，只计算缓存中没有的部分
+        cached[init_timestamp] = {
+            (): (
+                os.path.join(workdir, f"surface-{init_timestamp}.npy"),
+                os.path.join(workdir, f"upper-{init_timestamp}.npy"),
+            )
+        }
+        calls[init_timestamp] = set()
+        for path in target_paths:
+            for depth in range(len(path), 0, -1):
+                prefix = path[:depth]
+                if prefix in calls[init_timestamp] or prefix in cached[init_timestamp]:
+                    break
+                hit = (
+                    cache.get(init_timestamp, prefix, variant)
+                    if cache is not None
+                    else None
+                )
+                if hit:
+                    print(f"Resuming from cached state at lead {sum(prefix)}h")
+                    cached[init_timestamp][prefix] = hit
+                    break
+                calls[init_timestamp].add(prefix)
+    children = Counter(
+        (init_timestamp, path[:-1])
+        for init_timestamp, init_calls in calls.items()
+        for path in init_calls
     )
 
-    # Save the results
-    np.save(output_upper_fp, output_upper_array)
-    np.save(output_surface_fp, output_surface_array)
+    lead_results = {init_timestamp: {} for init_timestamp in init_timestamps}
+    for init_timestamp in init_timestamps:
+        for path, lead in target_paths.items():
+            if path == ():
+                # 0 时效就是初始场本身，直接使用初始场文件
+                surface_fp, upper_fp = cached[init_timestamp][path]
+            elif path in cached[init_timestamp]:
+                surface_fp, upper_fp = link_state(
+                    *cached[init_timestamp][path],
+                    init_timestamp + lead * 3600,
+                    savepaths[init_timestamp],
+                )
+            else:
+                continue
+            lead_results[init_timestamp][lead] = {
+                "surface_fp": surface_fp,
+                "upper_fp": upper_fp,
+                "forward_records": list(path),
+            }
+            if sink is not None:
+                sink.write(
+                    init_timestamp, lead, *load_state(surface_fp, upper_fp), path=path
+                )
 
-    return output_surface_fp, output_upper_fp
+    states = {}
+    for path in sorted(set().union(*calls.values())):
+        parent, step = path[:-1], path[-1]
+        members = [ts for ts in init_timestamps if path in calls[ts]]
+        for init_timestamp in members:
+            if (init_timestamp, parent) not in states:
+                states[(init_timestamp, parent)] = load_state(
+                    *cached[init_timestamp][parent]
+                )
+            dt = datetime.fromtimestamp(
+                init_timestamp + sum(parent) * 3600, tz=timezone.utc
+            )
+            dtstr = dt.isoformat()
+            future_dtstr = (dt + timedelta(hours=step)).isoformat()
+            print(f"Predicting from {dtstr} to {future_dtstr}")
+
+        # 先加载模型，计时只统计推理本身
+        SESSION_POOL.get(step, gpu=gpu, variant=variant)
+        t0 = time.perf_counter()
+        outputs = predict_batch(
+            [states[(init_timestamp, parent)][0] for init_timestamp in members],
+            [states[(init_timestamp, parent)][1] for init_timestamp in members],
+            step_mode=step,
+            gpu=gpu,
+            variant=variant,
+            batch_size=batch_size,
+        )
+        t1 = time.perf_counter()
+        print(f"Done. Time elapsed: {t1 - t0:.2f}s")
+        record_latency(step, (t1 - t0) / len(members))
+        TRACER.count("inference_seconds_total", t1 - t0, step_mode=step)
+        TRACER.count("inference_steps_total", len(members), step_mode=step)
+
+        for init_timestamp, (surface_array, upper_array) in zip(members, outputs):
+            children[(init_timestamp, parent)] -= 1
+            if children[(init_timestamp, parent)] == 0:
+                del states[(init_timestamp, parent)]
+            if children[(init_timestamp, path)] > 0:
+                states[(init_timestamp, path)] = (surface_array, upper_array)
 
+            if sink is not None:
+                sink.write(
+                    init_timestamp, sum(path), surface_array, upper_array, path=path
+                )
 
-def iteratively_predict(init_timestamp, target_timestamp):
-    input_surface_fp = os.path.join(TMP_DIR, f"surface-{init_timestamp}.npy")
-    input_upper_fp = os.path.join(TMP_DIR, f"upper-{init_timestamp}.npy")
-
-    steps = {24: 24 * 3600, 6: 6 * 3600, 3: 3 * 3600, 1: 1 * 3600}
-    timestamp = init_timestamp
-
-    forward_records = []
-    while timestamp < target_timestamp:
-        delta_hour = int((target_timestamp - timestamp) // 3600)
-
-        for step, interval in steps.items():
-            if delta_hour >= step:
-                step_num = delta_hour // step
-                for _ in range(step_num):
-                    dt = datetime.fromtimestamp(timestamp, tz=timezone.utc)
-                    dtstr = dt.isoformat()
-                    future_dtstr = (dt + timedelta(hours=step)).isoformat()
-                    print(f"Predicting from {dtstr} to {future_dtstr}")
-                    t0 = time.perf_counter()
-                    input_surface_fp, input_upper_fp = predict(
-                        input_surface_fp, input_upper_fp, step_mode=step
-                    )
-                    t1 = time.perf_counter()
-                    print(f"Done. Time elapsed: {t1 - t0:.2f}s")
-                    timestamp += interval
-                    forward_records.append(step)
-                break  # 当找到适合的步长并处理后，跳出当前循环进入下一个循环
+            timestamp = init_timestamp + sum(path) * 3600
+            savepath = savepaths[init_timestamp]
+            is_checkpoint = checkpoint_every and len(path) % checkpoint_every == 0
+            if cache is not None and (path in target_paths or plan_children[path] > 1):
+                cached_fps = cache.put(
+                    init_timestamp, path, surface_array, upper_array, variant
+                )
+                if path in target_paths or is_checkpoint:
+                    surface_fp, upper_fp = link_state(*cached_fps, timestamp, savepath)
+            elif path in target_paths or is_checkpoint:
+                surface_fp, upper_fp = save_state(
+                    surface_array, upper_array, timestamp, savepath
+                )
+            if path in target_paths:
+                lead_results[init_timestamp][target_paths[path]] = {
+                    "surface_fp": surface_fp,
+                    "upper_fp": upper_fp,
+                    "forward_records": list(path),
+                }
 
     print("All done.")
 
     return {
-        "surface_fp": input_surface_fp,
-        "upper_fp": input_upper_fp,
-        "forward_records": forward_records,
+        init_timestamp: {
+            init_timestamp + lead * 3600: result for lead, result in results.items()
+        }
+        for init_timestamp, results in lead_results.items()
+    }
+
+
+def predict_leads(
+    init_timestamp,
+    target_timestamps,
+    gpu=False,
+    checkpoint_every=None,
+    costs=None,
+    cache=STATE_CACHE,
+    variant=None,
+    workdir=None,
+    sink=None,
+    ctx=None,
+):
+    """
+    Roll the model forward from ``init_timestamp`` to every target timestamp.
+
+    The model calls follow ``plan_leads``, so targets that share a step prefix
+    share its inference, and each target resumes from the state cache when an
+    earlier run already computed part of its path. See
+    ``predict_leads_batch`` for the parameters. Target states are always
+    available in ``workdir`` (see ``predict_leads_batch``), hard-linked from
+    the cache when possible. ``ctx`` replaces ``workdir`` and ``cache`` like in
+    ``iteratively_predict``.
+
+    Returns a dict keyed by target timestamp of dicts with ``surface_fp``,
+    ``upper_fp`` and ``forward_records``.
+    """
+    if ctx is not None:
+        workdir, cache = ctx.run_dir, ctx.cache
+    target_leads = {
+        target_timestamp: int((target_timestamp - init_timestamp) // 3600)
+        for target_timestamp in target_timestamps
+    }
+    results = predict_leads_batch(
+        [init_timestamp],
+        target_leads.values(),
+        gpu=gpu,
+        checkpoint_every=checkpoint_every,
+        costs=costs,
+        cache=cache,
+        variant=variant,
+        workdir=workdir,
+        sink=sink,
+    )[int(init_timestamp)]
+
+    return {
+        target_timestamp: results[int(init_timestamp) + lead * 3600]
+        for target_timestamp, lead in target_leads.items()
+    }
+
+
+def iteratively_predict(
+    init_timestamp,
+    target_timestamp,
+    gpu=False,
+    checkpoint_every=None,
+    cache=STATE_CACHE,
+    variant=None,
+    workdir=None,
+    sink=None,
+    ctx=None,
+):
+    """
+    Roll the model forward from ``init_timestamp`` to ``target_timestamp``.
+
+    The state is kept in memory for the whole chain and resumed from the state
+    cache when an earlier run already computed part of it. Pass
+    ``checkpoint_every=N`` to also save every N-th intermediate state to
+    ``workdir`` (see ``predict_leads_batch``), and a ``sink`` such as a
+    ``store.TrajectoryStore`` to keep every state of the rollout. A
+    ``context.RunContext`` passed as ``ctx`` replaces ``workdir`` and
+    ``cache`` with its run directory and state cache.
+
+    ``init_timestamp`` and ``target_timestamp`` may also be lists of the same
+    length whose pairs share the same lead, and therefore the same step plan.
+    The init states are then advanced together in batches (see
+    ``predict_leads_batch``) and a list of results is returned in order.
+    """
+    if ctx is not None:
+        workdir, cache = ctx.run_dir, ctx.cache
+    if not isinstance(init_timestamp, (list, tuple)):
+        results = predict_leads(
+            init_timestamp,
+            [target_timestamp],
+            gpu=gpu,
+            checkpoint_every=checkpoint_every,
+            cache=cache,
+            variant=variant,
+            workdir=workdir,
+            sink=sink,
+        )
+        return results[target_timestamp]
+
+    if len(init_timestamp) != len(target_timestamp):
+        raise ValueError("init_timestamp and target_timestamp must have the same length")
+    leads = {
+        int((target - init) // 3600) for init, target in zip(init_timestamp, target_timestamp)
     }
+    if len(leads) != 1:
+        raise ValueError(f"Init timestamps must share a step plan, got leads {sorted(leads)}")
+    lead = leads.pop()
+
+    results = predict_leads_batch(
+        init_timestamp,
+        [lead],
+        gpu=gpu,
+        checkpoint_every=checkpoint_every,
+        cache=cache,
+        variant=variant,
+        workdir=workdir,
+        sink=sink,
+    )
+
+    return [results[int(init)][int(init) + lead * 3600] for init in init_timestamp]
 
 
 if __name__ == "__main__":
@@ -1,36 +1,53 @@
 import os
+import json
 import time
 from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import TimeoutError as FuturesTimeoutError
 from datetime import datetime, timedelta, timezone
 
 import numpy as np
 import netCDF4 as nc
 import pandas as pd
 import requests
+from requests.adapters import HTTPAdapter
 import pygrib
 import toml
 import arrow
 from tqdm import tqdm
 from scipy.interpolate import griddata
 
+from pwv.context import DEFAULT_CONTEXT
 from pwv.era5 import ERA5
+from pwv.grid import Regridder, StationSampler
+from pwv.pipeline import DeadlineExceeded, run_task_graph
+from pwv.trace import TRACER, count_retries, get_host, get_peak_rss, traced
 from retrying import retry
 
 STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
 STATION_INFO_FP = os.path.join(STATIC_DIR, "station_info.csv")
-TMP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tmp")
 OBS_DATA_URL_PATTERN = "http://www.nmc.cn/rest/weather?stationid={sid}"
 ECMWF_DATA_DIR_URL_PATTERN = "https://data.ecmwf.int/forecasts/%Y%m%d/%Hz/ifs/0p25/oper"
 
+# 观测数据并发下载的线程数、单站重试次数和整体截止时间（秒）
+OBS_FETCH_CONCURRENCY = 32
+OBS_FETCH_RETRIES = 3
+OBS_FETCH_DEADLINE = 600
+# 站点接口返回过去 24 小时的观测，更早的时次无法检验
+OBS_WINDOW_HOURS = 24
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+# 整文件下载的（连接，读取）超时，单位：秒
+DOWNLOAD_TIMEOUT = (10, 60)
+# 有截止时间时，超时可以放弃的阶段
+OPTIONAL_STAGES = ("gfs",)
+
 SURFACE_FIELD_CONDITIONS = {
     "t2m": {"shortName": "2t", "typeOfLevel": "heightAboveGround"},
     "u10": {"shortName": "10u", "typeOfLevel": "heightAboveGround"},
     "v10": {"shortName": "10v", "typeOfLevel": "heightAboveGround"},
 }
 SURFACE_FIELD_ORDER = ["u10", "v10", "t2m"]
-ERA5_API_KEY = toml.load(os.path.join(os.path.dirname(__file__), "secret.toml"))[
-    "cds_api_key"
-]
+SECRET_FP = os.path.join(os.path.dirname(__file__), "secret.toml")
 
 
 def get_station_info():
@@ -74,39 +91,181 @@ def parse_obs_data(data, sid, ts):
         }
 
 
-def prepare_observation():
-    station_df = get_station_info()
-
+def create_http_session(pool_size=OBS_FETCH_CONCURRENCY):
+    # 所有请求共用一个 keep-alive 连接池
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=1, pool_maxsize=pool_size, max_retries=0
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+
+    return session
+
+
+def fetch_station_data(
+    session, sid, url_pattern, deadline, timeout=5, retries=OBS_FETCH_RETRIES, backoff=0.5
+):
+    """
+    Fetch the raw observation payload of one station.
+
+    Connection errors and timeouts are retried with exponential backoff, but
+    never past ``deadline`` (a ``time.monotonic`` value). Returns the response,
+    or ``None`` when every attempt failed.
+    """
+    for attempt in range(retries + 1):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return None
+        url = url_pattern.format(sid=sid) + f"&_={int(time.time()*1000)}"
+        if attempt:
+            TRACER.count("retries_total", function="fetch_station_data")
+        TRACER.count("http_requests_total", host=get_host(url))
+        try:
+            resp = session.get(url, timeout=min(timeout, remaining))
+        except Exception:
+            TRACER.count("http_errors_total", host=get_host(url))
+            if attempt < retries:
+                time.sleep(min(backoff * 2**attempt, max(deadline - time.monotonic(), 0)))
+        else:
+            TRACER.count("download_bytes_total", len(resp.content), host=get_host(url))
+            return resp
+
+    return None
+
+
+def download_station_responses(
+    sids,
+    url_pattern=OBS_DATA_URL_PATTERN,
+    concurrency=OBS_FETCH_CONCURRENCY,
+    retries=OBS_FETCH_RETRIES,
+    deadline=OBS_FETCH_DEADLINE,
+    timeout=5,
+):
+    """
+    Download the observation payloads of many stations concurrently.
+
+    Requests run on a bounded thread pool sharing one keep-alive session.
+    Returns one response per station in the order of ``sids``; it is ``None``
+    when the request still failed after ``retries`` retries, or had not
+    finished when the global ``deadline`` (seconds) expired.
+    """
+    deadline_at = time.monotonic() + deadline
+    session = create_http_session(concurrency)
+    executor = ThreadPoolExecutor(max_workers=concurrency)
+    futures = {
+        executor.submit(
+            TRACER.bind(fetch_station_data),
+            session,
+            sid,
+            url_pattern,
+            deadline_at,
+            timeout=timeout,
+            retries=retries,
+        ): i
+        for i, sid in enumerate(sids)
+    }
+    responses = [None] * len(sids)
+    with tqdm(total=len(sids)) as pbar:
+        try:
+            for future in as_completed(
+                futures, timeout=max(deadline_at - time.monotonic(), 0)
+            ):
+                responses[futures[future]] = future.result()
+                pbar.update()
+        except FuturesTimeoutError:
+            print("Observation download deadline reached, skipping the rest stations.")
+    for future in futures:
+        future.cancel()
+    executor.shutdown(wait=False)
+    session.close()
+
+    return responses
+
+
+def parse_station_responses(sids, responses, want_ts):
     url_error_list = []
     data_error_list = []
-    sids = station_df["区站号"].tolist()
     records = []
-    dts = []
-    print("Downloading observation data...")
-    now_dt = arrow.now(tz="utc").floor("hour")
-    round3dt = now_dt.replace(hour=now_dt.hour // 3 * 3)
-    want_dt = round3dt.shift(hours=-3)
-    want_ts = int(want_dt.timestamp())
-
-    for sid in tqdm(sids):
-        URL = OBS_DATA_URL_PATTERN.format(sid=sid) + f"&_={int(time.time()*1000)}"
-        try:
-            resp = requests.get(URL, timeout=5)
-        except Exception:
+    for sid, resp in zip(sids, responses):
+        if resp is None:
             url_error_list.append(sid)
             continue
         if resp.ok:
-            data = resp.json()["data"]
+            try:
+                data = resp.json()["data"]
+            except (ValueError, KeyError, TypeError):
+                data_error_list.append(sid)
+                continue
             if data:
                 parsed_data = parse_obs_data(data, sid, want_ts)
                 if parsed_data:
                     records.append(parsed_data)
-                    dt = parsed_data["datetime"]
-                    dts.append(dt)
                 else:
                     data_error_list.append(sid)
-            else:
-                continue
+
+    return records, url_error_list, data_error_list
+
+
+def fetch_observations(sids, want_ts, **kwargs):
+    """
+    Download and parse the observations of many stations at ``want_ts``.
+
+    Keyword arguments are passed to ``download_station_responses``. Stations
+    whose request failed are reported in ``url_error_list``, stations without
+    a valid record at ``want_ts`` in ``data_error_list``. Records and both
+    error lists keep the order of ``sids``.
+
+    Returns ``records, url_error_list, data_error_list``.
+    """
+    responses = download_station_responses(sids, **kwargs)
+
+    return parse_station_responses(sids, responses, want_ts)
+
+
+def get_expected_obs_dt():
+    # 取最近一个已经发布的 3 小时整点观测
+    now_dt = arrow.now(tz="utc").floor("hour")
+    round3dt = now_dt.replace(hour=now_dt.hour // 3 * 3)
+    want_dt = round3dt.shift(hours=-3)
+
+    return want_dt.datetime
+
+
+def get_observable_leads(leads, era5_dt=None, obs_dt=None):
+    """
+    Leads (hours) of ``leads`` whose valid time has been observed.
+
+    A lead can be verified when its valid time falls within the
+    ``OBS_WINDOW_HOURS`` hours up to ``obs_dt`` (``get_expected_obs_dt`` by
+    default). ``era5_dt`` is the init time, the latest ERA5 time on CDS by
+    default, so the leads are known before anything is downloaded.
+    """
+    era5_dt = era5_dt or ERA5().get_latest_datetime_of_cds().datetime
+    obs_dt = obs_dt or get_expected_obs_dt()
+    earliest_dt = obs_dt - timedelta(hours=OBS_WINDOW_HOURS)
+
+    return sorted(
+        lead
+        for lead in set(leads)
+        if earliest_dt < era5_dt + timedelta(hours=lead) <= obs_dt
+    )
+
+
+@traced("observation")
+def prepare_observation(want_dt=None, ctx=DEFAULT_CONTEXT):
+    station_df = get_station_info()
+
+    sids = station_df["区站号"].tolist()
+    print("Downloading observation data...")
+    if want_dt is None:
+        want_dt = get_expected_obs_dt()
+    want_ts = int(want_dt.timestamp())
+
+    records, url_error_list, data_error_list = fetch_observations(sids, want_ts)
+    TRACER.count("observation_stations_failed_total", len(url_error_list), reason="url")
+    TRACER.count("observation_stations_failed_total", len(data_error_list), reason="data")
+    dts = [record["datetime"] for record in records]
 
     if len(set(dts)) > 1:
         most_common_dt = Counter(dts).most_common(1)[0][0]
@@ -120,7 +279,7 @@ def prepare_observation():
 
     dt = dts[0]
     df = pd.DataFrame(records)
-    df.to_csv(os.path.join(TMP_DIR, "obervation.csv"), index=False)
+    df.to_csv(ctx.path("obervation.csv"), index=False)
     print(
         "Observation data download is completed, "
         f"a total of {len(df)} observation stations' data downloaded, "
@@ -130,12 +289,46 @@ def prepare_observation():
     return dt, len(df)
 
 
-@retry(stop_max_attempt_number=7)
+@traced("observation")
+def prepare_observations(want_dts, ctx=DEFAULT_CONTEXT):
+    """
+    Observations of several hours from a single crawl.
+
+    The station payload covers the past 24 hours, so every station is
+    downloaded once and parsed for each of ``want_dts``. Each hour with
+    records is saved as ``observation-{timestamp}.csv``.
+
+    Returns a dict mapping each available hour to ``(csv_fp, count)``.
+    """
+    station_df = get_station_info()
+
+    sids = station_df["区站号"].tolist()
+    print("Downloading observation data...")
+    responses = download_station_responses(sids)
+
+    observations = {}
+    for want_dt in want_dts:
+        want_ts = int(want_dt.timestamp())
+        records, _, _ = parse_station_responses(sids, responses, want_ts)
+        if not records:
+            print(f"No observation data at {want_dt.isoformat()}, skipped.")
+            continue
+        df = pd.DataFrame(records)
+        obs_fp = ctx.path(f"observation-{want_ts}.csv")
+        df.to_csv(obs_fp, index=False)
+        observations[want_dt] = (obs_fp, len(df))
+
+    return observations
+
+
+@retry(stop_max_attempt_number=7, before_attempts=count_retries("check_ecmwf_dir_exist"))
 def check_ecmwf_dir_exist(dt: datetime):
     url = dt.astimezone(timezone.utc).strftime(ECMWF_DATA_DIR_URL_PATTERN)
+    TRACER.count("http_requests_total", host=get_host(url))
     try:
         resp = requests.get(url, timeout=3)
     except Exception:
+        TRACER.count("http_errors_total", host=get_host(url))
         return False
     else:
         if resp.ok:
@@ -144,20 +337,102 @@ def check_ecmwf_dir_exist(dt: datetime):
             return False
 
 
-def download_file_in_chunks(url, dest_path, chunk_size=1024):
-    r = requests.get(url, stream=True)
+def download_file_in_chunks(
+    url, dest_path, chunk_size=DOWNLOAD_CHUNK_SIZE, timeout=DOWNLOAD_TIMEOUT, deadline_at=None
+):
+    # 截止时间只让调度不再等待，线程本身要靠超时和截止时间检查才能退出
+    TRACER.count("http_requests_total", host=get_host(url))
+    r = requests.get(url, stream=True, timeout=timeout)
     if r.ok:
         with open(dest_path, "wb") as f:
             for chunk in r.iter_content(chunk_size=chunk_size):
+                if deadline_at is not None and time.monotonic() >= deadline_at:
+                    raise DeadlineExceeded(f"Download of {url} passed the deadline")
                 if chunk:
                     f.write(chunk)
+                    TRACER.count("download_bytes_total", len(chunk), host=get_host(url))
         return True
     else:
         return None
 
 
-@retry(stop_max_attempt_number=7)
-def download_ecmwf_data(dt_batch: datetime, dt_obs: datetime):
+def parse_grib_index(text):
+    # ECMWF 开放数据的 .index 文件每行是一条 GRIB 消息的 JSON 描述
+    entries = []
+    for line in text.splitlines():
+        line = line.strip()
+        if line:
+            entries.append(json.loads(line))
+
+    return entries
+
+
+def merge_byte_ranges(ranges):
+    # 合并相邻或重叠的字节区间，区间为闭区间 (start, end)
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+
+    return [tuple(byte_range) for byte_range in merged]
+
+
+def download_grib_messages(
+    url, dest_path, params, levtype="sfc", chunk_size=DOWNLOAD_CHUNK_SIZE
+):
+    """
+    Download only the wanted messages of a GRIB file that has a .index sidecar.
+
+    The ``.index`` file next to ``url`` lists the byte offset and length of
+    every message. Messages whose ``param`` is in ``params`` are fetched with
+    HTTP Range requests, adjacent messages in one request, and concatenated
+    into ``dest_path``, which is itself a valid GRIB file.
+
+    Returns ``True`` on success and ``None`` when the index is unavailable,
+    lists none of the wanted messages, or the server ignores Range requests.
+    """
+    index_url = os.path.splitext(url)[0] + ".index"
+    TRACER.count("http_requests_total", host=get_host(index_url))
+    resp = requests.get(index_url, timeout=10)
+    if not resp.ok:
+        return None
+
+    entries = [
+        entry
+        for entry in parse_grib_index(resp.text)
+        if entry.get("param") in params and entry.get("levtype", levtype) == levtype
+    ]
+    if not entries:
+        return None
+
+    ranges = merge_byte_ranges(
+        (entry["_offset"], entry["_offset"] + entry["_length"] - 1) for entry in entries
+    )
+    with requests.Session() as session, open(dest_path, "wb") as f:
+        for start, end in ranges:
+            TRACER.count("http_requests_total", host=get_host(url))
+            r = session.get(
+                url, headers={"Range": f"bytes={start}-{end}"}, stream=True, timeout=30
+            )
+            # 服务器不支持 Range 时会返回整个文件，此时放弃分段下载
+            if r.status_code != 206:
+                r.close()
+                return None
+            for chunk in r.iter_content(chunk_size=chunk_size):
+                if chunk:
+                    f.write(chunk)
+                    TRACER.count("download_bytes_total", len(chunk), host=get_host(url))
+
+    downloaded = sum(end - start + 1 for start, end in ranges)
+    print(f"Downloaded {len(entries)} GRIB messages, {downloaded / 1024**2:.1f} MB")
+
+    return True
+
+
+@retry(stop_max_attempt_number=7, before_attempts=count_retries("download_ecmwf_data"))
+def download_ecmwf_data(dt_batch: datetime, dt_obs: datetime, ctx=DEFAULT_CONTEXT):
     delta_hour = int((dt_obs - dt_batch).total_seconds() // 3600)
     step = delta_hour // 3 * 3
     if delta_hour - step > 1:
@@ -172,22 +447,32 @@ def download_ecmwf_data(dt_batch: datetime, dt_obs: datetime):
         f"the forecast step is：{step}h"
     )
     fn = os.path.basename(url)
-    ecmwf_fp = os.path.join(TMP_DIR, fn)
-    res = download_file_in_chunks(url, ecmwf_fp)
+    ecmwf_fp = ctx.path(fn)
+    params = [conditions["shortName"] for conditions in SURFACE_FIELD_CONDITIONS.values()]
+    res = download_grib_messages(url, ecmwf_fp, params)
+    if not res:
+        print("Partial download is unavailable, downloading the whole file.")
+        res = download_file_in_chunks(url, ecmwf_fp)
     if res:
         print("Completed.")
 
         return ecmwf_fp
 
 
-@retry(stop_max_attempt_number=7)
-def download_gfs_data(dt_obs: datetime):
+@retry(
+    stop_max_attempt_number=7,
+    retry_on_exception=lambda e: not isinstance(e, DeadlineExceeded),
+    before_attempts=count_retries("download_gfs_data"),
+)
+def download_gfs_data(dt_obs: datetime, deadline_at=None, ctx=DEFAULT_CONTEXT):
     print("Downloading GFS forecast field...")
     dt_batch = dt_obs.astimezone(timezone.utc).replace(
         hour=dt_obs.astimezone(timezone.utc).hour // 6 * 6
     )
     URL_PATTERN = "https://nomads.ncep.noaa.gov/cgi-bin/filter_gfs_0p25_1hr.pl?dir=%2Fgfs.{datestr}%2F{hourstr}%2Fatmos&file=gfs.t{hourstr}z.pgrb2.0p25.f{step}&var_TMP=on&var_UGRD=on&var_VGRD=on&lev_2_m_above_ground=on&lev_10_m_above_ground=on"
     while True:
+        if deadline_at is not None and time.monotonic() >= deadline_at:
+            raise DeadlineExceeded("GFS download passed the deadline")
         delta_hour = int((dt_obs - dt_batch).total_seconds() // 3600)
         datestr = dt_batch.strftime("%Y%m%d")
         hourstr = dt_batch.strftime("%H")
@@ -202,11 +487,13 @@ def download_gfs_data(dt_obs: datetime):
 
         url = URL_PATTERN.format(datestr=datestr, hourstr=hourstr, step=step)
         print(f"Downloading from {url}")
+        TRACER.count("gfs_batches_checked_total")
+        TRACER.count("http_requests_total", host=get_host(url))
         resp = requests.get(url, timeout=10, stream=True)
         if resp.ok:
             fn = f"gfs.t{hourstr}z.pgrb2.0p25.f{step}.grb"
-            gfs_fp = os.path.join(TMP_DIR, fn)
-            res = download_file_in_chunks(url, gfs_fp)
+            gfs_fp = ctx.path(fn)
+            res = download_file_in_chunks(url, gfs_fp, deadline_at=deadline_at)
             if res:
                 print("Completed.")
                 return gfs_fp, dt_batch
@@ -235,16 +522,22 @@ def interpolate(lons, lats, data):
     return new_data
 
 
-@retry(stop_max_attempt_number=7)
+@retry(stop_max_attempt_number=7, before_attempts=count_retries("download_era5_data"))
+def load_era5_api_key():
+    # 在需要从 CDS 下载时才读取，离线运行不需要 secret.toml
+    return toml.load(SECRET_FP)["cds_api_key"]
+
+
 def download_era5_data(api_key):
+    # 返回 (归档文件, 时次序号)，已经归档的时次不会重复下载
     era5 = ERA5(api_key)
-    surface_fp, dt = era5.fetch_latest_surface(TMP_DIR)
-    upper_fp, dt = era5.fetch_latest_upper(TMP_DIR)
+    surface_loc, dt = era5.fetch_latest_surface()
+    upper_loc, dt = era5.fetch_latest_upper()
 
-    return surface_fp, upper_fp, dt
+    return surface_loc, upper_loc, dt
 
 
-def transfer_ecmwf(grib2_fp):
+def transfer_ecmwf(grib2_fp, station_only=False, savefp=None, ctx=DEFAULT_CONTEXT):
     messages = pygrib.open(grib2_fp)
     surface_dataset = {}
     print("Start transfering ECMWF data...")
@@ -253,15 +546,21 @@ def transfer_ecmwf(grib2_fp):
         msg = messages.select(**conditions)[0]
 
         data, lats, lons = msg.data()
-        data = interpolate(lons, lats, data)
         surface_dataset[varname] = data
 
     surface_array = []
     for varname in SURFACE_FIELD_ORDER:
         surface_array.append(surface_dataset[varname])
 
-    surface_array = np.stack(surface_array)
-    savefp = os.path.join(TMP_DIR, "surface-ecmwf.npy")
+    # 插值权重按网格缓存，三个变量一次完成插值
+    if station_only:
+        sampler = StationSampler.from_latlons(lats, lons, cache_dir=ctx.cache_dir)
+        surface_array = sampler.regrid(np.stack(surface_array))
+        savefp = savefp or ctx.path("station-ecmwf.npy")
+    else:
+        regridder = Regridder.from_latlons(lats, lons, "pangu", cache_dir=ctx.cache_dir)
+        surface_array = regridder.regrid(np.stack(surface_array))
+        savefp = savefp or ctx.path("surface-ecmwf.npy")
     np.save(savefp, surface_array)
 
     print("Finished.")
@@ -269,7 +568,7 @@ def transfer_ecmwf(grib2_fp):
     return savefp
 
 
-def transfer_gfs(grib2_fp):
+def transfer_gfs(grib2_fp, station_only=False, savefp=None, ctx=DEFAULT_CONTEXT):
     messages = pygrib.open(grib2_fp)
     surface_dataset = {}
     print("Start transfering GFS data...")
@@ -277,7 +576,7 @@ def transfer_gfs(grib2_fp):
         print(f"Processing {varname}...")
         msg = messages.select(**conditions)[0]
 
-        data, _, _ = msg.data()
+        data, lats, lons = msg.data()
         surface_dataset[varname] = data
 
     surface_array = []
@@ -285,7 +584,12 @@ def transfer_gfs(grib2_fp):
         surface_array.append(surface_dataset[varname])
 
     surface_array = np.stack(surface_array)
-    savefp = os.path.join(TMP_DIR, "surface-gfs.npy")
+    if station_only:
+        sampler = StationSampler.from_latlons(lats, lons, cache_dir=ctx.cache_dir)
+        surface_array = sampler.regrid(surface_array)
+        savefp = savefp or ctx.path("station-gfs.npy")
+    else:
+        savefp = savefp or ctx.path("surface-gfs.npy")
     np.save(savefp, surface_array)
 
     print("Finished.")
@@ -293,67 +597,211 @@ def transfer_gfs(grib2_fp):
     return savefp
 
 
-def transfer_surface(infp, outfp):
-    ds = nc.Dataset(infp)
+def remove_existing(fp):
+    # 工作目录中的同名状态文件可能是指向缓存条目的硬链接，先删除再写入新文件，不会改写缓存
+    try:
+        os.remove(fp)
+    except FileNotFoundError:
+        pass
+
+
+def transfer_surface(infp, outfp, time_index=0):
+    """
+    Convert the ERA5 surface fields at ``time_index`` into the Pangu input.
+
+    The fields are written one at a time into a float32 ``.npy`` file mapped
+    into memory, so no stacked copy is built; with masking off, netCDF4
+    returns the unpacked values without a masked array on top.
+    """
     VAR_ORDER = ["msl", "u10", "v10", "t2m"]
-    array = []
-    for v in VAR_ORDER:
-        print(f"Processing {v}...")
-        data = ds.variables[v][0].data.astype(np.float32)
-        array.append(data)
+    with nc.Dataset(infp) as ds:
+        ds.set_auto_mask(False)
+        shape = (len(VAR_ORDER),) + ds.variables[VAR_ORDER[0]].shape[-2:]
+        remove_existing(outfp)
+        array = np.lib.format.open_memmap(outfp, mode="w+", dtype=np.float32, shape=shape)
+        for i, v in enumerate(VAR_ORDER):
+            print(f"Processing {v}...")
+            array[i] = ds.variables[v][time_index]
+        array.flush()
+        del array
+
+    print(f"Process peak RSS: {get_peak_rss() / 1024**2:.0f} MB")
+
+    return outfp
+
+
+def transfer_upper(infp, outfp, time_index=0):
+    """
+    Convert the ERA5 pressure level fields at ``time_index`` into the Pangu
+    input, with the vertical axis reversed.
+
+    Like ``transfer_surface``, but the fields are read one level at a time,
+    so besides the memory-mapped output only a single 721x1440 level is held
+    in memory.
+    """
+    VAR_ORDER = ["z", "q", "t", "u", "v"]
+    with nc.Dataset(infp) as ds:
+        ds.set_auto_mask(False)
+        n_levels, n_lats, n_lons = ds.variables[VAR_ORDER[0]].shape[-3:]
+        remove_existing(outfp)
+        array = np.lib.format.open_memmap(
+            outfp, mode="w+", dtype=np.float32, shape=(len(VAR_ORDER), n_levels, n_lats, n_lons)
+        )
+        for i, v in enumerate(VAR_ORDER):
+            print(f"Processing {v}...")
+            for level in range(n_levels):
+                # reverse the vertical axis
+                array[i, n_levels - 1 - level] = ds.variables[v][time_index, level]
+        array.flush()
+        del array
+
+    print(f"Process peak RSS: {get_peak_rss() / 1024**2:.0f} MB")
+
+    return outfp
+
+
+@traced("ecmwf")
+def prepare_ecmwf(dt_obs, station_only=False, savefp=None, ctx=DEFAULT_CONTEXT):
+    dt_batch = dt_obs
+    print("Searching for the ECMWF forecast batch closest to the observation time.")
+    with TRACER.span("ecmwf_batch_search"):
+        while True:
+            TRACER.count("ecmwf_batches_checked_total")
+            batch_exist = check_ecmwf_dir_exist(dt_batch)
+            if batch_exist:
+                print(
+                    "Found the ECMWF forecast batch closest to the observation time, "
+                    f"the start time of which is：{dt_batch.isoformat()}"
+                )
+                with TRACER.span("ecmwf_download"):
+                    ecmwfp = download_ecmwf_data(dt_batch, dt_obs, ctx)
+                if ecmwfp:
+                    break
+                else:
+                    print("Failed to download the file from this batch, try again.")
+            dt_batch -= timedelta(hours=1)
 
-    array = np.stack(array)
+    with TRACER.span("ecmwf_transfer"):
+        ecmwfarray_fp = transfer_ecmwf(
+            ecmwfp, station_only=station_only, savefp=savefp, ctx=ctx
+        )
 
-    np.save(outfp, array)
+    return ecmwfarray_fp, dt_batch
 
 
-def transfer_upper(infp, outfp):
-    ds = nc.Dataset(infp)
-    VAR_ORDER = ["z", "q", "t", "u", "v"]
-    array = []
-    for v in VAR_ORDER:
-        print(f"Processing {v}...")
-        # reverse the vertical axis
-        data = ds.variables[v][0, ::-1].data.astype(np.float32)
-        array.append(data)
+@traced("gfs")
+def prepare_gfs(
+    dt_obs, station_only=False, savefp=None, deadline_at=None, ctx=DEFAULT_CONTEXT
+):
+    with TRACER.span("gfs_download"):
+        gfs_fp, gfs_batch_dt = download_gfs_data(dt_obs, deadline_at, ctx)
+    with TRACER.span("gfs_transfer"):
+        gfsarray_fp = transfer_gfs(gfs_fp, station_only=station_only, savefp=savefp, ctx=ctx)
 
-    array = np.stack(array)
+    return gfsarray_fp, gfs_batch_dt
 
-    np.save(outfp, array)
 
+def transfer_era5(surface_loc, upper_loc, era5_dt, savepath=None):
+    # 转换为盘古模型的输入，文件名中的时间戳即起报时间，默认写入共用的运行目录
+    savepath = savepath or DEFAULT_CONTEXT.run_dir
+    os.makedirs(savepath, exist_ok=True)
+    surfacefp, surface_time_index = surface_loc
+    upperfp, upper_time_index = upper_loc
+    timestamp = int(era5_dt.timestamp())
+    input_surface_fp = os.path.join(savepath, f"surface-{timestamp}.npy")
+    transfer_surface(surfacefp, input_surface_fp, surface_time_index)
+    input_upper_fp = os.path.join(savepath, f"upper-{timestamp}.npy")
+    transfer_upper(upperfp, input_upper_fp, upper_time_index)
+
+    return input_surface_fp, input_upper_fp
+
+
+@traced("era5")
+def prepare_era5(ctx=DEFAULT_CONTEXT):
+    with TRACER.span("era5_download"):
+        surface_loc, upper_loc, era5_dt = download_era5_data(load_era5_api_key)
+    with TRACER.span("era5_transfer"):
+        input_surface_fp, input_upper_fp = transfer_era5(
+            surface_loc, upper_loc, era5_dt, ctx.run_dir
+        )
+
+    return input_surface_fp, input_upper_fp, era5_dt
+
+
+def get_prepare_tasks(station_only=False, stages=None, deadline_at=None, ctx=DEFAULT_CONTEXT):
+    """
+    Task graph of ``prepare_all`` for ``pipeline.run_task_graph``.
+
+    ``stages`` may replace any of the ``observation``, ``ecmwf``, ``gfs`` and
+    ``era5`` stage functions, e.g. with offline stubs. ``ecmwf`` and ``gfs``
+    receive the ``(dt_obs, obs_count)`` result of ``observation``, the others
+    take no argument. ``deadline_at`` (a ``time.monotonic`` value) stops the
+    GFS search of the default ``gfs`` stage, and the default stages write
+    their files into the run directory of ``ctx``.
+    """
+    stages = {
+        "observation": lambda: prepare_observation(ctx=ctx),
+        "ecmwf": lambda obs: prepare_ecmwf(obs[0], station_only=station_only, ctx=ctx),
+        "gfs": lambda obs: prepare_gfs(
+            obs[0], station_only=station_only, deadline_at=deadline_at, ctx=ctx
+        ),
+        "era5": lambda: prepare_era5(ctx),
+        **(stages or {}),
+    }
 
-def prepare_all():
-    os.makedirs(TMP_DIR, exist_ok=True)
+    # ERA5 的起报时间只取决于当前时间，不必等待观测数据
+    return {
+        "observation": (stages["observation"], []),
+        "ecmwf": (stages["ecmwf"], ["observation"]),
+        "gfs": (stages["gfs"], ["observation"]),
+        "era5": (stages["era5"], []),
+    }
 
-    dt_obs, obs_count = prepare_observation()
 
-    dt_batch = dt_obs
-    print("Searching for the ECMWF forecast batch closest to the observation time.")
-    while True:
-        batch_exist = check_ecmwf_dir_exist(dt_batch)
-        if batch_exist:
-            print(
-                "Found the ECMWF forecast batch closest to the observation time, "
-                f"the start time of which is：{dt_batch.isoformat()}"
-            )
-            ecmwfp = download_ecmwf_data(dt_batch, dt_obs)
-            if ecmwfp:
-                break
-            else:
-                print("Failed to download the file from this batch, try again.")
-        dt_batch -= timedelta(hours=1)
+def prepare_all(station_only=False, stages=None, deadline_at=None, ctx=DEFAULT_CONTEXT):
+    """
+    Download and convert every input of a verification run.
 
-    ecmwfarray_fp = transfer_ecmwf(ecmwfp)
+    The stages run as a task graph: the ERA5 retrieval starts right away next
+    to the observation crawl, and the ECMWF and GFS downloads start as soon as
+    the observation time is known. ``stages`` replaces stage functions, see
+    ``get_prepare_tasks``; the time spent in each stage is returned under
+    ``timings``.
 
-    gfs_fp, gfs_batch_dt = download_gfs_data(dt_obs)
-    gfsarray_fp = transfer_gfs(gfs_fp)
+    With ``station_only``, ECMWF and GFS fields are sampled bilinearly at the
+    station coordinates into compact ``station-*.npy`` tables of shape
+    ``(3, n_stations)`` instead of being saved as full 721x1440 fields.
 
-    surfacefp, upperfp, era5_dt = download_era5_data(ERA5_API_KEY)
-    timestamp = int(era5_dt.timestamp())
-    input_surface_fp = os.path.join(TMP_DIR, f"surface-{timestamp}.npy")
-    transfer_surface(surfacefp, input_surface_fp)
-    input_upper_fp = os.path.join(TMP_DIR, f"upper-{timestamp}.npy")
-    transfer_upper(upperfp, input_upper_fp)
+    When ``deadline_at`` (a ``time.monotonic`` value) passes, the stages of
+    ``OPTIONAL_STAGES`` still running are dropped and their outputs are
+    ``None``, so the run is verified without them instead of overrunning.
+
+    Every file is written into the run directory of ``ctx``, a
+    ``context.RunContext``; ``context.DEFAULT_CONTEXT``, whose run directory
+    is the shared ``context.TMP_DIR``, by default.
+    """
+    os.makedirs(ctx.run_dir, exist_ok=True)
+
+    results, timings = run_task_graph(
+        get_prepare_tasks(station_only, stages, deadline_at, ctx),
+        optional=OPTIONAL_STAGES,
+        deadline_at=deadline_at,
+    )
+
+    return collect_prepare_result(results, timings)
+
+
+def collect_prepare_result(results, timings):
+    dt_obs, obs_count = results["observation"]
+    ecmwfarray_fp, dt_batch = results["ecmwf"] or (None, None)
+    gfsarray_fp, gfs_batch_dt = results["gfs"] or (None, None)
+    input_surface_fp, input_upper_fp, era5_dt = results["era5"]
+    for name, timing in timings.items():
+        if timing.get("dropped"):
+            TRACER.count("stages_dropped_total", stage=name)
+            print(f"Stage {name} was dropped after {timing['seconds']:.2f}s")
+        else:
+            print(f"Stage {name} took {timing['seconds']:.2f}s")
     print("Prepare work has been completed, you can continue to start prediction work.")
 
     return {
@@ -366,6 +814,7 @@ def prepare_all():
         "gfs_batch_dt": gfs_batch_dt,
         "era5_dt": era5_dt,
         "obs_count": obs_count,
+        "timings": timings,
     }
 
 
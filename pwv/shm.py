@@ -0,0 +1,208 @@
+import os
+import queue
+import multiprocessing as mp
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+from pwv.grid import STATION_INFO_FP, load_station_idx
+
+# 盘古地面输出（msl, u10, v10, t2m）的形状
+SURFACE_SHAPE = (4, 721, 1440)
+# 每个槽位的元数据，步长路径以 "24,24,6" 的形式保存
+HEADER_DTYPE = np.dtype([("init_timestamp", "i8"), ("lead", "i4"), ("path", "S64")])
+# 元数据区按 4KB 对齐，数据区从整页开始
+PAGE_SIZE = 4096
+
+
+class RingItem:
+    """
+    One state taken from a ``SurfaceRing``.
+
+    ``surface`` is a read-only view of the slot, valid until ``release``,
+    also called when leaving a ``with`` block, hands the slot back to the
+    publisher. Copy it first to keep it longer.
+    """
+
+    def __init__(self, ring, slot) -> None:
+        self.ring = ring
+        self.slot = slot
+        header = ring.header[slot]
+        self.init_timestamp = int(header["init_timestamp"])
+        self.lead = int(header["lead"])
+        path = header["path"].decode()
+        self.path = tuple(int(step) for step in path.split(",")) if path else ()
+        self.surface = ring.slots[slot]
+        self.surface.flags.writeable = False
+
+    def release(self):
+        if self.surface is not None:
+            self.surface = None
+            self.ring.free.put(self.slot)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+class SurfaceRing:
+    """
+    Ring buffer of surface states in named shared memory.
+
+    The prediction process passes the ring as ``sink`` to
+    ``predict.iteratively_predict`` or ``predict.predict_leads``: every
+    surface state is copied into a free slot together with its init time,
+    lead and step path, and the slot is queued for the workers. Workers get
+    the ring as an argument of their ``multiprocessing.Process``, which
+    attaches to the same memory, and take states with ``get`` or by
+    iterating, without copying them. Each state goes to one worker.
+
+    When all ``n_slots`` slots are taken the publisher waits for a worker to
+    release one, up to ``timeout`` seconds. With ``leads``, only the states
+    at those leads are published. The upper-air states are not kept.
+
+    ``close`` tells the workers that no state follows and ``unlink``, both
+    called when leaving a ``with`` block in the process that created the
+    ring, frees the memory.
+    """
+
+    def __init__(
+        self,
+        n_slots=4,
+        shape=SURFACE_SHAPE,
+        dtype=np.float32,
+        leads=None,
+        timeout=600,
+        name=None,
+    ) -> None:
+        self.n_slots = n_slots
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.leads = set(leads) if leads is not None else None
+        self.timeout = timeout
+        header_size = -(-n_slots * HEADER_DTYPE.itemsize // PAGE_SIZE) * PAGE_SIZE
+        self.offset = header_size
+        size = header_size + n_slots * int(np.prod(self.shape)) * self.dtype.itemsize
+        self.shm = SharedMemory(name=name, create=True, size=size)
+        self.owner = os.getpid()
+        self.free = mp.Queue()
+        self.ready = mp.Queue()
+        for slot in range(n_slots):
+            self.free.put(slot)
+        self.attach()
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def attach(self):
+        self.header = np.ndarray((self.n_slots,), HEADER_DTYPE, buffer=self.shm.buf)
+        self.slots = np.ndarray(
+            (self.n_slots,) + self.shape,
+            self.dtype,
+            buffer=self.shm.buf,
+            offset=self.offset,
+        )
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["header"], state["slots"]
+
+        return state
+
+    def __setstate__(self, state):
+        # SharedMemory 在反序列化时按名称重新连接到同一块内存
+        self.__dict__.update(state)
+        self.attach()
+
+    def write(self, init_timestamp, lead, surface_array, upper_array=None, path=None):
+        """
+        Publish one surface state, the ``sink`` interface of ``predict``.
+        """
+        if self.leads is not None and lead not in self.leads:
+            return
+        try:
+            slot = self.free.get(timeout=self.timeout)
+        except queue.Empty:
+            raise TimeoutError(f"No slot of {self.name} released in {self.timeout}s")
+
+        self.slots[slot] = surface_array
+        self.header[slot] = (
+            init_timestamp,
+            lead,
+            ",".join(str(step) for step in path or ()).encode(),
+        )
+        self.ready.put(slot)
+
+    def get(self, timeout=None):
+        """
+        Take the next state, or ``None`` once the ring is closed.
+        """
+        slot = self.ready.get(timeout=timeout)
+        if slot is None:
+            # 让其余的工作进程也能收到结束标记
+            self.ready.put(None)
+            return None
+
+        return RingItem(self, slot)
+
+    def __iter__(self):
+        while True:
+            item = self.get()
+            if item is None:
+                return
+            yield item
+
+    def close(self):
+        self.ready.put(None)
+
+    def unlink(self):
+        # 先释放对共享内存的引用，否则无法关闭
+        self.header = self.slots = None
+        self.shm.close()
+        if os.getpid() == self.owner:
+            self.shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+        self.unlink()
+
+
+def station_worker(ring, savepath, station_idx=None):
+    """
+    Save the station values of every state of ``ring``.
+
+    Each state is saved as a ``(channel, station)`` table
+    ``station-pangu-{init_timestamp}-{lead}.npy`` in ``savepath``, in the
+    station order of ``station_idx`` (the Pangu station index by default),
+    which ``verify`` reads like a field.
+    """
+    if station_idx is None:
+        station_idx = load_station_idx("pangu", STATION_INFO_FP)
+    iy, ix = station_idx[:, 1], station_idx[:, 2]
+
+    for item in ring:
+        with item:
+            table = item.surface[:, iy, ix]
+        fp = os.path.join(
+            savepath, f"station-pangu-{item.init_timestamp}-{item.lead}.npy"
+        )
+        np.save(fp, table)
+        print(f"Saved station values at {item.lead}h to {fp}")
+
+
+def start_station_workers(ring, savepath, n_workers=2):
+    station_idx = load_station_idx("pangu", STATION_INFO_FP)
+    workers = [
+        mp.Process(target=station_worker, args=(ring, savepath, station_idx))
+        for _ in range(n_workers)
+    ]
+    for worker in workers:
+        worker.start()
+
+    return workers
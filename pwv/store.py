@@ -0,0 +1,187 @@
+import os
+import glob
+
+import numpy as np
+import netCDF4 as nc
+
+from pwv.grid import get_grid_axes
+
+STORE_DIR = os.environ.get(
+    "PWV_STORE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "store")
+)
+SURFACE_VARIABLES = ["msl", "u10", "v10", "t2m"]
+UPPER_VARIABLES = ["z", "q", "t", "u", "v"]
+# 盘古输入输出中气压层的顺序
+PANGU_LEVELS = [1000, 925, 850, 700, 600, 500, 400, 300, 250, 200, 150, 100, 50]
+# 每个块为一个时效、一个层次上 121x240 的区域，读取单层或局部区域时只需解压用到的块
+CHUNK_SHAPE = (121, 240)
+
+
+class TrajectoryStore:
+    """
+    Compressed, chunked store of forecast trajectories.
+
+    Each init time is one NetCDF4 file ``trajectory-{init_timestamp}.nc``
+    with an unlimited ``lead`` axis (hours), holding the surface variables as
+    ``(lead, lat, lon)`` and the upper-air variables as ``(lead, level, lat,
+    lon)``. Variables are zlib-compressed with byte shuffling in chunks of a
+    single lead, level and ``CHUNK_SHAPE`` tile, so one variable, one level
+    or one group of stations is read without decompressing whole states.
+
+    Compression is lossless by default. ``least_significant_digit``, either
+    one number for all variables or a dict by variable name, quantizes values
+    to that many decimal digits first, which bounds the error to half a unit
+    of the last digit kept and compresses much better.
+
+    A store can be passed as ``sink`` to ``predict.iteratively_predict`` to
+    keep every state of a rollout.
+    """
+
+    def __init__(
+        self, store_dir=STORE_DIR, least_significant_digit=None, complevel=4
+    ) -> None:
+        self.store_dir = store_dir
+        self.least_significant_digit = least_significant_digit
+        self.complevel = complevel
+
+    def get_fp(self, init_timestamp):
+        return os.path.join(self.store_dir, f"trajectory-{int(init_timestamp)}.nc")
+
+    def get_digits(self, varname):
+        if isinstance(self.least_significant_digit, dict):
+            return self.least_significant_digit.get(varname)
+
+        return self.least_significant_digit
+
+    def create(self, fp):
+        lons, lats = get_grid_axes("pangu")
+        ds = nc.Dataset(fp, "w", format="NETCDF4")
+        ds.createDimension("lead", None)
+        ds.createDimension("level", len(PANGU_LEVELS))
+        ds.createDimension("lat", len(lats))
+        ds.createDimension("lon", len(lons))
+        ds.createVariable("lead", "i4", ("lead",))
+        ds.createVariable("level", "i4", ("level",))[:] = PANGU_LEVELS
+        ds.createVariable("lat", "f8", ("lat",))[:] = lats
+        ds.createVariable("lon", "f8", ("lon",))[:] = lons
+
+        for varname in SURFACE_VARIABLES:
+            ds.createVariable(
+                varname,
+                "f4",
+                ("lead", "lat", "lon"),
+                zlib=True,
+                complevel=self.complevel,
+                shuffle=True,
+                chunksizes=(1,) + CHUNK_SHAPE,
+                least_significant_digit=self.get_digits(varname),
+            )
+        for varname in UPPER_VARIABLES:
+            ds.createVariable(
+                varname,
+                "f4",
+                ("lead", "level", "lat", "lon"),
+                zlib=True,
+                complevel=self.complevel,
+                shuffle=True,
+                chunksizes=(1, 1) + CHUNK_SHAPE,
+                least_significant_digit=self.get_digits(varname),
+            )
+
+        return ds
+
+    def write(self, init_timestamp, lead, surface_array, upper_array, path=None):
+        """
+        Store the state at ``lead`` hours, replacing an existing one. The
+        step ``path`` given by ``predict`` is not stored.
+        """
+        os.makedirs(self.store_dir, exist_ok=True)
+        fp = self.get_fp(init_timestamp)
+        ds = nc.Dataset(fp, "a") if os.path.exists(fp) else self.create(fp)
+        with ds:
+            leads = list(ds.variables["lead"][:])
+            i = leads.index(lead) if lead in leads else len(leads)
+            ds.variables["lead"][i] = lead
+            for c, varname in enumerate(SURFACE_VARIABLES):
+                ds.variables[varname][i] = surface_array[c]
+            for c, varname in enumerate(UPPER_VARIABLES):
+                ds.variables[varname][i] = upper_array[c]
+
+    def inits(self):
+        fps = glob.glob(os.path.join(self.store_dir, "trajectory-*.nc"))
+
+        return sorted(
+            int(os.path.basename(fp)[len("trajectory-") : -len(".nc")]) for fp in fps
+        )
+
+    def leads(self, init_timestamp):
+        with nc.Dataset(self.get_fp(init_timestamp)) as ds:
+            return [int(lead) for lead in ds.variables["lead"][:]]
+
+    def open(self, init_timestamp, lead):
+        ds = nc.Dataset(self.get_fp(init_timestamp))
+        ds.set_auto_mask(False)
+        leads = [int(value) for value in ds.variables["lead"][:]]
+        if lead not in leads:
+            ds.close()
+            raise KeyError(f"Lead {lead}h of init {init_timestamp} is not stored")
+
+        return ds, leads.index(lead)
+
+    def read(self, init_timestamp, lead, varname, level=None, region=None):
+        """
+        One variable at ``lead`` hours.
+
+        ``level`` picks a pressure level (hPa) of an upper-air variable, all
+        levels are returned otherwise. ``region`` is an optional ``(lat_slice,
+        lon_slice)`` of grid indices.
+        """
+        lat_slice, lon_slice = region or (slice(None), slice(None))
+        ds, i = self.open(init_timestamp, lead)
+        with ds:
+            var = ds.variables[varname]
+            if varname in SURFACE_VARIABLES:
+                return var[i, lat_slice, lon_slice]
+            if level is None:
+                return var[i, :, lat_slice, lon_slice]
+
+            return var[i, PANGU_LEVELS.index(level), lat_slice, lon_slice]
+
+    def read_stations(self, init_timestamp, lead, varname, station_idx, level=None):
+        """
+        Values of one variable at grid points such as stations.
+
+        ``station_idx`` holds ``(iy, ix)`` rows, or the ``(sid, iy, ix)`` rows
+        of ``grid.load_station_idx``. Only the chunks holding a point are read.
+        Returns an array of shape ``(n_points,)``, or ``(n_levels, n_points)``
+        for all levels of an upper-air variable.
+        """
+        station_idx = np.asarray(station_idx)
+        iy, ix = station_idx[:, -2], station_idx[:, -1]
+        tiles = np.stack([iy // CHUNK_SHAPE[0], ix // CHUNK_SHAPE[1]], axis=1)
+
+        ds, i = self.open(init_timestamp, lead)
+        with ds:
+            var = ds.variables[varname]
+            if varname in SURFACE_VARIABLES:
+                prefix = (i,)
+            elif level is None:
+                prefix = (i, slice(None))
+            else:
+                prefix = (i, PANGU_LEVELS.index(level))
+            values = None
+            for tile in np.unique(tiles, axis=0):
+                y0, x0 = tile[0] * CHUNK_SHAPE[0], tile[1] * CHUNK_SHAPE[1]
+                tile_slices = (
+                    slice(y0, y0 + CHUNK_SHAPE[0]),
+                    slice(x0, x0 + CHUNK_SHAPE[1]),
+                )
+                block = var[prefix + tile_slices]
+                if values is None:
+                    values = np.empty(
+                        block.shape[:-2] + (len(station_idx),), dtype=block.dtype
+                    )
+                points = np.all(tiles == tile, axis=1)
+                values[..., points] = block[..., iy[points] - y0, ix[points] - x0]
+
+        return values
@@ -0,0 +1,252 @@
+import os
+import sys
+import json
+import time
+import resource
+import functools
+import threading
+from contextlib import contextmanager
+from urllib.parse import urlparse
+
+from pwv.cache import atomic_write
+
+# 设置后每轮结束时把指标再写一份到固定路径，供 node_exporter 的 textfile collector 读取
+PROM_TEXTFILE = os.environ.get("PWV_PROM_TEXTFILE")
+METRIC_PREFIX = "pwv"
+
+
+def get_peak_rss():
+    # 整个进程生命周期内的峰值，ru_maxrss 在 Linux 上的单位是 KB，在 macOS 上是字节
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def get_rss():
+    # 当前的常驻内存（字节），没有 /proc 的系统上为 None
+    try:
+        with open("/proc/self/statm") as f:
+            resident_pages = int(f.read().split()[1])
+    except (OSError, IndexError, ValueError):
+        return None
+
+    return resident_pages * os.sysconf("SC_PAGE_SIZE")
+
+
+def get_host(url):
+    return urlparse(url).netloc
+
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    pairs = ",".join(f'{key}="{escape_label(value)}"' for key, value in labels)
+
+    return f"{{{pairs}}}"
+
+
+class Tracer:
+    """
+    Process-wide record of the spans and counters of one run.
+
+    A span times a block of work and records the RSS of the process when it
+    starts and ends (``rss_start``, ``rss_end``) and the peak RSS of the
+    process so far (``process_peak_rss``, not specific to the span). A span
+    opened inside another one of the same thread keeps it as ``parent``;
+    work handed to another thread keeps the span it was submitted from when
+    wrapped with ``bind``. Counters add up values by name and labels, such
+    as the bytes downloaded from each host. The prepare stages run on a
+    thread pool, so recording is thread-safe.
+
+    ``dump`` exports everything as JSON lines and as a Prometheus text file.
+    """
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.spans = []
+            self.counters = {}
+            self.span_count = 0
+
+    def current_span(self):
+        stack = self.local.__dict__.get("stack")
+
+        return stack[-1] if stack else None
+
+    @contextmanager
+    def parent(self, span_id):
+        """
+        Open the spans of this block under ``span_id``, a span of another
+        thread. ``None`` leaves them without a parent.
+        """
+        if span_id is None:
+            yield
+            return
+        stack = self.local.__dict__.setdefault("stack", [])
+        stack.append(span_id)
+        try:
+            yield
+        finally:
+            stack.pop()
+
+    def bind(self, func):
+        """
+        Wrap ``func`` to run under the span current here, e.g. when it is
+        submitted to a thread pool.
+        """
+        span_id = self.current_span()
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with self.parent(span_id):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    @contextmanager
+    def span(self, name, **attrs):
+        stack = self.local.__dict__.setdefault("stack", [])
+        with self.lock:
+            span_id = self.span_count
+            self.span_count += 1
+        record = {
+            "id": span_id,
+            "name": name,
+            "parent": stack[-1] if stack else None,
+            "thread": threading.current_thread().name,
+            "start": time.time(),
+            "attrs": attrs,
+            "rss_start": get_rss(),
+        }
+        stack.append(span_id)
+        t0 = time.perf_counter()
+        status = "error"
+        try:
+            yield record["attrs"]
+            status = "ok"
+        finally:
+            stack.pop()
+            record.update(
+                end=time.time(),
+                seconds=time.perf_counter() - t0,
+                status=status,
+                rss_end=get_rss(),
+                process_peak_rss=get_peak_rss(),
+            )
+            with self.lock:
+                self.spans.append(record)
+
+    def count(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def get_records(self):
+        with self.lock:
+            spans = sorted(self.spans, key=lambda span: span["id"])
+            counters = dict(self.counters)
+
+        records = [{"type": "span", **span} for span in spans]
+        records.extend(
+            {"type": "counter", "name": name, "labels": dict(labels), "value": value}
+            for (name, labels), value in sorted(counters.items())
+        )
+        records.append(
+            {"type": "gauge", "name": "process_peak_rss_bytes", "value": get_peak_rss()}
+        )
+
+        return records
+
+    def to_prometheus(self):
+        records = self.get_records()
+        span_seconds = {}
+        for record in records:
+            if record["type"] == "span":
+                key = (("span", record["name"]), ("status", record["status"]))
+                seconds, count = span_seconds.get(key, (0, 0))
+                span_seconds[key] = (seconds + record["seconds"], count + 1)
+
+        lines = [f"# TYPE {METRIC_PREFIX}_span_seconds summary"]
+        for labels, (seconds, count) in sorted(span_seconds.items()):
+            lines.append(f"{METRIC_PREFIX}_span_seconds_sum{format_labels(labels)} {seconds}")
+            lines.append(f"{METRIC_PREFIX}_span_seconds_count{format_labels(labels)} {count}")
+
+        typed = set()
+        for record in records:
+            metric = f"{METRIC_PREFIX}_{record['name']}"
+            if record["type"] == "span":
+                continue
+            if metric not in typed:
+                lines.append(f"# TYPE {metric} {record['type']}")
+                typed.add(metric)
+            labels = sorted(record.get("labels", {}).items())
+            lines.append(f"{metric}{format_labels(labels)} {record['value']}")
+
+        lines.append(f"# TYPE {METRIC_PREFIX}_last_run_timestamp_seconds gauge")
+        lines.append(f"{METRIC_PREFIX}_last_run_timestamp_seconds {time.time()}")
+
+        return "\n".join(lines) + "\n"
+
+    def dump(self, prefix):
+        """
+        Write ``{prefix}.trace.jsonl`` and ``{prefix}.prom``, and the
+        Prometheus file also to ``PWV_PROM_TEXTFILE`` when it is set.
+
+        Returns the paths of both files.
+        """
+        trace_fp = f"{prefix}.trace.jsonl"
+        prom_fp = f"{prefix}.prom"
+        os.makedirs(os.path.dirname(os.path.abspath(trace_fp)), exist_ok=True)
+        with open(trace_fp, "w") as f:
+            for record in self.get_records():
+                f.write(json.dumps(record, default=str) + "\n")
+
+        prom_text = self.to_prometheus()
+        with open(prom_fp, "w") as f:
+            f.write(prom_text)
+        if PROM_TEXTFILE:
+            # 原子替换，collector 不会读到半截文件
+            atomic_write(PROM_TEXTFILE, lambda f: f.write(prom_text), mode="w")
+
+        return trace_fp, prom_fp
+
+
+TRACER = Tracer()
+
+
+def traced(name):
+    """
+    Decorator running the function inside a span of ``TRACER``.
+    """
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with TRACER.span(name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def count_retries(name):
+    """
+    ``before_attempts`` hook of ``retrying.retry`` counting the retries of
+    the decorated function under ``retries_total``.
+    """
+
+    def before_attempts(attempt_number):
+        # 第一次之后的尝试都是重试
+        if attempt_number > 1:
+            TRACER.count("retries_total", function=name)
+
+    return before_attempts
@@ -0,0 +1,230 @@
+import os
+import sys
+import json
+import time
+import hashlib
+import itertools
+
+import numpy as np
+
+import onnxruntime as ort
+
+from pwv.cache import CACHE_DIR, FILE_MODE, atomic_dump_json
+from pwv.models import get_model_fp
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+PROFILES_FP = os.path.join(STATIC_DIR, "ort_profiles.json")
+
+# 默认配置与最初的设置一致：单线程、关闭内存池，内存占用最小但速度最慢
+DEFAULT_PROFILE = {
+    "intra_op_num_threads": 1,
+    "inter_op_num_threads": 1,
+    "execution_mode": "sequential",
+    "enable_cpu_mem_arena": False,
+    "enable_mem_pattern": False,
+    "enable_mem_reuse": False,
+    "graph_optimization_level": "all",
+    "cache_optimized_model": False,
+}
+
+EXECUTION_MODES = {
+    "sequential": ort.ExecutionMode.ORT_SEQUENTIAL,
+    "parallel": ort.ExecutionMode.ORT_PARALLEL,
+}
+GRAPH_OPTIMIZATION_LEVELS = {
+    "disable_all": ort.GraphOptimizationLevel.ORT_DISABLE_ALL,
+    "basic": ort.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+    "extended": ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+    "all": ort.GraphOptimizationLevel.ORT_ENABLE_ALL,
+}
+
+
+def load_profiles(profiles_fp=PROFILES_FP):
+    if not os.path.exists(profiles_fp):
+        return {}
+    with open(profiles_fp) as f:
+        return json.load(f)
+
+
+def get_execution_profile(step_mode, profiles_fp=PROFILES_FP):
+    """
+    Execution profile of a model: the defaults updated with the saved
+    profile of ``step_mode`` in ``ort_profiles.json``, if any.
+    """
+    profile = dict(DEFAULT_PROFILE)
+    profile.update(load_profiles(profiles_fp).get(str(step_mode), {}))
+
+    return profile
+
+
+def save_execution_profile(step_mode, profile, profiles_fp=PROFILES_FP):
+    profiles = load_profiles(profiles_fp)
+    profiles[str(step_mode)] = profile
+    atomic_dump_json(profiles_fp, profiles)
+
+
+def get_optimized_model_fp(modelfp, profile):
+    # 优化后的图与优化级别有关，不同级别分别缓存
+    stat = os.stat(modelfp)
+    identity = json.dumps(
+        [os.path.basename(modelfp), stat.st_size, stat.st_mtime_ns, profile["graph_optimization_level"]]
+    )
+    digest = hashlib.sha256(identity.encode("utf8")).hexdigest()[:16]
+    fn = os.path.splitext(os.path.basename(modelfp))[0]
+
+    return os.path.join(CACHE_DIR, f"{fn}.{digest}.optimized.onnx")
+
+
+def build_session_options(profile, modelfp=None):
+    """
+    ``SessionOptions`` for an execution profile.
+
+    With ``cache_optimized_model``, the graph optimized for ``modelfp`` is
+    serialized on the first load, into a temporary file of this process that
+    ``create_inference_session`` moves into the cache directory once the
+    session is built. Returns the options and the model path to load, which
+    is the serialized optimized graph once it exists.
+    """
+    options = ort.SessionOptions()
+    options.intra_op_num_threads = profile["intra_op_num_threads"]
+    options.inter_op_num_threads = profile["inter_op_num_threads"]
+    options.execution_mode = EXECUTION_MODES[profile["execution_mode"]]
+    options.enable_cpu_mem_arena = profile["enable_cpu_mem_arena"]
+    options.enable_mem_pattern = profile["enable_mem_pattern"]
+    options.enable_mem_reuse = profile["enable_mem_reuse"]
+    options.graph_optimization_level = GRAPH_OPTIMIZATION_LEVELS[
+        profile["graph_optimization_level"]
+    ]
+
+    if modelfp and profile["cache_optimized_model"]:
+        optimized_fp = get_optimized_model_fp(modelfp, profile)
+        if os.path.exists(optimized_fp):
+            # 已经优化过的图不需要再次优化
+            options.graph_optimization_level = GRAPH_OPTIMIZATION_LEVELS["disable_all"]
+            modelfp = optimized_fp
+        else:
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            # 先写入本进程的临时文件，被中断或多个进程同时加载时不会留下半截的优化图
+            options.optimized_model_filepath = (
+                f"{optimized_fp[: -len('.onnx')]}.{os.getpid()}.tmp.onnx"
+            )
+
+    return options, modelfp
+
+
+def create_inference_session(modelfp, profile, providers):
+    """
+    ``InferenceSession`` of ``modelfp`` with the options of ``profile``.
+
+    A cached optimized graph that fails to load is deleted and the session is
+    built again from ``modelfp``, which serializes a new one.
+    """
+    options, load_fp = build_session_options(profile, modelfp)
+    try:
+        ort_session = ort.InferenceSession(load_fp, sess_options=options, providers=providers)
+    except Exception as e:
+        if load_fp == modelfp:
+            raise
+        print(f"Discarding unreadable optimized model {os.path.basename(load_fp)}: {e!r}")
+        if os.path.exists(load_fp):
+            os.remove(load_fp)
+        options, load_fp = build_session_options(profile, modelfp)
+        ort_session = None
+
+    tmp_fp = options.optimized_model_filepath
+    try:
+        if ort_session is None:
+            ort_session = ort.InferenceSession(
+                load_fp, sess_options=options, providers=providers
+            )
+        if tmp_fp:
+            os.chmod(tmp_fp, FILE_MODE)
+            os.replace(tmp_fp, get_optimized_model_fp(modelfp, profile))
+    finally:
+        if tmp_fp and os.path.exists(tmp_fp):
+            os.remove(tmp_fp)
+
+    return ort_session
+
+
+def get_candidate_profiles(cpu_count=None):
+    cpu_count = cpu_count or os.cpu_count() or 1
+    thread_counts = sorted({1, max(cpu_count // 4, 1), max(cpu_count // 2, 1), cpu_count})
+
+    candidates = []
+    for intra_threads, execution_mode, memory_arena, optimization_level in itertools.product(
+        thread_counts, ["sequential", "parallel"], [False, True], ["extended", "all"]
+    ):
+        candidates.append(
+            {
+                "intra_op_num_threads": intra_threads,
+                "inter_op_num_threads": 1 if execution_mode == "sequential" else 2,
+                "execution_mode": execution_mode,
+                "enable_cpu_mem_arena": memory_arena,
+                "enable_mem_pattern": memory_arena,
+                "enable_mem_reuse": memory_arena,
+                "graph_optimization_level": optimization_level,
+                "cache_optimized_model": False,
+            }
+        )
+
+    return candidates
+
+
+def make_dummy_inputs(ort_session):
+    inputs = {}
+    for node in ort_session.get_inputs():
+        shape = [dim if isinstance(dim, int) else 1 for dim in node.shape]
+        inputs[node.name] = np.zeros(shape, dtype=np.float32)
+
+    return inputs
+
+
+def benchmark_profile(modelfp, profile, repeats=2):
+    options, load_fp = build_session_options(profile)
+    t0 = time.perf_counter()
+    ort_session = ort.InferenceSession(
+        load_fp or modelfp, sess_options=options, providers=["CPUExecutionProvider"]
+    )
+    load_seconds = time.perf_counter() - t0
+
+    inputs = make_dummy_inputs(ort_session)
+    # 第一次推理包含内存分配等预热开销，不计入
+    ort_session.run(None, inputs)
+    t0 = time.perf_counter()
+    for _ in range(repeats):
+        ort_session.run(None, inputs)
+    run_seconds = (time.perf_counter() - t0) / repeats
+
+    return load_seconds, run_seconds
+
+
+def autotune(step_modes=(1, 3, 6, 24), candidates=None, repeats=2, profiles_fp=PROFILES_FP):
+    """
+    Benchmark candidate profiles on this machine and save the fastest one of
+    each model to ``ort_profiles.json``, with optimized model caching on.
+    """
+    candidates = candidates or get_candidate_profiles()
+    best_profiles = {}
+    for step_mode in step_modes:
+        modelfp = get_model_fp(step_mode)
+        best = None
+        for profile in candidates:
+            load_seconds, run_seconds = benchmark_profile(modelfp, profile, repeats)
+            print(
+                f"{os.path.basename(modelfp)} {json.dumps(profile)}: "
+                f"load {load_seconds:.2f}s, run {run_seconds:.2f}s"
+            )
+            if best is None or run_seconds < best[0]:
+                best = (run_seconds, profile)
+
+        profile = dict(best[1], cache_optimized_model=True)
+        save_execution_profile(step_mode, profile, profiles_fp)
+        best_profiles[step_mode] = profile
+        print(f"Fastest profile of {os.path.basename(modelfp)}: {best[0]:.2f}s")
+
+    return best_profiles
+
+
+if __name__ == "__main__":
+    autotune([int(step_mode) for step_mode in sys.argv[1:]] or (1, 3, 6, 24))
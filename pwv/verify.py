@@ -7,42 +7,26 @@ import pandas as pd
 
 from cyeva import Comparison, WindComparison
 
+from pwv.context import DEFAULT_CONTEXT
+from pwv.grid import load_station_idx
+from pwv.trace import traced
+
 STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
 STATION_INFO_FP = os.path.join(STATIC_DIR, "station_info.csv")
-TMP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tmp")
+# 各个地面场数组中变量所在的通道
+PANGU_SURFACE_CHANNELS = {"u10": 1, "v10": 2, "t2m": 3}
+SURFACE_CHANNELS = {"u10": 0, "v10": 1, "t2m": 2}
 
 
-def get_observation():
-    df = pd.read_csv(os.path.join(TMP_DIR, "obervation.csv"))
+def get_observation(obs_fp=None):
+    df = pd.read_csv(obs_fp or DEFAULT_CONTEXT.path("obervation.csv"))
 
     return df[["sid", "wind_speed", "wind_direction", "temperature"]]
 
 
-def get_nearest_idx(points, point):
-    return np.abs(points - point).argmin()
-
-
 def get_pangu_station_idx():
-    pangu_idx_fp = os.path.join(TMP_DIR, "pangu_station_idx.json")
-    if os.path.exists(pangu_idx_fp):
-        with open(pangu_idx_fp) as f:
-            pangu_idx = json.load(f)
-    else:
-        wlon = np.linspace(0, 359.75, 1440)
-        wlat = np.linspace(90, -90, 721)
-
-        station_df = pd.read_csv(STATION_INFO_FP)
-        sids = station_df["区站号"].tolist()
-        lons = station_df["经度"].tolist()
-        lats = station_df["纬度"].tolist()
-        pangu_idx = {}
-        for sid, lon, lat in zip(sids, lons, lats):
-            ix = int(get_nearest_idx(wlon, lon))
-            iy = int(get_nearest_idx(wlat, lat))
-            pangu_idx[sid] = (iy, ix)
-
-        with open(pangu_idx_fp, "w") as f:
-            json.dump(pangu_idx, f)
+    station_idx = load_station_idx("pangu", STATION_INFO_FP)
+    pangu_idx = {int(sid): (int(iy), int(ix)) for sid, iy, ix in station_idx}
 
     return pangu_idx
 
@@ -69,74 +53,67 @@ def uv_to_wind_speed_direction(u, v):
     return speed, direction
 
 
+def extract_station_values(sources, station_idx=None):
+    """
+    Pick the station values of many fields in one fancy-indexing pass.
+
+    Parameters:
+    sources : dict
+        Maps a model name to ``(array_fp, variables)``, where ``variables``
+        maps a variable name to its channel in the array stored at
+        ``array_fp``, either a ``(channel, lat, lon)`` field or a
+        ``(channel, station)`` table from the station-only mode.
+    station_idx : np.ndarray
+        ``(sid, iy, ix)`` rows, the Pangu station index by default.
+
+    Returns:
+    sids : np.ndarray
+        Station ids.
+    values : dict
+        ``values[model][variable]`` is the array of station values.
+    """
+    if station_idx is None:
+        station_idx = load_station_idx("pangu", STATION_INFO_FP)
+    sids = station_idx[:, 0]
+    iy = station_idx[None, :, 1]
+    ix = station_idx[None, :, 2]
+
+    values = {}
+    for model, (array_fp, variables) in sources.items():
+        # 内存映射读取，只有站点所在的数据页会被真正读入内存
+        array = np.load(array_fp, mmap_mode="r")
+        channels = np.array(list(variables.values()))
+        if array.ndim == 2:
+            # 站点表，各列与站点列表的顺序一致
+            station_values = np.asarray(array[channels])
+        else:
+            station_values = np.asarray(array[channels[:, None], iy, ix])
+        values[model] = dict(zip(variables, station_values))
+
+    return sids, values
+
+
 def extract_station_forecast_data(pangu_surf_fp, ecmwf_surf_fp, gfs_surf_fp):
-    pangu_surf_array = np.load(pangu_surf_fp)
-    ecmwf_surf_array = np.load(ecmwf_surf_fp)
-    gfs_surf_array = np.load(gfs_surf_fp)
-    pangu_idx = get_pangu_station_idx()
-    sids = []
-
-    pangu_u10s = []
-    pangu_v10s = []
-    pangu_t2ms = []
-
-    ec_u10s = []
-    ec_v10s = []
-    ec_t2ms = []
-
-    gfs_u10s = []
-    gfs_v10s = []
-    gfs_t2ms = []
-
-    for sid, (iy, ix) in pangu_idx.items():
-        pangu_data = pangu_surf_array[:, iy, ix]
-        ec_data = ecmwf_surf_array[:, iy, ix]
-        gfs_data = gfs_surf_array[:, iy, ix]
-        sids.append(sid)
-        pangu_u10s.append(pangu_data[1])
-        pangu_v10s.append(pangu_data[2])
-        pangu_t2ms.append(pangu_data[3])
-
-        ec_u10s.append(ec_data[0])
-        ec_v10s.append(ec_data[1])
-        ec_t2ms.append(ec_data[2])
-
-        gfs_u10s.append(gfs_data[0])
-        gfs_v10s.append(gfs_data[1])
-        gfs_t2ms.append(gfs_data[2])
-
-    pangu_u10s = np.array(pangu_u10s)
-    pangu_v10s = np.array(pangu_v10s)
-    pangu_t2ms = np.array(pangu_t2ms)
-    pangu_ws10s, pangu_wd10s = uv_to_wind_speed_direction(pangu_u10s, pangu_v10s)
-    pangu_t2ms = pangu_t2ms - 273.15
-
-    ec_u10s = np.array(ec_u10s)
-    ec_v10s = np.array(ec_v10s)
-    ec_t2ms = np.array(ec_t2ms)
-    ec_ws10s, ec_wd10s = uv_to_wind_speed_direction(ec_u10s, ec_v10s)
-    ec_t2ms = ec_t2ms - 273.15
-
-    gfs_u10s = np.array(gfs_u10s)
-    gfs_v10s = np.array(gfs_v10s)
-    gfs_t2ms = np.array(gfs_t2ms)
-    gfs_ws10s, gfs_wd10s = uv_to_wind_speed_direction(gfs_u10s, gfs_v10s)
-    gfs_t2ms = gfs_t2ms - 273.15
-
-    df = pd.DataFrame(
-        {
-            "pangu_temperature": pangu_t2ms,
-            "pangu_wind_speed": pangu_ws10s,
-            "pangu_wind_direction": pangu_wd10s,
-            "ec_temperature": ec_t2ms,
-            "ec_wind_speed": ec_ws10s,
-            "ec_wind_direction": ec_wd10s,
-            "gfs_temperature": gfs_t2ms,
-            "gfs_wind_speed": gfs_ws10s,
-            "gfs_wind_direction": gfs_wd10s,
-            "sid": sids,
-        }
-    )
+    # 缺少的对比预报（例如回算时没有存档）传入 None，不生成对应的列
+    sources = {
+        "pangu": (pangu_surf_fp, PANGU_SURFACE_CHANNELS),
+        "ec": (ecmwf_surf_fp, SURFACE_CHANNELS),
+        "gfs": (gfs_surf_fp, SURFACE_CHANNELS),
+    }
+    sources = {model: source for model, source in sources.items() if source[0]}
+    sids, values = extract_station_values(sources)
+
+    columns = {}
+    for model, variables in values.items():
+        wind_speed, wind_direction = uv_to_wind_speed_direction(
+            variables["u10"], variables["v10"]
+        )
+        columns[f"{model}_temperature"] = variables["t2m"] - 273.15
+        columns[f"{model}_wind_speed"] = wind_speed
+        columns[f"{model}_wind_direction"] = wind_direction
+    columns["sid"] = sids
+
+    df = pd.DataFrame(columns)
 
     return df
 
@@ -203,22 +180,11 @@ def sinlge_verify(df, init_dt, obs_dt, prefix="pangu"):
     return result
 
 
-def verify(
-    pangu_surface_fp,
-    ec_surface_fp,
-    gfs_surface_fp,
-    era5_dt,
-    obs_dt,
-    ecmwf_batch_dt,
-    gfs_batch_dt,
-    obs_count,
-    forward_records,
-):
-    print("Verifying...")
+def compare_with_observation(pangu_surface_fp, ec_surface_fp, gfs_surface_fp, obs_fp=None):
     df_predict = extract_station_forecast_data(
         pangu_surface_fp, ec_surface_fp, gfs_surface_fp
     )
-    df_obs = get_observation()
+    df_obs = get_observation(obs_fp)
 
     df_predict["sid"] = df_predict["sid"].astype(int)
     df_obs["sid"] = df_obs["sid"].astype(int)
@@ -231,23 +197,43 @@ def verify(
         how="inner",
     )
 
-    df = df[
-        [
-            "sid",
-            "temperature",
-            "pangu_temperature",
-            "ec_temperature",
-            "gfs_temperature",
-            "wind_speed",
-            "pangu_wind_speed",
-            "ec_wind_speed",
-            "gfs_wind_speed",
-            "wind_direction",
-            "pangu_wind_direction",
-            "ec_wind_direction",
-            "gfs_wind_direction",
-        ]
+    columns = [
+        "sid",
+        "temperature",
+        "pangu_temperature",
+        "ec_temperature",
+        "gfs_temperature",
+        "wind_speed",
+        "pangu_wind_speed",
+        "ec_wind_speed",
+        "gfs_wind_speed",
+        "wind_direction",
+        "pangu_wind_direction",
+        "ec_wind_direction",
+        "gfs_wind_direction",
     ]
+    df = df[[column for column in columns if column in df.columns]]
+
+    return df
+
+
+@traced("verify")
+def verify(
+    pangu_surface_fp,
+    ec_surface_fp,
+    gfs_surface_fp,
+    era5_dt,
+    obs_dt,
+    ecmwf_batch_dt,
+    gfs_batch_dt,
+    obs_count,
+    forward_records,
+    ctx=DEFAULT_CONTEXT,
+):
+    print("Verifying...")
+    df = compare_with_observation(
+        pangu_surface_fp, ec_surface_fp, gfs_surface_fp, ctx.path("obervation.csv")
+    )
 
     dtstr = datetime.now(tz=timezone.utc).astimezone(timezone.utc).strftime("%Y%m%d%HZ")
     obs_dtstr = obs_dt.astimezone(timezone.utc).strftime("%Y%m%d%HZ")
@@ -256,8 +242,13 @@ def verify(
 
     pangu_result = sinlge_verify(df, era5_dt, obs_dt, "pangu")
     pangu_result.update({"forward_records": forward_records})
-    ec_result = sinlge_verify(df, ecmwf_batch_dt, obs_dt, "ec")
-    gfs_result = sinlge_verify(df, gfs_batch_dt, obs_dt, "gfs")
+    # 被放弃的对比模式记为 null
+    ec_result, gfs_result = [
+        sinlge_verify(df, batch_dt, obs_dt, prefix)
+        if f"{prefix}_temperature" in df.columns
+        else None
+        for prefix, batch_dt in (("ec", ecmwf_batch_dt), ("gfs", gfs_batch_dt))
+    ]
 
     result = {
         "pangu": pangu_result,
@@ -267,7 +258,8 @@ def verify(
         "observation_count": obs_count,
     }
 
-    with open(f"./results/verification-results-{obs_dtstr}-at-{dtstr}.json", "w") as f:
+    result_fp = f"./results/verification-results-{obs_dtstr}-at-{dtstr}.json"
+    with open(result_fp, "w") as f:
         json.dump(
             result,
             f,
@@ -275,6 +267,78 @@ def verify(
         )
     print("All done.")
 
+    return result_fp
+
+
+def verify_lead_cases(era5_dt, lead_cases):
+    """
+    Metrics of one Pangu rollout at several leads, as one table by lead.
+
+    Each item of ``lead_cases`` is a dict with ``lead``, ``obs_dt``,
+    ``obs_fp``, ``obs_count``, ``pangu_surface_fp``, ``ec_surface_fp``,
+    ``gfs_surface_fp``, ``ecmwf_batch_dt``, ``gfs_batch_dt`` and
+    ``forward_records``. A competitor whose surface file is ``None`` is left
+    out of that lead. The table has one row per lead and model, with the
+    metrics of ``sinlge_verify`` as flattened columns; it is empty, with the
+    same index, when there is no case.
+    """
+    rows = []
+    for case in sorted(lead_cases, key=lambda case: case["lead"]):
+        df = compare_with_observation(
+            case["pangu_surface_fp"],
+            case["ec_surface_fp"],
+            case["gfs_surface_fp"],
+            case["obs_fp"],
+        )
+        init_dts = {
+            "pangu": era5_dt,
+            "ecmwf": case["ecmwf_batch_dt"],
+            "gfs": case["gfs_batch_dt"],
+        }
+        for model, prefix in (("pangu", "pangu"), ("ecmwf", "ec"), ("gfs", "gfs")):
+            if f"{prefix}_temperature" not in df.columns:
+                continue
+            result = sinlge_verify(df, init_dts[model], case["obs_dt"], prefix)
+            row = {
+                "lead": case["lead"],
+                "model": model,
+                "observation_datetime": case["obs_dt"].isoformat(),
+                "observation_count": case["obs_count"],
+                "forward_records": (
+                    "-".join(str(step) for step in case["forward_records"])
+                    if model == "pangu"
+                    else None
+                ),
+            }
+            row.update(pd.json_normalize(result, sep="_").iloc[0].to_dict())
+            rows.append(row)
+
+    if not rows:
+        return pd.DataFrame(columns=["lead", "model"]).set_index(["lead", "model"])
+
+    return pd.DataFrame(rows).set_index(["lead", "model"])
+
+
+def verify_leads(era5_dt, lead_cases):
+    """
+    Verify one Pangu rollout at several leads and write one table by lead.
+
+    See ``verify_lead_cases`` for ``lead_cases`` and the table, which is
+    saved as ``verification-leads-*.csv`` and ``.json`` under ``./results``.
+    """
+    print("Verifying...")
+    df_leads = verify_lead_cases(era5_dt, lead_cases)
+
+    dtstr = datetime.now(tz=timezone.utc).strftime("%Y%m%d%HZ")
+    era5_dtstr = era5_dt.astimezone(timezone.utc).strftime("%Y%m%d%HZ")
+    os.makedirs("./results", exist_ok=True)
+    savefp = f"./results/verification-leads-{era5_dtstr}-at-{dtstr}"
+    df_leads.to_csv(f"{savefp}.csv")
+    df_leads.reset_index().to_json(f"{savefp}.json", orient="records", indent=4)
+    print("All done.")
+
+    return df_leads
+
 
 if __name__ == "__main__":
     pass
@@ -1,11 +1,118 @@
+import os
+import time
+import fcntl
+import threading
 from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
 from apscheduler.schedulers.blocking import BlockingScheduler
 
 from pwv.main import main
+from pwv.predict import SESSION_POOL
+from pwv.prepare import get_expected_obs_dt
+
+LOCK_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "pwv", "locks")
+INTERVAL_HOURS = 1
+# 每一轮从开始算起的截止时间（秒），到时仍未完成的 GFS 对比会被放弃
+CYCLE_DEADLINE = int(os.environ.get("PWV_CYCLE_DEADLINE", 45 * 60))
+# 工作进程启动时预先加载的模型
+WARM_STEP_MODES = (24, 6, 3, 1)
+
+
+def warm_up():
+    for step_mode in WARM_STEP_MODES:
+        try:
+            SESSION_POOL.get(step_mode)
+        except Exception as e:
+            print(f"Failed to preload the {step_mode}h model: {e!r}")
+
+
+def remove_stale_locks(max_age=24 * 3600):
+    # 只删除很久以前的锁文件，正在使用的锁不会被删除
+    for fn in os.listdir(LOCK_DIR):
+        fp = os.path.join(LOCK_DIR, fn)
+        if time.time() - os.path.getmtime(fp) > max_age:
+            os.remove(fp)
+
+
+def run_locked_cycle(deadline=None):
+    """
+    Run one cycle of ``pwv.main.main`` unless another process is already
+    verifying the same observation hour, in which case it is skipped.
+    """
+    os.makedirs(LOCK_DIR, exist_ok=True)
+    remove_stale_locks()
+    obs_dtstr = get_expected_obs_dt().strftime("%Y%m%d%HZ")
+    with open(os.path.join(LOCK_DIR, f"cycle-{obs_dtstr}.lock"), "w") as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            print(f"Another cycle is verifying {obs_dtstr}, skipped.")
+            return None
+
+        return main(deadline=deadline)
+
+
+class CycleRunner:
+    """
+    Runs the cycles one at a time in a single warm worker process.
+
+    The worker keeps its model sessions loaded between cycles. A cycle
+    triggered while the previous one is still running is not started next to
+    it: one catch-up cycle runs right after the running one ends, however
+    many triggers were missed meanwhile. A worker that died, e.g. killed for
+    running out of memory, is started again on the next cycle.
+    """
+
+    def __init__(self, deadline=CYCLE_DEADLINE) -> None:
+        self.deadline = deadline
+        self.executor = None
+        self.lock = threading.Lock()
+        self.busy = False
+        self.missed = False
+
+    def run_once(self):
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(max_workers=1, initializer=warm_up)
+        try:
+            return self.executor.submit(run_locked_cycle, self.deadline).result()
+        except BrokenProcessPool:
+            self.executor = None
+            raise
+
+    def trigger(self):
+        with self.lock:
+            if self.busy:
+                self.missed = True
+                print("The previous cycle is still running, a catch-up cycle is queued.")
+                return
+            self.busy = True
+
+        try:
+            while True:
+                self.run_once()
+                with self.lock:
+                    if not self.missed:
+                        break
+                    self.missed = False
+        finally:
+            with self.lock:
+                self.busy = False
+                self.missed = False
+
 
 if __name__ == "__main__":
+    runner = CycleRunner()
     scheduler = BlockingScheduler()
-    job = scheduler.add_job(main, "interval", hours=1)
-    for job in scheduler.get_jobs():
-        job.modify(next_run_time=datetime.now())
+    # 第二个实例只会记下错过的一轮然后返回，真正的运行由 CycleRunner 串行执行
+    scheduler.add_job(
+        runner.trigger,
+        "interval",
+        hours=INTERVAL_HOURS,
+        max_instances=2,
+        coalesce=True,
+        misfire_grace_time=INTERVAL_HOURS * 3600,
+        next_run_time=datetime.now(),
+    )
     scheduler.start()
@@ -0,0 +1,154 @@
+import json
+from datetime import datetime, timezone
+
+import netCDF4 as nc
+import numpy as np
+import pytest
+
+from pwv import era5
+from pwv.prepare import transfer_era5
+
+GRID_SHAPE = (2, 3)
+
+
+class FakeCDSClient:
+    """
+    Offline CDS client writing one NetCDF file per request, in the new CDS
+    layout, with every requested day and hour. Surface variable ``i`` holds
+    ``time_index * 10 + i`` and upper-air fields ``time_index * 100 + level
+    index``, so a read slice tells which time and level it came from.
+    """
+
+    def __init__(self) -> None:
+        self.requests = []
+
+    def retrieve(self, name, request, target):
+        self.requests.append((name, request))
+        year, month = int(request["year"]), int(request["month"])
+        dts = [
+            datetime(year, month, int(day), int(time[:2]), tzinfo=timezone.utc)
+            for day in request["day"]
+            for time in request["time"]
+        ]
+        levels = [int(level) for level in request.get("pressure_level", [])]
+        with nc.Dataset(target, "w") as ds:
+            ds.createDimension("valid_time", len(dts))
+            ds.createDimension("latitude", GRID_SHAPE[0])
+            ds.createDimension("longitude", GRID_SHAPE[1])
+            dims = ("valid_time", "latitude", "longitude")
+            if levels:
+                ds.createDimension("pressure_level", len(levels))
+                ds.createVariable("pressure_level", "i4", ("pressure_level",))[:] = levels
+                dims = ("valid_time", "pressure_level", "latitude", "longitude")
+            time_var = ds.createVariable("valid_time", "i8", ("valid_time",))
+            time_var.units = "seconds since 1970-01-01"
+            time_var[:] = [int(dt.timestamp()) for dt in dts]
+            for i, varname in enumerate(era5.VARIABLES[name].values()):
+                shape = tuple(len(ds.dimensions[dim]) for dim in dims)
+                values = np.zeros(shape, dtype=np.float32)
+                for time_index in range(len(dts)):
+                    if levels:
+                        values[time_index] = time_index * 100 + np.arange(len(levels))[
+                            :, None, None
+                        ]
+                    else:
+                        values[time_index] = time_index * 10 + i
+                ds.createVariable(varname, "f4", dims)[:] = values
+
+
+@pytest.fixture
+def client():
+    return FakeCDSClient()
+
+
+def test_make_requests_batches_by_month(client):
+    dts = [
+        datetime(2023, 7, 30, 0, tzinfo=timezone.utc),
+        datetime(2023, 8, 1, 12, tzinfo=timezone.utc),
+        datetime(2023, 7, 31, 12, tzinfo=timezone.utc),
+        datetime(2023, 8, 2, 0, tzinfo=timezone.utc),
+    ]
+    cds = era5.ERA5(client=client)
+
+    surface_requests = cds.make_requests(era5.SURFACE_DATASET, dts)
+    upper_requests = cds.make_requests(era5.UPPER_DATASET, dts)
+
+    assert [(r["year"], r["month"]) for r in surface_requests] == [("2023", "07"), ("2023", "08")]
+    assert surface_requests[0]["day"] == ["30", "31"]
+    assert surface_requests[0]["time"] == ["00:00", "12:00"]
+    assert surface_requests[1]["day"] == ["01", "02"]
+    assert "pressure_level" not in surface_requests[0]
+    assert upper_requests[0]["pressure_level"] == [str(level) for level in era5.PRESSURE_LEVELS]
+
+
+def test_retrieve_reuses_archive(client, tmp_path):
+    dts = [datetime(2023, 7, day, 0, tzinfo=timezone.utc) for day in (10, 11, 12)]
+    cds = era5.ERA5(client=client, archive_dir=str(tmp_path))
+
+    cds.retrieve(era5.SURFACE_DATASET, dts)
+    assert len(client.requests) == 1
+
+    # 已归档的时次不再请求，新的实例也从 index.json 中找到它们
+    for dt in dts:
+        assert cds.fetch_surface(dt) is not None
+    era5.ERA5(client=client, archive_dir=str(tmp_path)).retrieve(era5.SURFACE_DATASET, dts)
+    assert len(client.requests) == 1
+
+    with open(tmp_path / era5.INDEX_FN) as f:
+        index = json.load(f)
+    (meta,) = index[era5.SURFACE_DATASET].values()
+    assert len(meta["times"]) == 3
+
+    # 只请求缺少的时次
+    cds.retrieve(era5.SURFACE_DATASET, dts + [datetime(2023, 7, 13, 0, tzinfo=timezone.utc)])
+    assert len(client.requests) == 2
+    assert client.requests[-1][1]["day"] == ["13"]
+
+
+def test_retrieve_without_client(client, tmp_path):
+    dt = datetime(2023, 7, 10, 0, tzinfo=timezone.utc)
+    era5.ERA5(client=client, archive_dir=str(tmp_path)).retrieve(era5.SURFACE_DATASET, [dt])
+    offline = era5.ERA5(archive_dir=str(tmp_path))
+
+    assert offline.fetch_surface(dt) is not None
+    with pytest.raises(FileNotFoundError):
+        offline.fetch_surface(datetime(2023, 7, 11, 0, tzinfo=timezone.utc))
+
+
+def test_locate_for_transfer(client, tmp_path):
+    dts = [datetime(2023, 7, 10, hour, tzinfo=timezone.utc) for hour in (0, 6, 12)]
+    cds = era5.ERA5(client=client, archive_dir=str(tmp_path / "archive"))
+    cds.retrieve(era5.SURFACE_DATASET, dts)
+    cds.retrieve(era5.UPPER_DATASET, dts)
+
+    surface_loc = cds.archive.locate(era5.SURFACE_DATASET, dts[1])
+    upper_loc = cds.archive.locate(era5.UPPER_DATASET, dts[1])
+    assert surface_loc[1] == upper_loc[1] == 1
+    assert cds.archive.locate(era5.SURFACE_DATASET, datetime(2023, 7, 10, 18)) is None
+
+    surface_fp, upper_fp = transfer_era5(surface_loc, upper_loc, dts[1], str(tmp_path / "run"))
+
+    assert surface_fp.endswith(f"surface-{int(dts[1].timestamp())}.npy")
+    surface = np.load(surface_fp)
+    upper = np.load(upper_fp)
+    # 盘古的变量顺序为 msl, u10, v10, t2m，请求中依次为 u10, v10, t2m, msl
+    np.testing.assert_array_equal(surface[:, 0, 0], [13, 10, 11, 12])
+    # 垂直方向反转
+    np.testing.assert_array_equal(upper[0, :, 0, 0], 100 + np.arange(13)[::-1])
+
+
+def test_api_key_loaded_on_miss(client, tmp_path):
+    dt = datetime(2023, 7, 10, 0, tzinfo=timezone.utc)
+    era5.ERA5(client=client, archive_dir=str(tmp_path)).retrieve(era5.SURFACE_DATASET, [dt])
+    calls = []
+
+    def load_api_key():
+        calls.append(dt)
+        raise FileNotFoundError("secret.toml")
+
+    cds = era5.ERA5(load_api_key, archive_dir=str(tmp_path))
+    assert cds.fetch_surface(dt) is not None
+    assert calls == []
+    with pytest.raises(FileNotFoundError):
+        cds.fetch_surface(datetime(2023, 7, 11, 0, tzinfo=timezone.utc))
+    assert len(calls) == 1
@@ -0,0 +1,18 @@
+import argparse
+
+import pytest
+
+from pwv.optimize import check_variant, parse_max_rmse
+
+
+def test_parse_max_rmse():
+    assert parse_max_rmse("t2m=0.5") == ("t2m", 0.5)
+    for text in ("t2m", "t2m=fast", "tp=0.5"):
+        with pytest.raises(argparse.ArgumentTypeError):
+            parse_max_rmse(text)
+
+
+def test_check_variant_rejects_unknown_variables():
+    # 在运行模型之前就报错
+    with pytest.raises(ValueError):
+        check_variant(24, "int8", "surface.npy", "upper.npy", max_rmse={"tp": 0.5})
@@ -0,0 +1,48 @@
+import pytest
+
+from pwv import plan
+
+
+@pytest.fixture
+def latency_fp(tmp_path, monkeypatch):
+    fp = tmp_path / "step_latency.json"
+    monkeypatch.setattr(plan, "LATENCY_FP", str(fp))
+    monkeypatch.setattr(plan, "STEP_LATENCY", {})
+    monkeypatch.setattr(plan, "LATENCY_LOADED", False)
+
+    return fp
+
+
+def test_plan_leads_shares_prefix():
+    costs = {step: 1.0 for step in plan.STEP_MODES}
+
+    result = plan.plan_leads([50, 53, 0], costs)
+
+    # 53h 从 50h 的状态继续，而不是从 48h 另起一支
+    assert result["paths"] == {0: (), 50: (24, 24, 1, 1), 53: (24, 24, 1, 1, 3)}
+    assert result["calls"] == [(24,), (24, 24), (24, 24, 1), (24, 24, 1, 1), (24, 24, 1, 1, 3)]
+    assert result["cost"] == 5.0
+
+
+def test_latency_persists(latency_fp, monkeypatch):
+    plan.record_latency(24, 4.0)
+    plan.record_latency(6, 1.0)
+    assert latency_fp.exists()
+
+    # 新的进程从保存的文件中读取
+    monkeypatch.setattr(plan, "STEP_LATENCY", {})
+    monkeypatch.setattr(plan, "LATENCY_LOADED", False)
+    costs = plan.get_step_costs()
+
+    assert costs[24] == 4.0
+    assert costs[6] == 1.0
+    assert costs[1] == 2.5
+
+    plan.record_latency(24, 2.0, alpha=0.5)
+    assert plan.STEP_LATENCY[24] == 3.0
+
+
+def test_latency_ignores_bad_file(latency_fp):
+    latency_fp.write_text("not json")
+
+    assert plan.get_step_costs() == {step: 1.0 for step in plan.STEP_MODES}
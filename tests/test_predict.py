@@ -0,0 +1,88 @@
+import numpy as np
+import pytest
+
+from benchmarks.fixtures import make_onnx_model
+from pwv import models, plan, predict
+
+SURFACE_SHAPE = (4, 3, 4)
+UPPER_SHAPE = (5, 13, 3, 4)
+
+
+@pytest.fixture
+def model_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(models, "STATIC_DIR", str(tmp_path))
+    monkeypatch.setattr(plan, "LATENCY_FP", str(tmp_path / "step_latency.json"))
+    predict.SESSION_POOL.clear()
+    yield tmp_path
+    predict.SESSION_POOL.clear()
+
+
+def make_model(model_dir, step_mode, batch):
+    make_onnx_model(
+        str(model_dir / f"pangu_weather_{step_mode}.onnx"),
+        step_mode,
+        batch=batch,
+        surface_shape=SURFACE_SHAPE,
+        upper_shape=UPPER_SHAPE,
+    )
+
+
+def make_states(n_members):
+    surface_arrays = [np.full(SURFACE_SHAPE, i, dtype=np.float32) for i in range(n_members)]
+    upper_arrays = [np.full(UPPER_SHAPE, i, dtype=np.float32) for i in range(n_members)]
+
+    return surface_arrays, upper_arrays
+
+
+@pytest.mark.parametrize("batch", [None, "N", 2])
+@pytest.mark.parametrize("n_members", [1, 3])
+def test_predict_batch(model_dir, batch, n_members):
+    make_model(model_dir, 6, batch)
+    surface_arrays, upper_arrays = make_states(n_members)
+
+    outputs = predict.predict_batch(surface_arrays, upper_arrays, step_mode=6)
+
+    assert len(outputs) == n_members
+    for i, (surface_array, upper_array) in enumerate(outputs):
+        assert surface_array.shape == SURFACE_SHAPE
+        assert upper_array.shape == UPPER_SHAPE
+        np.testing.assert_allclose(surface_array, i + 6e-3, rtol=1e-6)
+        np.testing.assert_allclose(upper_array, i + 6e-3, rtol=1e-6)
+
+
+def test_iteratively_predict_on_batch_model(model_dir, tmp_path):
+    make_model(model_dir, 6, "N")
+    workdir = tmp_path / "run"
+    workdir.mkdir()
+    init_ts = 1689033600
+    np.save(workdir / f"surface-{init_ts}.npy", np.zeros(SURFACE_SHAPE, dtype=np.float32))
+    np.save(workdir / f"upper-{init_ts}.npy", np.zeros(UPPER_SHAPE, dtype=np.float32))
+
+    result = predict.iteratively_predict(
+        init_ts, init_ts + 12 * 3600, cache=None, workdir=str(workdir)
+    )
+
+    assert result["forward_records"] == [6, 6]
+    np.testing.assert_allclose(np.load(result["surface_fp"]), 12e-3, rtol=1e-5)
+
+
+def test_predict_ignores_stale_output(model_dir, tmp_path):
+    make_model(model_dir, 6, None)
+    workdir = tmp_path / "run"
+    workdir.mkdir()
+    init_ts = 1689033600
+    surface_fp = workdir / f"surface-{init_ts}.npy"
+    upper_fp = workdir / f"upper-{init_ts}.npy"
+    np.save(surface_fp, np.zeros(SURFACE_SHAPE, dtype=np.float32))
+    np.save(upper_fp, np.zeros(UPPER_SHAPE, dtype=np.float32))
+    # 同名、同形状但来自别的路径的旧输出
+    target_ts = init_ts + 6 * 3600
+    np.save(workdir / f"surface-{target_ts}.npy", np.full(SURFACE_SHAPE, 9, dtype=np.float32))
+    np.save(workdir / f"upper-{target_ts}.npy", np.full(UPPER_SHAPE, 9, dtype=np.float32))
+
+    output_surface_fp, output_upper_fp = predict.predict(
+        str(surface_fp), str(upper_fp), step_mode=6
+    )
+
+    np.testing.assert_allclose(np.load(output_surface_fp), 6e-3, rtol=1e-6)
+    np.testing.assert_allclose(np.load(output_upper_fp), 6e-3, rtol=1e-6)